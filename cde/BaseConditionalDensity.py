@@ -1,6 +1,8 @@
 from sklearn.base import BaseEstimator
 
-from cde.utils.integration import mc_integration_student_t, numeric_integation
+from cde.utils.integration import mc_integration_student_t, student_t_proposal_chunks, adaptive_gauss_kronrod, \
+  merge_chunk_statistics
+from cde.utils.distribution import multidim_t_pdf, multidim_t_rvs
 from cde.utils.center_point_select import *
 import scipy.stats as stats
 import matplotlib as mpl
@@ -10,18 +12,29 @@ from matplotlib import cm
 
 
 import scipy
-from cde.utils.optimizers import find_root_newton_method, find_root_by_bounding
+import scipy.integrate as integrate
+from cde.utils.optimizers import find_root_bracketed
 
 """ Default Numerical Integration Standards"""
-N_SAMPLES_INT = 10**5
-N_SAMPLES_INT_TIGHT_BOUNDS = 10**4
+N_SUBINTERVALS_INT = 10**3
+N_SUBINTERVALS_INT_TIGHT_BOUNDS = 16
 LOWER_BOUND = - 10 ** 3
 UPPER_BOUND = 10 ** 3
+RTOL_INT = 1e-8
+ATOL_INT = 1e-12
+N_GRID_LOC_SCALE = 256 # pdf evaluations per x_cond and refinement of the grid estimate of the conditional location / scale
+N_GRID_REFINEMENTS = 2
+
+""" Default Batched PDF Evaluation Standards"""
+PDF_BATCH_SIZE = 10 ** 6 # max. number of (x, y) pairs that are passed to a single pdf call
 
 """ Default Monte-Carlo Integration Standards"""
 DOF = 6
 LOC_PROPOSAL = 0
 SCALE_PROPOSAL = 2
+MC_BATCH_SIZE = 10 ** 5 # number of proposal samples per chunk of the streaming monte carlo integration
+MC_STD_ERR_TOL = None # standard error at which the monte carlo integration stops early (None: full sample budget)
+MC_SAMPLING = 'mc' # proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
 class ConditionalDensity(BaseEstimator):
 
@@ -42,20 +55,18 @@ class ConditionalDensity(BaseEstimator):
       means[i, :] = np.mean(samples, axis=0)
     return means
 
-  def _mean_pdf(self, x_cond, n_samples=10 ** 6):
+  def _mean_pdf(self, x_cond, n_samples=10 ** 6, std_err_tol=MC_STD_ERR_TOL, sampling=MC_SAMPLING):
+    if self.ndim_y == 1:
+      means = self._adaptive_integral(x_cond, lambda y, idx: y)
+      return means.reshape((x_cond.shape[0], self.ndim_y))
+
     means = np.zeros((x_cond.shape[0], self.ndim_y))
     for i in range(x_cond.shape[0]):
-      mean_fun = lambda y: y
-      if self.ndim_y == 1:
-        n_samples_int, lower, upper = self._determine_integration_bounds()
-        func_to_integrate = lambda y:  mean_fun(y) * np.squeeze(self._tiled_pdf(y, x_cond[i], n_samples_int))
-        integral = numeric_integation(func_to_integrate, n_samples_int, lower, upper)
-      else:
-        loc_proposal, scale_proposal = self._determine_mc_proposal_dist()
-        func_to_integrate = lambda y: mean_fun(y) * self._tiled_pdf(y, x_cond[i], n_samples)
-        integral = mc_integration_student_t(func_to_integrate, ndim=self.ndim_y, n_samples=n_samples,
-                                            loc_proposal=loc_proposal, scale_proposal=scale_proposal)
-      means[i] = integral
+      loc_proposal, scale_proposal = self._determine_mc_proposal_dist()
+      func_to_integrate = lambda y: y * self._tiled_pdf(y, x_cond[i], y.shape[0])
+      means[i] = mc_integration_student_t(func_to_integrate, ndim=self.ndim_y, n_samples=n_samples,
+                                          batch_size=MC_BATCH_SIZE, loc_proposal=loc_proposal,
+                                          scale_proposal=scale_proposal, std_err_tol=std_err_tol, sampling=sampling)
     return means
 
   """ STANDARD DEVIATION """
@@ -68,12 +79,9 @@ class ConditionalDensity(BaseEstimator):
       mean = self.mean_(x_cond, n_samples=n_samples)
 
     if self.ndim_y == 1: # compute with numerical integration
-      stds = np.zeros((x_cond.shape[0], self.ndim_y))
-      for i in range(x_cond.shape[0]):
-        mu = np.squeeze(mean[i])
-        n_samples_int, lower, upper = self._determine_integration_bounds()
-        func_to_integrate = lambda y: (y-mu)**2 * np.squeeze(self._tiled_pdf(y, x_cond[i], n_samples_int))
-        stds[i] = np.sqrt(numeric_integation(func_to_integrate, n_samples_int, lower, upper))
+      mu = mean.reshape((x_cond.shape[0], 1))
+      variances = self._adaptive_integral(x_cond, lambda y, idx: (y - mu[idx])**2)
+      stds = np.sqrt(variances).reshape((x_cond.shape[0], self.ndim_y))
     else: # call covariance and return sqrt of diagonal
       covs = self.covariance(x_cond, n_samples=n_samples)
       stds = np.sqrt(np.diagonal(covs, axis1=1, axis2=2))
@@ -97,7 +105,7 @@ class ConditionalDensity(BaseEstimator):
 
   """ COVARIANCE """
 
-  def _covariance_pdf(self, x_cond, n_samples=10 ** 6, mean=None):
+  def _covariance_pdf(self, x_cond, n_samples=10 ** 6, mean=None, std_err_tol=MC_STD_ERR_TOL, sampling=MC_SAMPLING):
     assert hasattr(self, "mean_")
     assert hasattr(self, "pdf")
     assert mean is None or mean.shape == (x_cond.shape[0], self.ndim_y)
@@ -107,26 +115,30 @@ class ConditionalDensity(BaseEstimator):
     if mean is None:
       mean = self.mean_(x_cond, n_samples=n_samples)
 
-    covs = np.zeros((x_cond.shape[0], self.ndim_y, self.ndim_y))
-    for i in range(x_cond.shape[0]):
-      x = x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
-
-      def cov(y):
-        a = (y - mean[i])
-
-        # compute cov matrices c for sampled instances and weight them with the probability p from the pdf
-        c = np.empty((a.shape[0], a.shape[1] ** 2))
-        for j in range(a.shape[0]):
-          c[j, :] = np.reshape(np.outer(a[j], a[j]), (a.shape[1] ** 2,))
-
-        p = np.tile(np.expand_dims(self.pdf(x, y), axis=1), (1, self.ndim_y ** 2))
-        res = c * p
-        return res
-
-      integral = mc_integration_student_t(cov, ndim=self.ndim_y, n_samples=n_samples,
-                                          loc_proposal=loc_proposal, scale_proposal=scale_proposal)
-      covs[i] = integral.reshape((self.ndim_y, self.ndim_y))
-    return covs
+    # importance weighted outer products a a^T with a = y - mean, accumulated chunk-wise for all x_cond. Without
+    # std_err_tol, only their sums are needed, which are computed with batched matrix products -> the per-sample outer
+    # products of shape (n_samples, ndim_y ** 2) are never materialized. With std_err_tol, the running mean and sum of
+    # squared deviations of the per-sample outer products are merged chunk by chunk (Welford / Chan et al.).
+    cov, m2 = np.zeros((2, x_cond.shape[0], self.ndim_y, self.ndim_y))
+    n = 0
+    for y_samples, q in student_t_proposal_chunks(self.ndim_y, n_samples=n_samples, batch_size=MC_BATCH_SIZE,
+                                                  loc_proposal=loc_proposal, scale_proposal=scale_proposal, dof=DOF,
+                                                  sampling=sampling):
+      for idx, _, p in self._batched_pdf(x_cond, y_samples):
+        a = y_samples[None, :, :] - mean[idx][:, None, :]
+        w = (p / q)[:, :, None]
+        if std_err_tol is None:
+          cov[idx] += np.matmul(np.swapaxes(a * w, 1, 2), a)
+        else:
+          values = (a * w)[:, :, :, None] * a[:, :, None, :]
+          cov[idx], m2[idx] = merge_chunk_statistics(n, cov[idx], m2[idx], values, axis=1)
+      n += y_samples.shape[0]
+
+      if std_err_tol is not None and n > 1:
+        if np.all(np.sqrt(m2 / (n - 1) / n) <= std_err_tol):
+          break
+
+    return cov / n if std_err_tol is None else cov
 
   def _covariance_mc(self, x_cond, n_samples=10 ** 6):
     if hasattr(self, 'sample'):
@@ -158,15 +170,8 @@ class ConditionalDensity(BaseEstimator):
     if std is None:
       std = np.reshape(np.sqrt(self.covariance(x_cond, n_samples=n_samples)), (x_cond.shape[0],))
 
-    skewness = np.empty(shape=(x_cond.shape[0],))
-    n_samples_int, lower, upper = self._determine_integration_bounds()
-
-    for i in range(x_cond.shape[0]):
-      mu = np.squeeze(mean[i])
-      sigm = np.squeeze(std[i])
-      func_skew = lambda y: ((y - mu) / sigm)**3 * np.squeeze(self._tiled_pdf(y, x_cond[i], n_samples_int))
-      skewness[i] = numeric_integation(func_skew, n_samples=n_samples_int)
-
+    mu, sigm = mean.reshape((x_cond.shape[0], 1)), std.reshape((x_cond.shape[0], 1))
+    skewness = self._adaptive_integral(x_cond, lambda y, idx: ((y - mu[idx]) / sigm[idx])**3)
     return skewness
 
   def _skewness_mc(self, x_cond, n_samples=10 ** 6):
@@ -198,15 +203,8 @@ class ConditionalDensity(BaseEstimator):
     if std is None:
       std = np.reshape(np.sqrt(self.covariance(x_cond, n_samples=n_samples)), (x_cond.shape[0],))
 
-    n_samples_int, lower, upper = self._determine_integration_bounds()
-    kurtosis = np.empty(shape=(x_cond.shape[0],))
-
-    for i in range(x_cond.shape[0]):
-      mu = np.squeeze(mean[i])
-      sigm = np.squeeze(std[i])
-      func_skew = lambda y: ((y - mu)**4 / sigm**4) * np.squeeze(self._tiled_pdf(y, x_cond[i], n_samples_int))
-      kurtosis[i] = numeric_integation(func_skew, n_samples=n_samples_int)
-
+    mu, sigm = mean.reshape((x_cond.shape[0], 1)), std.reshape((x_cond.shape[0], 1))
+    kurtosis = self._adaptive_integral(x_cond, lambda y, idx: (y - mu[idx])**4 / sigm[idx]**4)
     return kurtosis - 3 # excess kurtosis
 
   def _kurtosis_mc(self, x_cond, n_samples=10 ** 6):
@@ -225,9 +223,133 @@ class ConditionalDensity(BaseEstimator):
       kurtosis[i] = scipy.stats.kurtosis(y_sample)
     return kurtosis
 
+  """ MOMENTS & EXPECTATIONS (SINGLE PASS) """
+
+  def _moments_pdf(self, x_cond, orders=(1, 2, 3, 4), n_samples=10 ** 6):
+    # evaluates the pdf once on the quadrature nodes and reduces all statistics from the same pdf values
+    self._assert_moment_orders(orders)
+    assert hasattr(self, "pdf")
+
+    if self.ndim_y == 1:
+      return self._moments_adaptive(x_cond, orders=orders)
+
+    y_nodes, weights = self._quadrature_rule(n_samples)
+
+    means = np.zeros((x_cond.shape[0], self.ndim_y))
+    covs = np.zeros((x_cond.shape[0], self.ndim_y, self.ndim_y))
+
+    for idx, _, p in self._batched_pdf(x_cond, y_nodes):
+      pw = p * weights
+      pw /= np.sum(pw, axis=1, keepdims=True) # self-normalized weights reduce the variance of the importance sampling estimates
+      means[idx] = pw.dot(y_nodes)
+      centered = y_nodes[None, :, :] - means[idx][:, None, :]
+      covs[idx] = np.matmul(np.swapaxes(centered * pw[:, :, None], 1, 2), centered)
+
+    stds = np.sqrt(np.diagonal(covs, axis1=1, axis2=2))
+    return self._select_moments(orders, means, stds, None, None)
+
+  def _moments_adaptive(self, x_cond, orders=(1, 2, 3, 4)):
+    # integrates the powers (y - c)^k, k = 0, ..., 4 jointly with the adaptive quadrature where c is the center of the
+    # integration bracket of the respective x_cond -> shifting by c avoids cancellation in the central moments
+    lower, upper, _ = self._integration_brackets(x_cond)
+    c = ((lower + upper) / 2).reshape((x_cond.shape[0], 1))
+    powers = self._adaptive_integral(x_cond, lambda y, idx: np.stack([(y - c[idx]) ** k for k in range(5)], axis=-1),
+                                     lower=lower, upper=upper)
+
+    # normalize by the probability mass -> raw moments E[(y - c)^k] around c
+    m1, m2, m3, m4 = [powers[:, k] / powers[:, 0] for k in range(1, 5)]
+
+    means = (c[:, 0] + m1).reshape((x_cond.shape[0], 1))
+    stds = np.sqrt(m2 - m1 ** 2).reshape((x_cond.shape[0], 1))
+    central_moments_3 = m3 - 3 * m1 * m2 + 2 * m1 ** 3
+    central_moments_4 = m4 - 4 * m1 * m3 + 6 * m1 ** 2 * m2 - 3 * m1 ** 4
+    return self._select_moments(orders, means, stds, central_moments_3, central_moments_4)
+
+  def _moments_mc(self, x_cond, orders=(1, 2, 3, 4), n_samples=10 ** 6):
+    # draws the samples once per x_cond and reduces all statistics from the same samples
+    if hasattr(self, 'sample'):
+      sample = self.sample
+    elif hasattr(self, 'simulate_conditional'):
+      sample = self.simulate_conditional
+    else:
+      raise AssertionError("Requires sample or simulate_conditional method")
+    self._assert_moment_orders(orders)
+
+    means = np.zeros((x_cond.shape[0], self.ndim_y))
+    stds = np.zeros((x_cond.shape[0], self.ndim_y))
+    central_moments_3, central_moments_4 = np.zeros(x_cond.shape[0]), np.zeros(x_cond.shape[0])
+
+    for i in range(x_cond.shape[0]):
+      x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
+      _, samples = sample(x)
+      samples = np.reshape(samples, (n_samples, self.ndim_y))
+
+      means[i] = np.mean(samples, axis=0)
+      centered = samples - means[i]
+      stds[i] = np.sqrt(np.mean(centered ** 2, axis=0))
+      if self.ndim_y == 1:
+        central_moments_3[i] = np.mean(centered ** 3)
+        central_moments_4[i] = np.mean(centered ** 4)
+
+    return self._select_moments(orders, means, stds, central_moments_3, central_moments_4)
+
+  def _expectation_pdf(self, x_cond, func, n_samples=10 ** 6):
+    assert hasattr(self, "pdf")
+
+    if self.ndim_y == 1:
+      def func_nodes(y, idx):
+        f = func(y.reshape((-1, 1)))
+        assert f.shape[0] == y.size, "func must return a numpy array of shape (n_samples,) or (n_samples, ndim_out)"
+        return f.reshape(y.shape + f.shape[1:])
+      return self._adaptive_integral(x_cond, func_nodes)
+
+    y_nodes, weights = self._quadrature_rule(n_samples)
+
+    # func does not depend on x -> it only needs to be evaluated once on the quadrature nodes
+    f = func(y_nodes)
+    assert f.shape[0] == y_nodes.shape[0], "func must return a numpy array of shape (n_samples,) or (n_samples, ndim_out)"
+
+    expectations = np.zeros((x_cond.shape[0],) + f.shape[1:])
+    for idx, _, p in self._batched_pdf(x_cond, y_nodes):
+      expectations[idx] = (p * weights).dot(f)
+    return expectations
+
+  def _expectation_mc(self, x_cond, func, n_samples=10 ** 6):
+    if hasattr(self, 'sample'):
+      sample = self.sample
+    elif hasattr(self, 'simulate_conditional'):
+      sample = self.simulate_conditional
+    else:
+      raise AssertionError("Requires sample or simulate_conditional method")
+
+    expectations = []
+    for i in range(x_cond.shape[0]):
+      x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
+      _, samples = sample(x)
+      f = func(np.reshape(samples, (n_samples, self.ndim_y)))
+      assert f.shape[0] == n_samples, "func must return a numpy array of shape (n_samples,) or (n_samples, ndim_out)"
+      expectations.append(np.mean(f, axis=0))
+    return np.stack(expectations, axis=0)
+
+  def _assert_moment_orders(self, orders):
+    assert len(orders) > 0 and all([order in [1, 2, 3, 4] for order in orders]), "orders must be a subset of (1, 2, 3, 4)"
+    assert self.ndim_y == 1 or all([order <= 2 for order in orders]), \
+      "co-skewness and co-kurtosis are not supported - orders 3 and 4 require ndim_y = 1"
+
+  def _select_moments(self, orders, means, stds, central_moments_3, central_moments_4):
+    moments = {1: means, 2: stds}
+    if self.ndim_y == 1:
+      moments[3] = central_moments_3 / stds[:, 0] ** 3
+      moments[4] = central_moments_4 / stds[:, 0] ** 4 - 3 # excess kurtosis
+    return tuple(moments[order] for order in orders)
+
   """ QUANTILES / VALUE-AT-RISK """
 
   def _quantile_mc(self, x_cond, alpha=0.01, n_samples=10 ** 6):
+    return self._quantiles_mc(x_cond, np.array([alpha]), n_samples=n_samples)[:, 0]
+
+  def _quantiles_mc(self, x_cond, alphas, n_samples=10 ** 6):
+    # draws the samples once per x_cond and reads off all quantile levels from the same samples
     if hasattr(self, 'sample'):
       sample = self.sample
     elif hasattr(self, 'simulate_conditional'):
@@ -236,19 +358,38 @@ class ConditionalDensity(BaseEstimator):
       raise AssertionError("Requires sample or simulate_conditional method")
 
     assert x_cond.ndim == 2
-    VaRs = np.zeros(x_cond.shape[0])
-    x_cond = np.tile(x_cond.reshape((1, x_cond.shape[0], x_cond.shape[1])), (n_samples,1, 1))
-    for i in range(x_cond.shape[1]):
-      _, samples = sample(x_cond[:, i,:])
-      VaRs[i] = np.percentile(samples, alpha * 100.0)
-    return VaRs
-
-  def _quantile_cdf(self, x_cond, alpha=0.01, eps=1e-8, init_bound=1e3):
-    # finds the alpha quantile of the distribution through root finding by bounding
-
-    cdf_fun = lambda y: self.cdf(x_cond, y) - alpha
-    init_bound = init_bound * np.ones(x_cond.shape[0])
-    return find_root_by_bounding(cdf_fun, left=-init_bound, right=init_bound, eps=eps)
+    quantiles = np.zeros((x_cond.shape[0], alphas.shape[0]))
+    for i in range(x_cond.shape[0]):
+      x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
+      _, samples = sample(x)
+      quantiles[i] = np.percentile(samples, alphas * 100.0)
+    return quantiles
+
+  def _quantile_cdf(self, x_cond, alpha=0.01, eps=1e-8):
+    return self._quantiles_cdf(x_cond, np.array([alpha]), eps=eps)[:, 0]
+
+  def _quantiles_cdf(self, x_cond, alphas, eps=1e-8):
+    # solves the cdf(y|x) = alpha problems of all (x_cond, alpha) pairs jointly with a vectorized safeguarded root
+    # finding that is seeded with the brackets loc +/- 10 scale and a gaussian guess from the conditional location / scale
+    assert x_cond.ndim == 2 and alphas.ndim == 1
+    assert np.all(alphas > 0) and np.all(alphas < 1), "quantile levels alpha must be within (0, 1)"
+    n_values, n_alphas = x_cond.shape[0], alphas.shape[0]
+
+    X, A = np.repeat(x_cond, n_alphas, axis=0), np.tile(alphas, n_values)
+    loc, scale = [np.repeat(v, n_alphas) for v in self._quantile_location_scale(x_cond)]
+
+    cdf_fun = lambda y, idx: self.cdf(X[idx], y.reshape((-1, 1))).flatten() - A[idx]
+    quantiles = find_root_bracketed(cdf_fun, left=loc - 10 * scale, right=loc + 10 * scale,
+                                    x0=loc + scale * stats.norm.ppf(A), eps=eps)
+    return quantiles.reshape((n_values, n_alphas))
+
+  def _quantile_location_scale(self, x_cond):
+    # conditional location / scale estimates if available, otherwise the global statistics of y
+    loc_scale = self._conditional_location_scale(x_cond)
+    if loc_scale is None:
+      loc_scale = [np.squeeze(v)[()] for v in self._determine_mc_proposal_dist()]
+    loc, scale = [np.broadcast_to(v, (x_cond.shape[0],)).astype(np.float64) for v in loc_scale]
+    return loc, np.maximum(scale, 1e-8)
 
   """ CONDITONAL VALUE-AT-RISK """
 
@@ -256,18 +397,25 @@ class ConditionalDensity(BaseEstimator):
     assert VaRs.shape[0] == x_cond.shape[0], "same number of x_cond must match the number of values_at_risk provided"
     assert self.ndim_y == 1, 'this function only supports only ndim_y = 1'
     assert x_cond.ndim == 2
-
-    n_samples_int, lower, _ = self._determine_integration_bounds()
-
-    CVaRs = np.zeros(x_cond.shape[0])
-
-    for i in range(x_cond.shape[0]):
-      upper = float(VaRs[i])
-      func_to_integrate = lambda y: y * np.squeeze(self._tiled_pdf(y, x_cond[i], n_samples_int))
-      integral = numeric_integation(func_to_integrate, n_samples_int, lower, upper)
-      CVaRs[i] = integral / alpha
-
-    return CVaRs
+    n_values = x_cond.shape[0]
+    VaRs_2d, alphas = VaRs.reshape((n_values, -1)), np.reshape(alpha, (-1,))
+    assert VaRs_2d.shape[1] == alphas.shape[0], "VaRs must have one column per alpha"
+    n_alphas = alphas.shape[0]
+
+    # the tail integrals of all alphas share one grid: the segments lower -> VaR_(1) -> VaR_(2) -> ... of the sorted
+    # VaRs are integrated jointly in one adaptive quadrature call and then accumulated with a cumulative sum
+    order = np.argsort(VaRs_2d, axis=1)
+    upper = np.take_along_axis(VaRs_2d, order, axis=1)
+    lower, _, _ = self._integration_brackets(x_cond)
+    lower = np.concatenate([np.minimum(lower, upper[:, 0])[:, None], upper[:, :-1]], axis=1)
+
+    segment_integrals = self._adaptive_integral(np.repeat(x_cond, n_alphas, axis=0), lambda y, idx: y,
+                                                lower=lower.flatten(), upper=upper.flatten())
+    tail_integrals = np.zeros((n_values, n_alphas))
+    np.put_along_axis(tail_integrals, order, np.cumsum(segment_integrals.reshape((n_values, n_alphas)), axis=1), axis=1)
+
+    CVaRs = tail_integrals / alphas
+    return CVaRs.reshape(VaRs.shape)
 
   def _conditional_value_at_risk_sampling(self, VaRs, x_cond, n_samples=10 ** 6):
     if hasattr(self, 'sample'):
@@ -277,14 +425,17 @@ class ConditionalDensity(BaseEstimator):
     else:
       raise AssertionError("Requires sample or simulate_conditional method")
 
-    CVaRs = np.zeros(x_cond.shape[0])
-    x_cond = np.tile(x_cond.reshape((1, x_cond.shape[0], x_cond.shape[1])), (n_samples, 1, 1))
-    for i in range(x_cond.shape[1]):
-      _, samples = sample(x_cond[:, i, :])
-      shortfall_samples = np.ma.masked_where(VaRs[i] < samples, samples)
-      CVaRs[i] = np.mean(shortfall_samples)
+    # shortfall means of all VaRs of an x_cond from the cumulative sums of the same sorted samples
+    VaRs_2d = VaRs.reshape((x_cond.shape[0], -1))
+    CVaRs = np.zeros(VaRs_2d.shape)
+    for i in range(x_cond.shape[0]):
+      x = np.tile(x_cond[i].reshape((1, x_cond.shape[1])), (n_samples, 1))
+      _, samples = sample(x)
+      samples = np.sort(samples.flatten())
+      n_shortfall = np.maximum(np.searchsorted(samples, VaRs_2d[i], side='right'), 1)
+      CVaRs[i] = np.cumsum(samples)[n_shortfall - 1] / n_shortfall
 
-    return CVaRs
+    return CVaRs.reshape(VaRs.shape)
 
   """ OTHER HELPERS """
 
@@ -415,9 +566,9 @@ class ConditionalDensity(BaseEstimator):
       lower = self.y_mean - 10 * self.y_std
       upper = self.y_mean + 10 * self.y_std
 
-      return N_SAMPLES_INT_TIGHT_BOUNDS, lower, upper
+      return N_SUBINTERVALS_INT_TIGHT_BOUNDS, lower, upper
     else:
-      return N_SAMPLES_INT, LOWER_BOUND, UPPER_BOUND
+      return N_SUBINTERVALS_INT, LOWER_BOUND, UPPER_BOUND
 
   def _determine_mc_proposal_dist(self):
     if hasattr(self, 'y_std') and hasattr(self, 'y_mean'):
@@ -427,6 +578,154 @@ class ConditionalDensity(BaseEstimator):
     else:
       return np.ones(self.ndim_y) * LOC_PROPOSAL, np.ones(self.ndim_y) * SCALE_PROPOSAL
 
+  def _conditional_location_scale(self, x_cond):
+    """ Cheap estimates of the location and scale of p(y|x) that are used to place the integration brackets.
+    Estimators that know their conditional mean and standard deviation in closed form should override this method.
+
+    Args:
+      x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
+
+    Returns:
+      (loc, scale) - numpy arrays of shape (n_values,) or None if no estimates are available
+    """
+    return None
+
+  def _grid_location_scale(self, x_cond, n_points=N_GRID_LOC_SCALE, n_refinements=N_GRID_REFINEMENTS):
+    """ Cheap estimates of the location and scale of p(y|x) for densities without closed-form moments - the mean and
+    standard deviation of the pdf on a grid over the global integration bounds, which is refined to loc +/- 10 scale.
+    The scale is at least the grid spacing, so that the brackets do not cut off densities narrower than the grid.
+    Only supports ndim_y = 1.
+
+    Args:
+      x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
+      n_points: (int) number of grid points per x_cond
+      n_refinements: (int) number of grids per x_cond
+
+    Returns:
+      (loc, scale) - numpy arrays of shape (n_values,) or None if the pdf vanishes on the grid of an x_cond
+    """
+    _, lower, upper = self._determine_integration_bounds()
+    lower = np.broadcast_to(np.squeeze(lower), (x_cond.shape[0],)).astype(np.float64)
+    upper = np.broadcast_to(np.squeeze(upper), (x_cond.shape[0],)).astype(np.float64)
+
+    for _ in range(n_refinements):
+      y = np.linspace(lower, upper, num=n_points, axis=-1)
+      p = np.concatenate([p_batch for _, _, p_batch in self._batched_pdf(x_cond, y[..., None])]).astype(np.float64)
+      mass = np.sum(p, axis=1)
+      if not np.all(mass > 0):
+        return None
+      loc = np.sum(p * y, axis=1) / mass
+      scale = np.maximum(np.sqrt(np.sum(p * (y - loc[:, None]) ** 2, axis=1) / mass), y[:, 1] - y[:, 0])
+      lower, upper = loc - 10 * scale, loc + 10 * scale
+    return loc, scale
+
+  def _integration_brackets(self, x_cond):
+    """ Per-x integration bounds over the one-dimensional y space - loc +/- 10 scale if conditional location and scale
+    estimates are available, otherwise the global bounds of _determine_integration_bounds
+
+    Args:
+      x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
+
+    Returns:
+      (lower, upper, n_subintervals) - bounds as numpy arrays of shape (n_values,) and the number of subintervals
+      of the initial partition
+    """
+    loc_scale = self._conditional_location_scale(x_cond)
+    if loc_scale is not None:
+      loc, scale = [np.reshape(v, (x_cond.shape[0],)) for v in loc_scale]
+      return loc - 10 * scale, loc + 10 * scale, N_SUBINTERVALS_INT_TIGHT_BOUNDS
+
+    n_subintervals, lower, upper = self._determine_integration_bounds()
+    lower = np.broadcast_to(np.squeeze(lower), (x_cond.shape[0],)).astype(np.float64)
+    upper = np.broadcast_to(np.squeeze(upper), (x_cond.shape[0],)).astype(np.float64)
+    return lower, upper, n_subintervals
+
+  def _adaptive_integral(self, x_cond, func, lower=None, upper=None, rtol=RTOL_INT, atol=ATOL_INT,
+                         batch_size=PDF_BATCH_SIZE):
+    """ Computes the integrals  int func(y) p(y|x) dy  for all x_cond with the vectorized adaptive Gauss-Kronrod
+    quadrature. In each refinement round, the pdf values of all x_cond are obtained from _batched_pdf. Only supports
+    ndim_y = 1.
+
+    Args:
+      x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
+      func: vectorized integrand weighting func(y, idx) with y being the quadrature nodes of the x_cond rows idx - must
+            take a numpy array of shape (n_rows, n_nodes) and an index array of shape (n_rows,) and return an array of
+            shape (n_rows, n_nodes) or (n_rows, n_nodes, ndim_out)
+      lower: (optional) lower integration bounds - scalar or numpy array of shape (n_values,)
+      upper: (optional) upper integration bounds - scalar or numpy array of shape (n_values,)
+      --> bounds that are not provided are determined by _integration_brackets, if both are provided they should be
+          tight brackets of the density mass
+      rtol: (float) relative error tolerance
+      atol: (float) absolute error tolerance
+      batch_size: (int) max. number of (x, y) pairs that are evaluated in one pdf call
+
+    Returns:
+      integrals - numpy array of shape (n_values,) or (n_values, ndim_out)
+    """
+    assert self.ndim_y == 1, "adaptive integration only supports ndim_y = 1"
+    assert x_cond.ndim == 2
+
+    if lower is None or upper is None:
+      default_lower, default_upper, n_subintervals = self._integration_brackets(x_cond)
+      lower = default_lower if lower is None else lower
+      upper = default_upper if upper is None else upper
+    else:
+      n_subintervals = N_SUBINTERVALS_INT_TIGHT_BOUNDS
+    lower, upper = np.broadcast_to(lower, (x_cond.shape[0],)), np.broadcast_to(upper, (x_cond.shape[0],))
+
+    def integrand(y, idx):
+      f = func(y, idx)
+      p = np.concatenate([p_batch for _, _, p_batch in self._batched_pdf(x_cond[idx], y[..., None], batch_size=batch_size)])
+      # the integrand keeps the precision of the pdf (e.g. float32) which determines the attainable accuracy
+      return (f * p.reshape(p.shape + (1,) * (f.ndim - 2))).astype(np.result_type(p.dtype, np.float32), copy=False)
+
+    integrals, _ = adaptive_gauss_kronrod(integrand, lower, upper, rtol=rtol, atol=atol, n_subintervals=n_subintervals)
+    return integrals
+
+  def _batched_pdf(self, x_cond, y, batch_size=PDF_BATCH_SIZE):
+    """ Evaluates p(y|x) for all x_cond on a set of y points. The (n_values x n_points) evaluation problem is split
+    into memory-bounded chunks of x_cond rows, each of which is computed with a single pdf call.
+
+    Args:
+      x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
+      y: y points - numpy array of shape (n_points, ndim_y) shared by all x_cond or (n_values, n_points, ndim_y)
+      batch_size: (int) max. number of (x, y) pairs that are evaluated in one pdf call
+
+    Yields:
+      (idx, y_batch, p_batch) - indices of the x_cond rows in the chunk - numpy array of shape (n_rows,),
+      their y points - numpy array of shape (n_rows, n_points, ndim_y) and the corresponding pdf values
+      p(y|x) - numpy array of shape (n_rows, n_points)
+    """
+    assert x_cond.ndim == 2 and y.ndim in [2, 3] and y.shape[-1] == self.ndim_y
+
+    n_values, n_points = x_cond.shape[0], y.shape[-2]
+    y = np.broadcast_to(y, (n_values, n_points, self.ndim_y))
+    rows_per_batch = max(1, batch_size // n_points)
+
+    for start in range(0, n_values, rows_per_batch):
+      idx = np.arange(start, min(start + rows_per_batch, n_values))
+      y_batch = y[idx]
+      X = np.repeat(x_cond[idx], n_points, axis=0)
+      p_batch = np.reshape(self.pdf(X, y_batch.reshape((-1, self.ndim_y))), y_batch.shape[:2])
+      yield idx, y_batch, p_batch
+
+  def _quadrature_rule(self, n_samples=10 ** 6):
+    """ Nodes and weights for approximating integrals over the multi-dimensional y space (ndim_y > 1) by importance
+    sampling with n_samples draws from the student-t proposal distribution
+
+        int f(y) p(y|x) dy  ~=  sum_j  w_j * f(y_j) * p(y_j|x)
+
+    Args:
+      n_samples: number of monte carlo samples
+
+    Returns:
+      (y_nodes, weights) - numpy arrays of shape (n_samples, ndim_y) and (n_samples,)
+    """
+    loc_proposal, scale_proposal = self._determine_mc_proposal_dist()
+    y_nodes = multidim_t_rvs(loc_proposal, scale_proposal, dof=DOF, N=n_samples)
+    weights = 1. / (n_samples * multidim_t_pdf(y_nodes, loc_proposal, scale_proposal, DOF))
+    return y_nodes, weights
+
   def _tiled_pdf(self, Y, x_cond, n_samples):
     x = np.tile(x_cond.reshape((1, x_cond.shape[0])), (n_samples, 1))
     return np.tile(np.expand_dims(self.pdf(x, Y), axis=1), (1, self.ndim_y))
\ No newline at end of file
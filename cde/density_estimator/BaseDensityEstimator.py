@@ -110,6 +110,15 @@ class BaseDensityEstimator(ConditionalDensity):
   def _param_grid(self):
     raise NotImplementedError
 
+  def _handle_sample_weight(self, sample_weight, n_samples):
+    # validates per-sample weights of the training data - returns None if the samples are unweighted
+    if sample_weight is None:
+      return None
+    sample_weight = np.asarray(sample_weight, dtype=np.float64)
+    assert sample_weight.shape == (n_samples,), "sample_weight must have shape (n_samples,)"
+    assert np.all(sample_weight >= 0) and np.sum(sample_weight) > 0, "sample weights must be non-negative"
+    return sample_weight
+
   def score(self, X, Y):
     """Computes the mean conditional log-likelihood of the provided data (X, Y)
 
@@ -122,10 +131,13 @@ class BaseDensityEstimator(ConditionalDensity):
     """
     return np.mean(self.log_pdf(X, Y))
 
-  def mean_(self, x_cond, n_samples=10**6):
+  def mean_(self, x_cond, n_samples=10**6, sampling='mc'):
     """ Mean of the fitted distribution conditioned on x_cond
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      n_samples: number of samples for monte carlo integration
+      sampling: proposal sampling scheme of the monte carlo integration over the y space (ndim_y > 1) - 'mc'
+                (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
     Returns:
       Means E[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y)
@@ -135,7 +147,7 @@ class BaseDensityEstimator(ConditionalDensity):
     assert x_cond.ndim == 2
 
     if self.has_pdf:
-      return self._mean_pdf(x_cond, n_samples=n_samples)
+      return self._mean_pdf(x_cond, n_samples=n_samples, sampling=sampling)
     else:
       return self._mean_mc(x_cond, n_samples=n_samples)
 
@@ -153,11 +165,14 @@ class BaseDensityEstimator(ConditionalDensity):
     assert x_cond.ndim == 2
     return self._std_pdf(x_cond, n_samples=n_samples)
 
-  def covariance(self, x_cond, n_samples=10**6):
+  def covariance(self, x_cond, n_samples=10**6, sampling='mc'):
     """ Covariance of the fitted distribution conditioned on x_cond
 
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      n_samples: number of samples for monte carlo integration
+      sampling: proposal sampling scheme of the monte carlo integration over the y space - 'mc' (pseudo-random),
+                'sobol' or 'halton' (randomized quasi-monte carlo)
 
     Returns:
       Covariances Cov[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
@@ -165,7 +180,7 @@ class BaseDensityEstimator(ConditionalDensity):
     assert self.fitted, "model must be fitted"
     x_cond = self._handle_input_dimensionality(x_cond)
     assert x_cond.ndim == 2
-    return self._covariance_pdf(x_cond, n_samples=n_samples)
+    return self._covariance_pdf(x_cond, n_samples=n_samples, sampling=sampling)
 
   def skewness(self, x_cond, n_samples=10**6):
     """ Skewness of the fitted distribution conditioned on x_cond
@@ -176,10 +191,7 @@ class BaseDensityEstimator(ConditionalDensity):
        Returns:
          Skewness Skew[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
        """
-    assert self.fitted, "model must be fitted"
-    x_cond = self._handle_input_dimensionality(x_cond)
-    assert x_cond.ndim == 2
-    return self._skewness_pdf(x_cond, n_samples=n_samples)
+    return self.moments(x_cond, orders=(3,), n_samples=n_samples)[0]
 
   def kurtosis(self, x_cond, n_samples=10**6):
     """ Kurtosis of the fitted distribution conditioned on x_cond
@@ -190,10 +202,7 @@ class BaseDensityEstimator(ConditionalDensity):
        Returns:
          Kurtosis Kurt[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
        """
-    assert self.fitted, "model must be fitted"
-    x_cond = self._handle_input_dimensionality(x_cond)
-    assert x_cond.ndim == 2
-    return self._kurtosis_pdf(x_cond, n_samples=n_samples)
+    return self.moments(x_cond, orders=(4,), n_samples=n_samples)[0]
 
   def mean_std(self, x_cond, n_samples=10 ** 6):
     """ Computes Mean and Covariance of the fitted distribution conditioned on x_cond.
@@ -205,9 +214,60 @@ class BaseDensityEstimator(ConditionalDensity):
     Returns:
       Means E[y|x] and Covariances Cov[y|x]
     """
-    mean = self.mean_(x_cond, n_samples=n_samples)
-    std = self._std_pdf(x_cond, n_samples=n_samples, mean=mean)
-    return mean, std
+    return self.moments(x_cond, orders=(1, 2), n_samples=n_samples)
+
+  def moments(self, x_cond, orders=(1, 2, 3, 4), n_samples=10 ** 6):
+    """ Computes several moments of the fitted distribution conditioned on x_cond. The pdf (or sampling if no pdf is
+        available) is evaluated only once and all requested statistics are reduced from the same evaluations.
+        Computationally more efficient than calling mean_, std_, skewness and kurtosis separately
+
+    Args:
+      x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      orders: tuple of moment orders - 1: mean, 2: standard deviation, 3: skewness, 4: excess kurtosis.
+              Orders 3 and 4 are only supported for ndim_y = 1
+      n_samples: number of samples for monte carlo model_fitting
+
+    Returns:
+      tuple with one entry per order
+        - order 1: Means E[y|x] - numpy array of shape (n_values, ndim_y)
+        - order 2: Standard deviations sqrt(Var[y|x]) - numpy array of shape (n_values, ndim_y)
+        - order 3: Skewness Skew[y|x] - numpy array of shape (n_values,)
+        - order 4: Excess kurtosis Kurt[y|x] - 3 - numpy array of shape (n_values,)
+    """
+    assert self.fitted, "model must be fitted"
+    x_cond = self._handle_input_dimensionality(x_cond)
+    assert x_cond.ndim == 2
+
+    if self.has_pdf:
+      return self._moments_pdf(x_cond, orders=orders, n_samples=n_samples)
+    elif self.can_sample:
+      return self._moments_mc(x_cond, orders=orders, n_samples=n_samples)
+    else:
+      raise NotImplementedError()
+
+  def expectation(self, x_cond, func, n_samples=10 ** 6):
+    """ Computes the conditional expectation E[f(y)|x] of an arbitrary function f under the fitted distribution
+
+    Args:
+      x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      func: vectorized function f - must take a numpy array of shape (n_samples, ndim_y) and return a numpy array
+            of shape (n_samples,) or (n_samples, ndim_out)
+      n_samples: number of samples for monte carlo model_fitting
+
+    Returns:
+      Expectations E[f(y)|x] corresponding to x_cond - numpy array of shape (n_values,) or (n_values, ndim_out)
+    """
+    assert self.fitted, "model must be fitted"
+    assert callable(func)
+    x_cond = self._handle_input_dimensionality(x_cond)
+    assert x_cond.ndim == 2
+
+    if self.has_pdf:
+      return self._expectation_pdf(x_cond, func, n_samples=n_samples)
+    elif self.can_sample:
+      return self._expectation_mc(x_cond, func, n_samples=n_samples)
+    else:
+      raise NotImplementedError()
 
   def value_at_risk(self, x_cond, alpha=0.01, n_samples=10**6):
     """ Computes the Value-at-Risk (VaR) of the fitted distribution. Only if ndim_y = 1
@@ -233,6 +293,33 @@ class BaseDensityEstimator(ConditionalDensity):
       raise NotImplementedError()
     return VaR
 
+  def quantiles(self, x_cond, alphas=(0.01, 0.05, 0.1), n_samples=10**6):
+    """ Computes multiple conditional quantiles of the fitted distribution at once. Only if ndim_y = 1
+
+    Args:
+      x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      alphas: quantile levels within (0, 1) - array-like of shape (n_alphas)
+      n_samples: number of samples for the monte carlo fallback
+
+    Returns:
+       quantiles for each x to condition on and each alpha - numpy array of shape (n_values, n_alphas)
+    """
+    assert self.fitted, "model must be fitted"
+    assert self.ndim_y == 1, "Quantiles can only be computed when ndim_y = 1"
+    x_cond = self._handle_input_dimensionality(x_cond)
+    alphas = np.asarray(alphas, dtype=np.float64).reshape((-1,))
+    assert x_cond.ndim == 2
+
+    if self.has_cdf:
+      quantiles = self._quantiles_cdf(x_cond, alphas)
+      if np.isnan(quantiles).any() and self.can_sample: # try with sampling if failed
+        quantiles = self._quantiles_mc(x_cond, alphas, n_samples=n_samples)
+    elif self.can_sample:
+      quantiles = self._quantiles_mc(x_cond, alphas, n_samples=n_samples)
+    else:
+      raise NotImplementedError()
+    return quantiles
+
   def conditional_value_at_risk(self, x_cond, alpha=0.01, n_samples=10**6):
     """ Computes the Conditional Value-at-Risk (CVaR) / Expected Shortfall of the fitted distribution. Only if ndim_y = 1
 
@@ -285,18 +372,23 @@ class BaseDensityEstimator(ConditionalDensity):
 
         Args:
           x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
-          alpha: quantile percentage of the distribution
+          alpha: quantile percentage of the distribution - either a float or an array-like of shape (n_alphas) in
+                 which case the risk measures of all alphas are computed jointly
           n_samples: number of samples for monte carlo model_fitting
 
         Returns:
-          - VaR values for each x to condition on - numpy array of shape (n_values)
-          - CVaR values for each x to condition on - numpy array of shape (n_values)
+          - VaR values for each x to condition on - numpy array of shape (n_values) or (n_values, n_alphas)
+          - CVaR values for each x to condition on - numpy array of shape (n_values) or (n_values, n_alphas)
         """
     assert self.fitted, "model must be fitted"
     assert self.ndim_y == 1, "Value at Risk can only be computed when ndim_y = 1"
     assert x_cond.ndim == 2
 
-    VaRs = self.value_at_risk(x_cond, alpha=alpha, n_samples=n_samples)
+    if np.ndim(alpha) == 0:
+      VaRs = self.value_at_risk(x_cond, alpha=alpha, n_samples=n_samples)
+    else:
+      alpha = np.asarray(alpha, dtype=np.float64)
+      VaRs = self.quantiles(x_cond, alphas=alpha, n_samples=n_samples)
 
     if self.has_pdf:
       CVaRs = self._conditional_value_at_risk_mc_pdf(VaRs, x_cond, alpha=alpha, n_samples=n_samples)
@@ -305,6 +397,6 @@ class BaseDensityEstimator(ConditionalDensity):
     else:
       raise NotImplementedError("Distribution object must either support pdf or sampling in order to compute CVaR")
 
-    assert VaRs.shape == CVaRs.shape == (len(x_cond),)
+    assert VaRs.shape == CVaRs.shape == (len(x_cond),) + np.shape(alpha)
     return VaRs, CVaRs
 
@@ -4,12 +4,20 @@ import sklearn
 import os
 import itertools
 import warnings
+import hashlib
+import multiprocessing
+from collections import OrderedDict
 from multiprocessing import Manager
 
 from cde.utils.tf_utils.layers_powered import LayersPowered
 import cde.utils.tf_utils.layers as L
 from cde.utils.serializable import Serializable
 from cde.utils.async_executor import AsyncExecutor
+from cde.utils.data_pipeline import TrainingData, ReservoirBuffer, update_mean_std, STATISTICS_CHUNK_SIZE
+from cde.utils.early_stopping import EarlyStopping
+from cde.utils.callbacks import run_callbacks
+from cde.utils.data_parallel import SharedAllReduce, shared_array, shard_batches, run_workers
+from cde.utils.numpy_predictor import NumpyMLP
 from cde.density_estimator.BaseDensityEstimator import BaseDensityEstimator
 
 
@@ -33,6 +41,29 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
     # set to >0. to use dropout during training. Determines the probability of dropping the output of a node
     dropout = 0.0
 
+    # clip the gradients by global norm - used by estimators whose gradients tend to explode
+    gradient_clipping = False
+    gradient_clip_norm = 3e5
+
+    # mini-batch training - if batch_size is None, each training step uses the whole training data
+    batch_size = None
+    shuffle = True
+
+    # max. number of network outputs (e.g. mixture components) kept in the LRU cache - 0 disables the cache
+    output_cache_size = 0
+    output_cache_hits = 0
+    output_cache_misses = 0
+
+    # number of training samples the data statistics / noise intensity are based on - grows with partial_fit
+    n_samples_seen = 0
+
+    # max. number of past training samples kept for replay in partial_fit - 0 disables the replay buffer
+    replay_buffer_size = 0
+    _replay_buffer = None
+
+    # incremented whenever the parameters of the network change -> part of the cache keys
+    _param_version = 0
+
     def reset_fit(self):
         """
         Reset all tensorflow objects to enable the model to be trained again
@@ -40,7 +71,8 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
         """
         raise NotImplementedError()
 
-    def fit_by_cv(self, X, Y, n_folds=3, param_grid=None, random_state=None, verbose=True, n_jobs=-1):
+    def fit_by_cv(self, X, Y, n_folds=3, param_grid=None, random_state=None, verbose=True, n_jobs=-1,
+                  vectorize_folds=False):
         """ Fits the conditional density model with hyperparameter search and cross-validation.
 
         - Determines the best hyperparameter configuration from a pre-defined set using cross-validation. Thereby,
@@ -60,6 +92,10 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
                                "keep_edges": [True, False]
                               }
           random_state: (int) seed used by the random number generator for shuffeling the data
+          n_jobs: (int) number of processes that fit the (param, fold) models - ignored if vectorize_folds is True
+          vectorize_folds: (boolean) if True, the models of all (param, fold) pairs are built in a single graph and
+                           trained in lock-step within one session instead of one process and graph per model. This
+                           avoids the process and graph overhead which dominates for small networks.
         """
         os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
         original_params = self.get_params()
@@ -73,6 +109,37 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
 
         param_ids, fold_ids = list(zip(*itertools.product(range(len(param_list)), range(n_folds))))
 
+        if vectorize_folds:
+            score_dict = self._fit_eval_lockstep(X, Y, param_list, train_splits, test_splits, original_params)
+        else:
+            score_dict = self._fit_eval_async(X, Y, param_list, train_splits, test_splits, original_params,
+                                              param_ids, fold_ids, verbose=verbose, n_jobs=n_jobs)
+
+        # make sure we ultimately have an output for every parameter - fold - combination
+        assert len(score_dict.keys()) == len(param_list) * len(train_splits)
+
+        # Select the best parameter setting
+        scores_array = np.zeros((len(param_list), len(train_splits)))
+        for (i, j), score in score_dict.items():
+            scores_array[i, j] = score
+        avg_scores = np.mean(scores_array, axis=-1)
+        best_idx = np.argmax(avg_scores)
+        selected_params = param_list[best_idx]
+        assert len(avg_scores) == len(param_list)
+
+        if verbose:
+            print("Completed grid search - Selected params: {}".format(selected_params))
+            print("Refitting model with selected params")
+
+        # Refit with best parameter set
+        self.set_params(**selected_params)
+        self.reset_fit()
+        self.fit(X, Y, verbose=False)
+        return selected_params
+
+    def _fit_eval_async(self, X, Y, param_list, train_splits, test_splits, original_params, param_ids, fold_ids,
+                        verbose=True, n_jobs=-1):
+        # fits and evaluates each (param, fold) model in a separate process and graph
         # multiprocessing setup
         manager = Manager()
         score_dict = manager.dict()
@@ -100,7 +167,6 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
         executor = AsyncExecutor(n_jobs=n_jobs)
         executor.run(_fit_eval, param_ids, fold_ids, verbose=verbose)
 
-
         # check if all results are available and rerun failed fit_evals. Try three times
         for i in range(3):
             failed_runs = [x for x in zip(param_ids, fold_ids) if x not in score_dict]
@@ -114,28 +180,206 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
                     _fit_eval(p, f, verbose=verbose, i_rand=i)
                 except Exception as e:
                     print(e)
+        return dict(score_dict)
 
-        # make sure we ultimately have an output for every parameter - fold - combination
-        assert len(score_dict.keys()) == len(param_list) * len(train_splits)
+    def _fit_eval_lockstep(self, X, Y, param_list, train_splits, test_splits, original_params):
+        # fits the models of all (param, fold) pairs in one graph, trains them in lock-step and evaluates them
+        with tf.Graph().as_default(), tf.Session():
+            models, datas = {}, []
+            for param_idx, fold_idx in itertools.product(range(len(param_list)), range(len(train_splits))):
+                kwargs_dict = {**original_params, **param_list[param_idx]}
+                kwargs_dict['name'] = 'cv_%i_%i_' % (param_idx, fold_idx) + self.name
+                model = self.__class__(**kwargs_dict)
 
-        # Select the best parameter setting
-        scores_array = np.zeros((len(param_list), len(train_splits)))
-        for (i, j), score in score_dict.items():
-            scores_array[i, j] = score
-        avg_scores = np.mean(scores_array, axis=-1)
-        best_idx = np.argmax(avg_scores)
-        selected_params = param_list[best_idx]
-        assert len(avg_scores) == len(param_list)
+                train_indices = train_splits[fold_idx]
+                data = model._training_data(X[train_indices], Y[train_indices])
+                model._initialize_fit(data)
+                models[(param_idx, fold_idx)] = model
+                datas.append(data)
 
-        if verbose:
-            print("Completed grid search - Selected params: {}".format(selected_params))
-            print("Refitting model with selected params")
+            self._fit_lockstep(list(models.values()), datas)
 
-        # Refit with best parameter set
-        self.set_params(**selected_params)
-        self.reset_fit()
-        self.fit(X, Y, verbose=False)
-        return selected_params
+            score_dict = {}
+            for (param_idx, fold_idx), model in models.items():
+                test_indices = test_splits[fold_idx]
+                test_score = model.score(X[test_indices], Y[test_indices])
+                assert not np.isnan(test_score)
+                score_dict[(param_idx, fold_idx)] = test_score
+        return score_dict
+
+    @staticmethod
+    def _fit_lockstep(models, datas):
+        """ Trains several initialized models of the same graph in lock-step - every session call runs one training
+        step of each model that still has a mini-batch left in the current epoch. The models are trained for the
+        same number of epochs as their fit (see _n_fit_epochs).
+
+        Args:
+          models: list of BaseNNEstimator instances, prepared with _initialize_fit
+          datas: list of the respective TrainingData
+        """
+        sess = tf.get_default_session()
+        for epoch in range(max(model._n_fit_epochs() for model in models)):
+            active = [(model, data) for model, data in zip(models, datas) if epoch < model._n_fit_epochs()]
+            for batches in itertools.zip_longest(*[model._training_batches(data) for model, data in active]):
+                train_ops, feed_dict = [], {}
+                for (model, data), batch in zip(active, batches):
+                    if batch is not None:
+                        train_ops.append(model._train_op())
+                        feed_dict.update(model._train_feed_dict(*batch, nll_scale=model._nll_scale(data, batch)))
+                sess.run(train_ops, feed_dict=feed_dict)
+
+        for model in models:
+            model.fitted = True
+            model._invalidate_output_cache()
+
+    def fit_data_parallel(self, X, Y, n_workers=None, verbose=False):
+        """ Fits the model with synchronous data-parallel training in n_workers local processes. Every worker holds a
+        replica of the network and computes the gradient on its shard of each mini-batch. The gradients are summed
+        through shared memory, so that all replicas apply the same update a single process would compute on the
+        whole mini-batch. The replicas start from the (freshly initialized) parameters of this model, which receives
+        the trained parameters in the end.
+
+        The workers are forked (see cde.utils.data_parallel.fork_context), independent of the default start method of
+        the platform, and thus this method is only available on POSIX systems. Every worker builds its own graph and
+        session and never uses the session inherited from this process.
+
+        Args:
+          X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+          Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+          n_workers: (int) number of worker processes - if None, the number of CPUs
+          verbose: (boolean) controls the verbosity (console output)
+        """
+        assert not callable(X), "data-parallel training requires the data as numpy arrays"
+        n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        assert n_workers > 0
+
+        # data statistics, noise intensity and initial parameters are computed once and shared by all replicas
+        data = self._training_data(X, Y)
+        self._initialize_fit(data)
+        X, Y = data.X, data.Y
+
+        n_steps = 1 if self.batch_size is None else int(np.ceil(X.shape[0] / self.batch_size))
+        n_grads = sum(var.shape.num_elements() for var in tf.trainable_variables(scope=self.name))
+        initial_params = self.get_param_values()
+        params = shared_array(initial_params.shape[0])
+        params[:] = initial_params
+        # the gradients and the negative log-likelihood of the shards are summed in one all-reduce per step
+        all_reduce = SharedAllReduce(n_workers, n_grads + 1)
+        estimator_params = self.get_params()
+
+        def _worker(rank):
+            config = tf.ConfigProto(device_count={"CPU": 1}, inter_op_parallelism_threads=1,
+                                    intra_op_parallelism_threads=1)
+            with tf.Graph().as_default(), tf.Session(config=config):
+                model = self.__class__(**estimator_params)
+                model._initialize_fit(model._training_data(X, Y))
+                model.set_param_values(np.copy(params))
+                grads, grad_phs, apply_op = model._build_data_parallel_ops(n_workers)
+
+                shard = np.arange(rank, X.shape[0], n_workers)
+                random_state = np.random.RandomState(seed=model.random_state.randint(0, 10 ** 7) + rank)
+                for i in range(model.n_training_epochs):
+                    log_loss = 0.0
+                    for idx in shard_batches(shard, n_steps, shuffle=model.shuffle, random_state=random_state):
+                        # the mini-batches (of all shards) hold about 1 / n_steps of the data
+                        feed_dict = model._train_feed_dict(X[idx], Y[idx], nll_scale=float(n_steps))
+                        values = model.sess.run(grads + [model.nll_loss], feed_dict=feed_dict)
+                        total = all_reduce.all_reduce(rank, np.concatenate([np.ravel(v) for v in values]))
+                        log_loss += total[-1]
+
+                        feed_dict, offset = {}, 0
+                        for grad_ph in grad_phs:
+                            size = grad_ph.shape.num_elements()
+                            feed_dict[grad_ph] = total[offset:offset + size].reshape(grad_ph.shape.as_list())
+                            offset += size
+                        model.sess.run(apply_op, feed_dict=feed_dict)
+
+                    if verbose and rank == 0 and not i % 100:
+                        print('Step {:4}: train log-loss {: .4f}'.format(i, log_loss))
+
+                if rank == 0:
+                    params[:] = model.get_param_values()
+
+        run_workers(_worker, n_workers, all_reduce=all_reduce)
+
+        self.set_param_values(np.copy(params))
+        self.fitted = True
+
+    def fit_warm_start(self, X, Y, init_params, n_epoch=None, verbose=False):
+        """ Fits the model like fit, but the training starts from the provided parameters instead of a random
+        initialization, e.g. from the parameters of a model with the same configuration that was fitted to fewer data.
+        The data normalization and noise intensity are computed from the new data.
+
+        Args:
+          X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+          Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+          init_params: flattened parameter values (see get_param_values) of a model with the same configuration
+          n_epoch: (optional) number of training epochs - defaults to n_training_epochs
+          verbose: (boolean) controls the verbosity (console output)
+        """
+        data = self._training_data(X, Y)
+        self._initialize_fit(data)
+
+        self.set_param_values(np.copy(init_params))
+        if self.data_normalization:  # the parameters contain the normalization of the data they were fitted to
+            self._assign_data_normalization()
+
+        n_epoch = self.n_training_epochs if n_epoch is None else n_epoch
+        self._partial_fit(data, n_epoch=n_epoch, verbose=verbose)
+        self.fitted = True
+
+    def partial_fit(self, X, Y, n_epoch=1, normalization_decay=None, n_replay=None, eval_set=None, verbose=False):
+        """ Incrementally updates the fitted model with new data - the training warm-starts from the current
+        parameters of the network instead of re-initializing them. If data_normalization is used, the normalization
+        statistics are updated with the new data as well. If a replay buffer is enabled (see set_replay_buffer_size),
+        samples of the past training data are replayed together with the new data to counteract forgetting.
+
+        Args:
+          X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+          Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+          n_epoch: (int) number of training epochs over the new (and replayed) data
+          normalization_decay: (optional) float in (0, 1] - if None, the normalization statistics are the exact
+                               mean / std of all data seen so far (Welford). Otherwise the statistics are an
+                               exponential moving average that weights the new data with normalization_decay.
+          n_replay: (optional) number of samples drawn from the replay buffer - if None, the whole buffer is replayed
+          eval_set: (tuple) eval/test set - tuple (X_test, Y_test)
+          verbose: (boolean) controls the verbosity (console output)
+        """
+        assert self.fitted, "model must be fitted before it can be updated with partial_fit"
+        X, Y = self._handle_input_dimensionality(X, Y, fitting=False)
+        if eval_set is not None:
+            eval_set = self._handle_input_dimensionality(*eval_set)
+
+        if self.data_normalization:
+            self.x_mean, self.x_std = update_mean_std(self.n_samples_seen, self.x_mean, self.x_std, X,
+                                                      decay=normalization_decay)
+            self.y_mean, self.y_std = update_mean_std(self.n_samples_seen, self.y_mean, self.y_std, Y,
+                                                      decay=normalization_decay)
+            self._assign_data_normalization()
+        self._assign_noise_intensity(self.n_samples_seen + X.shape[0])
+
+        X_train, Y_train = X, Y
+        if self._replay_buffer is not None and len(self._replay_buffer) > 0 and n_replay != 0:
+            X_replay, Y_replay = self._replay_buffer.sample(n_replay)
+            X_train, Y_train = np.concatenate([X, X_replay]), np.concatenate([Y, Y_replay])
+        if self._replay_buffer is not None:
+            self._replay_buffer.add(X, Y)
+
+        self._partial_fit(TrainingData(X_train, Y_train, self.ndim_x, self.ndim_y), n_epoch=n_epoch,
+                          eval_set=eval_set, verbose=verbose)
+
+    def set_replay_buffer_size(self, max_size):
+        """ Enables (max_size > 0) or disables (max_size = 0) the bounded replay buffer that keeps a uniform random
+        sub-sample of the training data (reservoir sampling) for partial_fit. The buffer is filled in fit and with
+        the data passed to partial_fit.
+
+        Args:
+          max_size: (int) max. number of training samples kept in the buffer
+        """
+        assert max_size >= 0
+        self.replay_buffer_size = int(max_size)
+        self._replay_buffer = ReservoirBuffer(self.replay_buffer_size, self.ndim_x, self.ndim_y,
+                                              random_state=self.random_state) if max_size > 0 else None
 
     def pdf(self, X, Y):
         """ Predicts the conditional probability p(y|x). Requires the model to be fitted.
@@ -150,7 +394,7 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
          """
         assert self.fitted, "model must be fitted to compute likelihood score"
         X, Y = self._handle_input_dimensionality(X, Y, fitting=False)
-        p = self.sess.run(self.pdf_, feed_dict={self.X_ph: X, self.Y_ph: Y})
+        p = self.sess.run(self.pdf_, feed_dict=self._feed_dict(X, Y))
         assert p.ndim == 1 and p.shape[0] == X.shape[0]
         return p
 
@@ -167,7 +411,7 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
         """
         assert self.fitted, "model must be fitted to compute likelihood score"
         X, Y = self._handle_input_dimensionality(X, Y, fitting=False)
-        p = self.sess.run(self.cdf_, feed_dict={self.X_ph: X, self.Y_ph: Y})
+        p = self.sess.run(self.cdf_, feed_dict=self._feed_dict(X, Y))
         assert p.ndim == 1 and p.shape[0] == X.shape[0]
         return p
 
@@ -184,17 +428,244 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
          """
         assert self.fitted, "model must be fitted to compute likelihood score"
         X, Y = self._handle_input_dimensionality(X, Y, fitting=False)
-        p = self.sess.run(self.log_pdf_, feed_dict={self.X_ph: X, self.Y_ph: Y})
+        p = self.sess.run(self.log_pdf_, feed_dict=self._feed_dict(X, Y))
         assert p.ndim == 1 and p.shape[0] == X.shape[0]
         return p
 
-    def _compute_data_normalization(self, X, Y):
-        # compute data statistics (mean & std)
-        self.x_mean = np.mean(X, axis=0)
-        self.x_std = np.std(X, axis=0)
-        self.y_mean = np.mean(Y, axis=0)
-        self.y_std = np.std(Y, axis=0)
+    def set_output_cache_size(self, max_size):
+        """ Enables (max_size > 0) or disables (max_size = 0) the bounded LRU cache of the network outputs. The cache
+        is keyed by a content hash of the X array and the parameter version of the model and is invalidated when the
+        model is (re-)fitted, reset or its parameters are set.
 
+        Args:
+          max_size: (int) max. number of X arrays whose network outputs are kept in the cache
+        """
+        assert max_size >= 0
+        self.output_cache_size = int(max_size)
+        self.output_cache_hits, self.output_cache_misses = 0, 0
+        self._invalidate_output_cache()
+
+    def output_cache_info(self):
+        """ Returns: dict with the hits, misses, current size and max. size of the network output cache """
+        return {'hits': self.output_cache_hits, 'misses': self.output_cache_misses,
+                'size': len(self.__dict__.get('_output_cache', ())), 'max_size': self.output_cache_size}
+
+    def set_param_values(self, flattened_params, **tags):
+        LayersPowered.set_param_values(self, flattened_params, **tags)
+        self._invalidate_output_cache()
+
+    def export_numpy(self):
+        """ Exports the fitted model as a pure numpy predictor (see cde.utils.numpy_predictor) which requires neither
+        tensorflow nor edward, e.g. for serving the model. The predictor can be pickled and provides pdf, log_pdf, cdf
+        and the moments (and sampling for the mixture models) of the estimator.
+
+        Returns:
+          numpy predictor - a ConditionalDensity with the same outputs as the fitted estimator
+        """
+        raise NotImplementedError()
+
+    def _export_network(self):
+        """ numpy copy of the core network - the (weight normalized) weights, biases and nonlinearities of its dense
+        layers and the data normalization statistics
+
+        Returns: tuple (NumpyMLP, data_statistics) - data_statistics is None if the data is not normalized
+        """
+        assert self.fitted, "model must be fitted"
+        dense_layers = [layer for layer in L.get_all_layers(self.core_network.output_layer)
+                        if isinstance(layer, L.DenseLayer)]
+        params = self.sess.run([(layer.W, layer.b) for layer in dense_layers])
+        activations = [layer.nonlinearity.__name__ for layer in dense_layers]
+
+        data_statistics = None
+        if self.data_normalization:
+            # read from the graph -> also valid for estimators that were unpickled or fitted with partial_fit
+            x_mean, x_std, y_mean, y_std = self.sess.run([self.mean_x_sym, self.std_x_sym, self.mean_y_sym,
+                                                          self.std_y_sym])
+            data_statistics = {'X_mean': x_mean, 'X_std': x_std, 'Y_mean': y_mean, 'Y_std': y_std}
+
+        mlp = NumpyMLP([W for W, _ in params], [b for _, b in params], activations,
+                       x_mean=None if data_statistics is None else data_statistics['X_mean'],
+                       x_std=None if data_statistics is None else data_statistics['X_std'])
+        return mlp, data_statistics
+
+    def _train_op(self):
+        # op that performs one training step on the mini-batch fed with _train_feed_dict
+        raise NotImplementedError()
+
+    def _optimizer(self):
+        # a new instance of the optimizer used for training
+        raise NotImplementedError()
+
+    def _build_data_parallel_ops(self, n_workers):
+        """ Builds the ops of a data-parallel replica: the gradients of the loss on a shard of the mini-batch and an
+        op that applies the summed gradients (fed via placeholders) with a fresh optimizer. The regularization penalty
+        is split among the workers, such that the summed gradients equal those of the loss on the whole mini-batch.
+
+        Returns:
+          (list of gradient tensors, list of gradient placeholders, apply op)
+        """
+        var_list = tf.trainable_variables(scope=self.name)
+        existing_vars = set(tf.global_variables())
+
+        with tf.variable_scope(self.name):
+            shard_loss = self.nll_scale_ph * self.nll_loss + self.reg_loss / n_workers
+            grads = [tf.zeros_like(var) if grad is None else grad
+                     for grad, var in zip(tf.gradients(shard_loss, var_list), var_list)]
+            grad_phs = [tf.placeholder(var.dtype.base_dtype, shape=var.shape) for var in var_list]
+            applied_grads = tf.clip_by_global_norm(grad_phs, self.gradient_clip_norm)[0] if self.gradient_clipping \
+                else grad_phs
+            apply_op = self._optimizer().apply_gradients(zip(applied_grads, var_list))
+
+        # initialize the slot variables of the new optimizer
+        tf.variables_initializer([var for var in tf.global_variables() if var not in existing_vars]).run()
+        return grads, grad_phs, apply_op
+
+    def _n_fit_epochs(self):
+        # number of training epochs of fit
+        return self.n_training_epochs
+
+    def _train_feed_dict(self, X, Y, sample_weight=None, nll_scale=1.0):
+        feed_dict = {self.X_ph: X, self.Y_ph: Y, self.train_phase: True, self.dropout_ph: self.dropout,
+                     self.nll_scale_ph: nll_scale}
+        if sample_weight is not None:
+            feed_dict[self.sample_weight_ph] = sample_weight
+        return feed_dict
+
+    def _nll_scale(self, data, batch):
+        # the summed log-likelihood loss of a mini-batch is scaled up to the size of the training data (like the scale
+        # of edward's inference) -> the regularization penalty keeps the same weight as in full-batch training
+        return 1.0 if self.batch_size is None else data.n_samples / batch[0].shape[0]
+
+    def _feed_dict(self, X, Y):
+        # inputs of the pdf / cdf / log_pdf ops - estimators may feed cached network outputs instead of X
+        return {self.X_ph: X, self.Y_ph: Y}
+
+    def _cached_network_outputs(self, X, compute_fn):
+        """ Returns compute_fn(X) - looked up in / added to the LRU cache if it is enabled. The cached arrays are
+        read-only since they are shared between all callers.
+        """
+        if not self.output_cache_size:
+            return compute_fn(X)
+
+        cache = self.__dict__.setdefault('_output_cache', OrderedDict())
+        X = np.ascontiguousarray(X)
+        key = (self._param_version, X.shape, X.dtype.str, hashlib.sha1(X).hexdigest())
+
+        if key in cache:
+            self.output_cache_hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+
+        self.output_cache_misses += 1
+        outputs = compute_fn(X)
+        for array in (outputs if isinstance(outputs, tuple) else (outputs,)):
+            array.flags.writeable = False
+        cache[key] = outputs
+        while len(cache) > self.output_cache_size:
+            cache.popitem(last=False)
+        return outputs
+
+    def _invalidate_output_cache(self):
+        self._param_version += 1
+        self._output_cache = OrderedDict()
+
+    def _training_data(self, X, Y, sample_weight=None):
+        # numpy arrays (incl. np.memmap) or a callable data_fn that returns an iterable of (X_chunk, Y_chunk) per epoch
+        if not callable(X):
+            X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
+        data = TrainingData(X, Y, self.ndim_x, self.ndim_y, sample_weight=sample_weight)
+
+        if self.replay_buffer_size > 0:
+            self.set_replay_buffer_size(self.replay_buffer_size)
+            for batch in data.batches(batch_size=STATISTICS_CHUNK_SIZE, shuffle=False, n_prefetch=0):
+                self._replay_buffer.add(batch[0], batch[1])
+        return data
+
+    def _training_batches(self, data):
+        # one epoch of (shuffled) mini-batches, prepared ahead in a background thread
+        return data.batches(batch_size=self.batch_size, shuffle=self.shuffle, random_state=self.random_state)
+
+    def _train_epoch(self, data, timer):
+        # one training step per mini-batch - returns the training objective of the epoch, i.e. the negative
+        # log-likelihood summed over the batches plus the regularization penalty (counted once), and the number of samples
+        epoch_nll, reg_loss, n_samples = 0.0, 0.0, 0
+        batches = iter(self._training_batches(data))
+        while True:
+            with timer.phase('batching'):
+                batch = next(batches, None)
+            if batch is None:
+                return epoch_nll + reg_loss, n_samples
+            with timer.phase('feed_dict'):
+                feed_dict = self._train_feed_dict(*batch, nll_scale=self._nll_scale(data, batch))
+            with timer.phase('session_run'):
+                _, batch_nll, reg_loss = self.sess.run([self._train_op(), self.nll_loss, self.reg_loss],
+                                                       feed_dict=feed_dict)
+            epoch_nll, n_samples = epoch_nll + batch_nll, n_samples + batch[0].shape[0]
+
+    def _eval_loss_fn(self, eval_set, loss, timer):
+        # mean loss on the eval set - only computed when needed and at most once per epoch
+        eval_losses = []
+
+        def eval_loss_fn():
+            if not eval_losses:
+                with timer.phase('eval'):
+                    eval_loss = self.sess.run(loss, feed_dict={self.X_ph: eval_set[0], self.Y_ph: eval_set[1]})
+                eval_losses.append(eval_loss / eval_set[0].shape[0])
+            return eval_losses[0]
+        return eval_loss_fn
+
+    def _end_epoch(self, callbacks, early_stopping, epoch, train_loss, n_samples, timer, eval_loss_fn=None):
+        # checks the early stopping and calls the callbacks - returns True if the training shall be stopped
+        with timer.phase('early_stopping'):
+            stop = self._check_early_stopping(early_stopping, epoch, train_loss, eval_loss_fn)
+
+        if callbacks:
+            logs = {'epoch': epoch, 'loss': train_loss, 'n_samples': n_samples}
+            if eval_loss_fn is not None:
+                logs['eval_loss'] = eval_loss_fn()
+            logs['times'] = timer.times()
+            run_callbacks(callbacks, 'on_epoch_end', self, epoch, logs)
+        return stop
+
+    def _end_fit(self, callbacks, early_stopping, n_epochs, fit_timer):
+        logs = {'n_epochs': n_epochs, 'fit_time': fit_timer.times()['total'],
+                'stopped_epoch': early_stopping.stopped_epoch if early_stopping is not None else None}
+        run_callbacks(callbacks, 'on_fit_end', self, logs)
+
+    def _early_stopping(self, patience=None, min_delta=0.0, eval_interval=1, max_fit_time=None):
+        # None if neither a patience nor a time budget is set -> the model is trained for all epochs
+        early_stopping = EarlyStopping(self, patience=patience, min_delta=min_delta, eval_interval=eval_interval,
+                                       max_fit_time=max_fit_time)
+        return early_stopping if early_stopping.active else None
+
+    def _check_early_stopping(self, early_stopping, epoch, train_loss, eval_loss_fn=None):
+        # returns True if the training shall be stopped - monitors the mean validation log-loss if an eval set is
+        # available (eval_loss_fn is only called in evaluation epochs) and the mean training log-loss otherwise
+        if early_stopping is None:
+            return False
+        if early_stopping.is_eval_epoch(epoch):
+            return early_stopping.update(epoch, train_loss if eval_loss_fn is None else eval_loss_fn())
+        return early_stopping.stop(epoch)
+
+    def _finish_early_stopping(self, early_stopping, verbose=True):
+        if early_stopping is None:
+            return
+        early_stopping.restore_best_params()
+        if verbose and early_stopping.stopped_epoch is not None:
+            print("early stopping in epoch {} - restored the parameters of epoch {} (monitored log-loss: {:.4f})".format(
+                early_stopping.stopped_epoch, early_stopping.best_epoch, early_stopping.best_loss))
+
+    def _compute_data_normalization(self, data):
+        # compute data statistics (mean & std) - in one streaming pass if the data is memory-mapped or streamed
+        statistics = data.statistics(random_state=self.random_state)
+        self.n_samples_seen = statistics['n_samples']
+        self.x_mean = statistics['X_mean']
+        self.x_std = statistics['X_std']
+        self.y_mean = statistics['Y_mean']
+        self.y_std = statistics['Y_std']
+        self._assign_data_normalization()
+
+    def _assign_data_normalization(self):
         self.data_statistics = {
             'X_mean': self.x_mean,
             'X_std': self.x_std,
@@ -211,11 +682,14 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
             tf.assign(self.std_y_sym, self.y_std)
         ])
 
-    def _compute_noise_intensity(self, X, Y):
+    def _compute_noise_intensity(self, data):
         # computes the noise intensity based on the number of samples and dimensionality of the data
+        if self.adaptive_noise_fn is not None:
+            self._assign_noise_intensity(data.n_samples)
 
-        n_samples = X.shape[0]
-
+    def _assign_noise_intensity(self, n_samples):
+        # n_samples_seen is only needed for the running normalization statistics and the adaptive noise
+        self.n_samples_seen = n_samples
         if self.adaptive_noise_fn is not None:
             self.x_noise_std = self.adaptive_noise_fn(n_samples, self.ndim_x + self.ndim_y)
             self.y_noise_std = self.adaptive_noise_fn(n_samples, self.ndim_x + self.ndim_y)
@@ -229,12 +703,15 @@ class BaseNNEstimator(LayersPowered, Serializable, BaseDensityEstimator):
                 tf.assign(self.y_noise_std_sym, self.y_noise_std),
             ])
 
-
     def _build_input_layers(self):
         # Input_Layers & placeholders
         self.X_ph = tf.placeholder(tf.float32, shape=(None, self.ndim_x))
         self.Y_ph = tf.placeholder(tf.float32, shape=(None, self.ndim_y))
         self.train_phase = tf.placeholder_with_default(False, None)
+        # per-sample weights of the log-likelihood loss - all ones unless sample weights are fed
+        self.sample_weight_ph = tf.placeholder_with_default(tf.ones(tf.shape(self.X_ph)[:1]), shape=(None,))
+        # scale of the summed log-likelihood loss of a mini-batch (see _nll_scale) - 1 for the whole data
+        self.nll_scale_ph = tf.placeholder_with_default(1.0, shape=(), name='nll_scale')
 
         layer_in_x = L.InputLayer(shape=(None, self.ndim_x), input_var=self.X_ph, name="input_x")
         layer_in_y = L.InputLayer(shape=(None, self.ndim_y), input_var=self.Y_ph, name="input_y")
@@ -1,10 +1,13 @@
 import numpy as np
 import statsmodels.api as sm
+from scipy.special import logsumexp
+from scipy.stats import norm
 
 from cde.utils.async_executor import execute_batch_async_pdf
 from .BaseDensityEstimator import BaseDensityEstimator
 
 MULTIPROC_THRESHOLD = 10**4
+KERNEL_BATCH_SIZE = 10**6 # max. number of (query, training) point pairs per chunk of the weighted kernel sums
 
 class ConditionalKernelDensityEstimation(BaseDensityEstimator):
   """ ConditionalKernelDensityEstimation (CKDE): Nonparametric conditional density estimator that
@@ -48,21 +51,29 @@ class ConditionalKernelDensityEstimation(BaseDensityEstimator):
     self.has_cdf = True
 
 
-  def fit(self, X, Y, **kwargs):
+  def fit(self, X, Y, sample_weight=None, **kwargs):
     """ Since CKDE is a lazy learner, fit just stores the provided training data (X,Y)
 
       Args:
         X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+        sample_weight: (optional) non-negative weights of the samples - numpy array of shape (n_samples,). The kernels
+                       of the samples are weighted accordingly, the bandwidth is selected on the unweighted samples.
 
     """
     X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
+    self.sample_weight = self._handle_sample_weight(sample_weight, X.shape[0])
     self.y_mean, self.y_std = np.mean(Y, axis=0), np.std(Y, axis=0)
 
     dep_type = 'c' * self.ndim_y
     indep_type = 'c' * self.ndim_x
     self.sm_kde = sm.nonparametric.KDEMultivariateConditional(endog=[Y], exog=[X], dep_type=dep_type, indep_type=indep_type, bw=self.bandwidth)
 
+    if self.sample_weight is not None:
+      # the weighted kernel sums are computed directly with the (gaussian) kernels and bandwidths of statsmodels
+      self.X_train, self.Y_train = X, Y
+      self.bw_y, self.bw_x = self.sm_kde.bw[:self.ndim_y], self.sm_kde.bw[self.ndim_y:]
+
     self.fitted = True
     self.can_sample = False
     self.has_cdf = True
@@ -81,6 +92,10 @@ class ConditionalKernelDensityEstimation(BaseDensityEstimator):
     X,Y = self._handle_input_dimensionality(X, Y)
 
     n_samples = X.shape[0]
+    if self.sample_weight is not None:
+      if n_samples >= MULTIPROC_THRESHOLD:
+        return execute_batch_async_pdf(self._weighted_pdf, X, Y, n_jobs=self.n_jobs)
+      return self._weighted_pdf(X, Y)
     if n_samples >= MULTIPROC_THRESHOLD:
       return execute_batch_async_pdf(self.sm_kde.pdf, Y, X, n_jobs=self.n_jobs)
     else:
@@ -100,11 +115,44 @@ class ConditionalKernelDensityEstimation(BaseDensityEstimator):
     assert self.fitted, "model must be fitted to compute likelihood score"
     X, Y = self._handle_input_dimensionality(X, Y)
     n_samples = X.shape[0]
+    if self.sample_weight is not None:
+      if n_samples > MULTIPROC_THRESHOLD:
+        return execute_batch_async_pdf(self._weighted_cdf, X, Y, n_jobs=self.n_jobs)
+      return self._weighted_cdf(X, Y)
     if n_samples > MULTIPROC_THRESHOLD:
       execute_batch_async_pdf(self.sm_kde.cdf, Y, X, n_jobs=self.n_jobs)
     else:
       return self.sm_kde.cdf(endog_predict=Y, exog_predict=X)
 
+  def _weighted_kernel_weights(self, X):
+    # normalized weights w_i * K_h(x - x_i) / sum_j w_j * K_h(x - x_j) of the training kernels - shape (n_query, n_train)
+    log_kernels_x = - 0.5 * np.sum(np.square((X[:, None, :] - self.X_train[None, :, :]) / self.bw_x), axis=-1)
+    with np.errstate(divide='ignore'):  # samples with zero weight get a log-weight of -inf
+      log_weights = log_kernels_x + np.log(self.sample_weight)
+    return np.exp(log_weights - logsumexp(log_weights, axis=1, keepdims=True))
+
+  def _weighted_pdf(self, X, Y):
+    return self._query_chunks(self._weighted_pdf_batch, X, Y)
+
+  def _weighted_cdf(self, X, Y):
+    return self._query_chunks(self._weighted_cdf_batch, X, Y)
+
+  def _query_chunks(self, func, X, Y):
+    # evaluates func on chunks of the query rows - the (n_query, n_train, ndim) arrays of the weighted kernel sums are
+    # bounded by KERNEL_BATCH_SIZE, independent of the number of query points
+    rows_per_batch = max(1, KERNEL_BATCH_SIZE // self.X_train.shape[0])
+    return np.concatenate([np.zeros(0)] + [func(X[start:start + rows_per_batch], Y[start:start + rows_per_batch])
+                                           for start in range(0, X.shape[0], rows_per_batch)])
+
+  def _weighted_pdf_batch(self, X, Y):
+    log_kernels_y = - 0.5 * np.sum(np.square((Y[:, None, :] - self.Y_train[None, :, :]) / self.bw_y), axis=-1)
+    log_normalization = np.sum(np.log(self.bw_y)) + 0.5 * self.ndim_y * np.log(2 * np.pi)
+    return np.sum(self._weighted_kernel_weights(X) * np.exp(log_kernels_y - log_normalization), axis=1)
+
+  def _weighted_cdf_batch(self, X, Y):
+    kernel_cdfs = np.prod(norm.cdf((Y[:, None, :] - self.Y_train[None, :, :]) / self.bw_y), axis=-1)
+    return np.sum(self._weighted_kernel_weights(X) * kernel_cdfs, axis=1)
+
   def sample(self, X):
     raise NotImplementedError("Conditional Kernel Density Estimation is a lazy learner and does not support sampling")
 
@@ -0,0 +1,147 @@
+import numpy as np
+from scipy.special import logsumexp
+
+from .BaseDensityEstimator import BaseDensityEstimator
+from .BaseNNEstimator import BaseNNEstimator
+
+
+class EnsembleEstimator(BaseDensityEstimator):
+  """
+  Ensemble of neural network density estimators (MDN, KMN or NF) with the same configuration that only differ in the
+  random seed of their initialization. All members are built in the same graph and trained in lock-step within one
+  session, so that n_members seeds cost roughly the overhead of a single fit. The members can be evaluated
+  individually; the ensemble itself is the equally weighted mixture of the member densities.
+
+  Args:
+    estimator_class: class of the members - a subclass of BaseNNEstimator
+    name: (str) name space of the ensemble - the members are named name + '_member_i'
+    ndim_x: (int) dimensionality of x variable
+    ndim_y: (int) dimensionality of y variable
+    n_members: (int) number of ensemble members
+    random_seed: (optional) seed (int) of the random number generator which draws the seeds of the members
+    seeds: (optional) list of member seeds - overrides n_members and random_seed
+    **estimator_kwargs: further (hyper-)parameters passed to the constructor of each member
+  """
+
+  def __init__(self, estimator_class, name, ndim_x, ndim_y, n_members=5, random_seed=None, seeds=None,
+               **estimator_kwargs):
+    assert issubclass(estimator_class, BaseNNEstimator), "the ensemble members must be neural network estimators"
+    if seeds is None:
+      seeds = np.random.RandomState(seed=random_seed).randint(0, 10 ** 7, size=n_members)
+    assert len(seeds) > 0
+
+    self.estimator_class = estimator_class
+    self.name = name
+    self.ndim_x = ndim_x
+    self.ndim_y = ndim_y
+    self.seeds = [int(seed) for seed in seeds]
+    self.n_members = len(self.seeds)
+    self.random_state = np.random.RandomState(seed=random_seed)
+
+    self.members = [estimator_class(name='%s_member_%i' % (name, i), ndim_x=ndim_x, ndim_y=ndim_y, random_seed=seed,
+                                    **estimator_kwargs) for i, seed in enumerate(self.seeds)]
+
+    self.can_sample = all(member.can_sample for member in self.members)
+    self.has_pdf = True
+    self.has_cdf = all(member.has_cdf for member in self.members)
+
+    self.fitted = False
+
+  def fit(self, X, Y, verbose=False, **kwargs):
+    """ Fits all ensemble members to the provided data - the members are initialized with their respective seeds and
+    trained in lock-step for n_training_epochs
+
+      Args:
+        X: numpy array to be conditioned on - shape: (n_samples, n_dim_x) - or a callable that returns an iterable of
+           (X_chunk, Y_chunk) tuples for every epoch, in which case Y must be None and the data is streamed
+        Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+    """
+    # the training data (and its cached statistics) is shared - the members shuffle it with their own random states
+    data = self.members[0]._training_data(X, Y)
+    for member in self.members:
+      member._initialize_fit(data)
+
+    BaseNNEstimator._fit_lockstep(self.members, [data] * self.n_members)
+    self.fitted = True
+
+    if verbose:
+      print("fitted ensemble of {} {} members".format(self.n_members, self.estimator_class.__name__))
+
+  def pdf(self, X, Y):
+    """ Predicts the conditional likelihood p(y|x) of the ensemble, i.e. the mean of the member likelihoods
+
+       Args:
+         X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+       Returns:
+          conditional likelihood p(y|x) - numpy array of shape (n_query_samples, )
+    """
+    return np.mean([member.pdf(X, Y) for member in self.members], axis=0)
+
+  def log_pdf(self, X, Y):
+    """ Predicts the conditional log-probability log p(y|x) of the ensemble - computed stably as the logsumexp of the
+    member log-probabilities
+
+       Args:
+         X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+       Returns:
+          conditional log-probability log p(y|x) - numpy array of shape (n_query_samples, )
+    """
+    return logsumexp(self.member_log_pdfs(X, Y), axis=0) - np.log(self.n_members)
+
+  def cdf(self, X, Y):
+    """ Predicts the conditional cumulative probability p(Y<=y|X=x) of the ensemble
+
+       Args:
+         X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+       Returns:
+         conditional cumulative probability p(Y<=y|X=x) - numpy array of shape (n_query_samples, )
+    """
+    assert self.has_cdf
+    return np.mean([member.cdf(X, Y) for member in self.members], axis=0)
+
+  def sample(self, X):
+    """ sample from the ensemble mixture - each row is sampled from a uniformly drawn member
+
+      Args:
+        X: values to be conditioned on when sampling - numpy array of shape (n_instances, n_dim_x)
+
+      Returns: tuple (X, Y)
+        - X - the values to conditioned on that were provided as argument - numpy array of shape (n_samples, ndim_x)
+        - Y - conditional samples from the model p(y|x) - numpy array of shape (n_samples, ndim_y)
+    """
+    assert self.fitted and self.can_sample
+    X = self._handle_input_dimensionality(X)
+    member_idx = self.random_state.randint(0, self.n_members, size=X.shape[0])
+
+    Y = np.zeros((X.shape[0], self.ndim_y))
+    for i, member in enumerate(self.members):
+      rows = member_idx == i
+      if np.any(rows):
+        Y[rows] = member.sample(X[rows], random_state=self.random_state.randint(0, 2 ** 31))[1]
+    return X, Y
+
+  def member_log_pdfs(self, X, Y):
+    """ Returns: conditional log-probabilities of the individual members - numpy array of shape (n_members, n_samples) """
+    assert self.fitted, "model must be fitted to compute likelihood score"
+    return np.stack([member.log_pdf(X, Y) for member in self.members])
+
+  def member_scores(self, X, Y):
+    """ Computes the mean conditional log-likelihood of the provided data (X, Y) for each member
+
+      Returns:
+        list of the mean log-likelihoods of the members (in the order of self.seeds)
+    """
+    return list(np.mean(self.member_log_pdfs(X, Y), axis=1))
+
+  def _param_grid(self):
+    return self.members[0]._param_grid()
+
+  def __str__(self):
+    return "\nEstimator type: {}\n estimator_class: {}\n n_members: {}\n seeds: {}\n".format(
+      self.__class__.__name__, self.estimator_class.__name__, self.n_members, self.seeds)
@@ -2,16 +2,13 @@
 # code skeleton from https://github.com/janvdvegt/KernelMixtureNetwork
 # this version additionally supports fit_by_crossval and multidimentional Y
 #
-import math
 import numpy as np
-import sklearn
 import tensorflow as tf
-import edward as ed
-from edward.models import Categorical, Mixture, MultivariateNormalDiag
 from cde.utils.tf_utils.network import MLP
 import cde.utils.tf_utils.layers as L
 from cde.utils.tf_utils.layers_powered import LayersPowered
 from cde.utils.serializable import Serializable
+from cde.utils.numpy_predictor import NumpyMixturePredictor
 #import matplotlib.pyplot as plt
 
 
@@ -50,6 +47,8 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
           weight_normalization: boolean specifying whether weight normalization shall be used
           data_normalization: (boolean) whether to normalize the data (X and Y) to exhibit zero-mean and std
           dropout: (float) the probability of switching off nodes during training
+          batch_size: (optional) number of samples per training step - if None, the whole data is used in each step
+          shuffle: (boolean) whether to shuffle the training data before each epoch of mini-batch training
           random_seed: (optional) seed (int) of the random number generators used
   """
 
@@ -57,7 +56,7 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
                init_scales='default', hidden_sizes=(16, 16), hidden_nonlinearity=tf.nn.tanh, train_scales=True,
                n_training_epochs=1000, x_noise_std=None, y_noise_std=None, adaptive_noise_fn=None,  entropy_reg_coef=0.0,
                weight_decay=0.0, weight_normalization=True, data_normalization=True, dropout=0.0, l2_reg=0.0, l1_reg=0.0,
-               random_seed=None):
+               batch_size=None, shuffle=True, random_seed=None):
 
     Serializable.quick_init(self, locals())
     self._check_uniqueness_of_scope(name)
@@ -92,6 +91,8 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
     self.weight_normalization = weight_normalization
     self.data_normalization = data_normalization
     self.dropout = dropout
+    self.batch_size = batch_size
+    self.shuffle = shuffle
 
     if type(init_scales) is str and init_scales == 'default':
         init_scales = np.array([0.7, 0.3])
@@ -111,43 +112,63 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
     # build tensorflow model
     self._build_model()
 
-  def fit(self, X, Y, eval_set=None, verbose=True):
+  def fit(self, X, Y, eval_set=None, verbose=True, patience=None, min_delta=0.0, eval_interval=1, max_fit_time=None,
+          sample_weight=None, callbacks=None):
     """ Fits the conditional density model with provided data
 
       Args:
-        X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+        X: numpy array to be conditioned on - shape: (n_samples, n_dim_x) - or a callable that returns an iterable of
+           (X_chunk, Y_chunk) tuples for every epoch, in which case Y must be None and the data is streamed
         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
         eval_set: (tuple) eval/test set - tuple (X_test, Y_test)
         verbose: (boolean) controls the verbosity (console output)
+        patience: (optional) number of evaluations without improvement of the validation log-loss (or the training
+                  log-loss if no eval_set is provided) after which the training is stopped
+        min_delta: (float) minimum decrease of the monitored log-loss that counts as an improvement
+        eval_interval: (int) number of epochs between two evaluations of the monitored log-loss
+        max_fit_time: (optional) wall-clock time budget of the training in seconds
+        sample_weight: (optional) non-negative weights of the training samples - numpy array of shape (n_samples,).
+                       The log-likelihood of each sample in the training loss is weighted accordingly.
+        callbacks: (optional) list of training callbacks (see cde.utils.callbacks), e.g. collectors of the loss curve
+                   or the wall time per training phase
+        --> if patience or max_fit_time is set, the parameters with the best monitored log-loss are restored at the end
     """
-    X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
+    early_stopping = self._early_stopping(patience, min_delta, eval_interval, max_fit_time)
+    data = self._training_data(X, Y, sample_weight=sample_weight)
 
     if eval_set is not None:
       eval_set = self._handle_input_dimensionality(*eval_set)
 
+    self._initialize_fit(data)
+
+    # train the model
+    self._partial_fit(data, n_epoch=self.n_training_epochs, eval_set=eval_set, verbose=verbose,
+                      early_stopping=early_stopping, callbacks=callbacks)
+    self.fitted = True
+
+    if verbose:
+      print("optimal scales: {}".format(self.sess.run(self.scales)))
+
+  def _initialize_fit(self, data):
+    # everything of fit except for the training epochs
     self._setup_inference_and_initialize()
 
     # data normalization if desired
+    # the kernel centers are sampled from Y - or from a uniform sub-sample of Y if the data is not held in memory
+    Y_sample = data.statistics(random_state=self.random_state)['Y_sample']
     if self.data_normalization:  # this must happen after the initialization
-      self._compute_data_normalization(X, Y)  # computes mean & std of data and assigns it to tf graph for normalization
-      Y_normalized = (Y - self.data_statistics['Y_mean']) / (self.data_statistics['Y_std'] + 1e-8)
+      self._compute_data_normalization(data)  # computes mean & std of data and assigns it to tf graph for normalization
+      Y_normalized = (Y_sample - self.data_statistics['Y_mean']) / (self.data_statistics['Y_std'] + 1e-8)
     else:
-      Y_normalized = Y
+      Y_normalized = Y_sample
 
-    self._compute_noise_intensity(X, Y)
+    self._compute_noise_intensity(data)
 
     # sample locations and assign them to tf locs variable
     sampled_locs = sample_center_points(Y_normalized, method=self.center_sampling_method, k=self.n_centers,
                                      keep_edges=self.keep_edges, random_state=self.random_state)
     self.sess.run(tf.assign(self.locs, sampled_locs))
 
-    # train the model
-    self._partial_fit(X, Y, n_epoch=self.n_training_epochs, eval_set=eval_set, verbose=verbose)
-    self.fitted = True
-
-    if verbose:
-      print("optimal scales: {}".format(self.sess.run(self.scales)))
-
   def _build_model(self):
     """
     implementation of the KMN
@@ -159,9 +180,6 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
       self.X_in = L.get_output(self.layer_in_x)
       self.Y_in = L.get_output(self.layer_in_y)
 
-      # get batch size
-      self.batch_size = tf.shape(self.X_ph)[0]
-
       # create core multi-layer perceptron
       core_network = MLP(
         name="core_network",
@@ -173,6 +191,7 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
         dropout_ph=self.dropout_ph if self.dropout else None
       )
 
+      self.core_network = core_network
       self.core_output_layer = core_network.output_layer
 
       # weights of the mixture components
@@ -184,9 +203,6 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
       self.locs = tf.Variable(np.zeros((self.n_centers, self.ndim_y)), name="locs", trainable=False, dtype=tf.float32) # assign sampled locs when fitting
       self.locs_layer = L.VariableLayer(core_network.input_layer, (self.n_centers, self.ndim_y), variable=self.locs, name="locs", trainable=False)
 
-      self.locs_array = tf.unstack(tf.transpose(tf.multiply(tf.ones((self.batch_size, self.n_centers, self.ndim_y)), self.locs), perm=[1, 0, 2]))
-      assert len(self.locs_array) == self.n_centers
-
       # scales of the gaussian kernels
       log_scales_layer = L.VariableLayer(core_network.input_layer, (self.n_scales,),
                                          variable=tf.Variable(self.init_scales_softplus, dtype=tf.float32, trainable=self.train_scales),
@@ -194,26 +210,18 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
 
       self.scales_layer = L.NonlinearityLayer(log_scales_layer, nonlinearity=tf.nn.softplus)
       self.scales = L.get_output(self.scales_layer)
-      self.scales_array = scales_array = tf.unstack(tf.transpose(tf.multiply(tf.ones((self.batch_size, self.ndim_y, self.n_scales)), self.scales), perm=[2,0,1]))
-      assert len(self.scales_array) == self.n_scales
 
-      # put mixture components together
-      self.y_input = L.get_output(self.layer_in_y)
-      self.cat = cat = Categorical(logits=self.logits)
-      self.components = components = [MultivariateNormalDiag(loc=loc, scale_diag=scale) for loc in self.locs_array for scale in scales_array]
-      self.mixture = mixture = Mixture(cat=cat, components=components)
+      # components are ordered center-major (each center with all scales) - shared by all rows of the batch
+      component_locs = tf.reshape(tf.tile(tf.expand_dims(self.locs, axis=1), (1, self.n_scales, 1)), (1, -1, self.ndim_y))
+      component_scales = tf.reshape(tf.tile(tf.expand_dims(self.scales, axis=1), (self.n_centers, self.ndim_y)), (1, -1, self.ndim_y))
 
       # regularization
       self._add_softmax_entropy_regularization()
       self._add_l1_l2_regularization(core_network)
 
-      # tensor to compute probabilities
-      if self.data_normalization:
-        self.pdf_ = mixture.prob(self.y_input) / tf.reduce_prod(self.std_y_sym)
-        self.log_pdf_ = mixture.log_prob(self.y_input) - tf.reduce_sum(tf.log(self.std_y_sym))
-      else:
-        self.pdf_ = mixture.prob(self.y_input)
-        self.log_pdf_ = mixture.log_prob(self.y_input)
+      # tensors to compute (log-)probabilities - fused over all mixture components
+      self.y_input = L.get_output(self.layer_in_y)
+      self._build_log_pdf(self._mixture_log_prob(self.logits, component_locs, component_scales, self.y_input))
 
       # symbolic tensors for getting the unnormalized mixture components
       if self.data_normalization:
@@ -226,6 +234,21 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
     # initialize LayersPowered --> provides functions for serializing tf models
     LayersPowered.__init__(self, [self.core_output_layer, self.locs_layer, self.scales_layer, self.layer_in_y])
 
+  def export_numpy(self):
+    """ Exports the fitted KMN as a pure numpy predictor which requires neither tensorflow nor edward
+
+      Returns:
+        NumpyMixturePredictor with the same pdf, log_pdf, cdf, sampling and mixture moments as the fitted KMN
+    """
+    mlp, data_statistics = self._export_network()
+    locs, scales = self.sess.run([self.locs, self.scales])
+
+    # components are ordered center-major (each center with all scales) - as in the tensorflow graph
+    kernel_locs = np.repeat(locs, self.n_scales, axis=0)
+    kernel_scales = np.tile(scales[:, None], (self.n_centers, self.ndim_y))
+    return NumpyMixturePredictor(self.name, self.ndim_x, self.ndim_y, mlp, n_components=self.n_centers * self.n_scales,
+                                 kernel_locs=kernel_locs, kernel_scales=kernel_scales, data_statistics=data_statistics)
+
   def _param_grid(self):
     param_grid = {
         "n_training_epochs": [500, 1000],
@@ -235,7 +258,7 @@ class KernelMixtureNetwork(BaseNNMixtureEstimator):
     }
     return param_grid
 
-  def _get_mixture_components(self, X):
+  def _compute_mixture_components(self, X):
     assert self.fitted
 
     locs, weights, scales = self.sess.run([self.locs_unnormalized, self.weights, self.scales_unnormalized], feed_dict={self.X_ph: X})
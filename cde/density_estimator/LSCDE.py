@@ -51,10 +51,11 @@ class LSConditionalDensityEstimation(BaseDensityEstimator):
     self.has_pdf = True
     self.has_cdf = False
 
-  def _build_model(self, X, Y):
+  def _build_model(self, X, Y, sample_weight=None):
     # save mean and variance of data for normalization
-    self.x_mean, self.y_mean = np.mean(X, axis=0), np.mean(Y, axis=0)
-    self.x_std, self.y_std = np.std(X, axis=0),  np.std(Y, axis=0)
+    self.x_mean, self.y_mean = np.average(X, axis=0, weights=sample_weight), np.average(Y, axis=0, weights=sample_weight)
+    self.x_std = np.sqrt(np.average(np.square(X - self.x_mean), axis=0, weights=sample_weight))
+    self.y_std = np.sqrt(np.average(np.square(Y - self.y_mean), axis=0, weights=sample_weight))
 
     # get locations of the gaussian kernel centers
     if self.center_sampling_method == 'all':
@@ -74,26 +75,29 @@ class LSConditionalDensityEstimation(BaseDensityEstimator):
 
     assert self.centr_x.shape == (n_locs, self.ndim_x) and self.centr_y.shape == (n_locs, self.ndim_y)
 
-  def fit(self, X, Y, **kwargs):
+  def fit(self, X, Y, sample_weight=None, **kwargs):
     """ Fits the conditional density model with provided data
 
       Args:
         X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+        sample_weight: (optional) non-negative weights of the samples - numpy array of shape (n_samples,). The
+                       empirical averages h and H of the least-squares problem are weighted accordingly.
     """
     # assert that both X an Y are 2D arrays with shape (n_samples, n_dim)
 
     X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
     self.ndim_y, self.ndim_x = Y.shape[1], X.shape[1]
+    sample_weight = self._handle_sample_weight(sample_weight, X.shape[0])
 
-    self._build_model(X, Y)
+    self._build_model(X, Y, sample_weight=sample_weight)
 
     X_normalized, Y_normalized = self._normalize(X, Y)
 
     # determine the kernel weights alpha
-    self.h = np.mean(self._gaussian_kernel(X_normalized, Y_normalized), axis=0)
+    self.h = np.average(self._gaussian_kernel(X_normalized, Y_normalized), axis=0, weights=sample_weight)
 
-    a = np.mean(norm_along_axis_1(X_normalized,self.centr_x),axis=0)
+    a = np.average(norm_along_axis_1(X_normalized,self.centr_x), axis=0, weights=sample_weight)
     b = norm_along_axis_1(self.centr_y, self.centr_y)
     eta = 2 * np.add.outer(a,a) + b
 
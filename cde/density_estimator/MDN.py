@@ -1,10 +1,10 @@
 import numpy as np
 import tensorflow as tf
-from edward.models import Categorical, Mixture, MultivariateNormalDiag
 from cde.utils.tf_utils.network import MLP
 import cde.utils.tf_utils.layers as L
 from cde.utils.tf_utils.layers_powered import LayersPowered
 from cde.utils.serializable import Serializable
+from cde.utils.numpy_predictor import NumpyMixturePredictor
 
 
 from .BaseNNMixtureEstimator import BaseNNMixtureEstimator
@@ -33,6 +33,8 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
         weight_normalization: (boolean) whether weight normalization shall be used
         data_normalization: (boolean) whether to normalize the data (X and Y) to exhibit zero-mean and std
         dropout: (float) the probability of switching off nodes during training
+        batch_size: (optional) number of samples per training step - if None, the whole data is used in each step
+        shuffle: (boolean) whether to shuffle the training data before each epoch of mini-batch training
         random_seed: (optional) seed (int) of the random number generators used
     """
 
@@ -40,7 +42,7 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
   def __init__(self, name, ndim_x, ndim_y, n_centers=10, hidden_sizes=(16, 16), hidden_nonlinearity=tf.nn.tanh,
                n_training_epochs=1000, x_noise_std=None, y_noise_std=None, adaptive_noise_fn=None, entropy_reg_coef=0.0,
                weight_decay=0.0, weight_normalization=True, data_normalization=True, dropout=0.0, l2_reg=0.0, l1_reg=0.0,
-               random_seed=None):
+               batch_size=None, shuffle=True, random_seed=None):
 
     Serializable.quick_init(self, locals())
     self._check_uniqueness_of_scope(name)
@@ -71,6 +73,8 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
     self.weight_normalization = weight_normalization
     self.data_normalization = data_normalization
     self.dropout = dropout
+    self.batch_size = batch_size
+    self.shuffle = shuffle
 
     self.can_sample = True
     self.has_pdf = True
@@ -81,32 +85,50 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
     # build tensorflow model
     self._build_model()
 
-  def fit(self, X, Y, random_seed=None, verbose=True, eval_set=None, **kwargs):
+  def fit(self, X, Y, random_seed=None, verbose=True, eval_set=None, patience=None, min_delta=0.0, eval_interval=1,
+          max_fit_time=None, sample_weight=None, callbacks=None, **kwargs):
     """ Fits the conditional density model with provided data
 
       Args:
-        X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+        X: numpy array to be conditioned on - shape: (n_samples, n_dim_x) - or a callable that returns an iterable of
+           (X_chunk, Y_chunk) tuples for every epoch, in which case Y must be None and the data is streamed
         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
         eval_set: (tuple) eval/test set - tuple (X_test, Y_test)
         verbose: (boolean) controls the verbosity (console output)
+        patience: (optional) number of evaluations without improvement of the validation log-loss (or the training
+                  log-loss if no eval_set is provided) after which the training is stopped
+        min_delta: (float) minimum decrease of the monitored log-loss that counts as an improvement
+        eval_interval: (int) number of epochs between two evaluations of the monitored log-loss
+        max_fit_time: (optional) wall-clock time budget of the training in seconds
+        sample_weight: (optional) non-negative weights of the training samples - numpy array of shape (n_samples,).
+                       The log-likelihood of each sample in the training loss is weighted accordingly.
+        callbacks: (optional) list of training callbacks (see cde.utils.callbacks), e.g. collectors of the loss curve
+                   or the wall time per training phase
+        --> if patience or max_fit_time is set, the parameters with the best monitored log-loss are restored at the end
 
     """
-    X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
+    early_stopping = self._early_stopping(patience, min_delta, eval_interval, max_fit_time)
+    data = self._training_data(X, Y, sample_weight=sample_weight)
 
     if eval_set is not None:
       eval_set = self._handle_input_dimensionality(*eval_set)
 
+    self._initialize_fit(data)
+
+    # train the model
+    self._partial_fit(data, n_epoch=self.n_training_epochs, verbose=verbose, eval_set=eval_set,
+                      early_stopping=early_stopping, callbacks=callbacks)
+    self.fitted = True
+
+  def _initialize_fit(self, data):
+    # everything of fit except for the training epochs
     self._setup_inference_and_initialize()
 
     # data normalization if desired
     if self.data_normalization: # this must happen after the initialization
-      self._compute_data_normalization(X, Y)  # computes mean & std of data and assigns it to tf graph for normalization
+      self._compute_data_normalization(data)  # computes mean & std of data and assigns it to tf graph for normalization
 
-    self._compute_noise_intensity(X, Y)
-
-    # train the model
-    self._partial_fit(X, Y, n_epoch=self.n_training_epochs, verbose=verbose, eval_set=eval_set)
-    self.fitted = True
+    self._compute_noise_intensity(data)
 
   def _build_model(self):
     """
@@ -130,6 +152,7 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
               dropout_ph=self.dropout_ph if self.dropout else None
           )
 
+      self.core_network = core_network
       core_output_layer = core_network.output_layer
 
       # slice output of MLP into three equally sized parts for loc, scale and mixture weights
@@ -151,27 +174,13 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
       self.softmax_layer_weights = L.NonlinearityLayer(slice_layer_weights, nonlinearity=tf.nn.softmax)
       self.weights = L.get_output(self.softmax_layer_weights)
 
-      # # put mixture components together
-      self.y_input = L.get_output(self.layer_in_y)
-      self.cat = cat = Categorical(logits=self.logits)
-      self.components = components = [MultivariateNormalDiag(loc=loc, scale_diag=scale) for loc, scale
-                     in zip(tf.unstack(self.locs, axis=1), tf.unstack( self.scales, axis=1))]
-      self.mixture = mixture = Mixture(cat=cat, components=components, value=tf.zeros_like(self.y_input))
-
       # regularization
       self._add_softmax_entropy_regularization()
       self._add_l1_l2_regularization(core_network)
 
-      # tensor to store samples
-      self.samples = mixture.sample() #TODO either use it or remove it
-
-      # tensor to compute probabilities
-      if self.data_normalization:
-        self.pdf_ = mixture.prob(self.y_input) / tf.reduce_prod(self.std_y_sym)
-        self.log_pdf_ = mixture.log_prob(self.y_input) - tf.reduce_sum(tf.log(self.std_y_sym))
-      else:
-        self.pdf_ = mixture.prob(self.y_input)
-        self.log_pdf_ = mixture.log_prob(self.y_input)
+      # tensors to compute (log-)probabilities - fused over all mixture components
+      self.y_input = L.get_output(self.layer_in_y)
+      self._build_log_pdf(self._mixture_log_prob(self.logits, self.locs, self.scales, self.y_input))
 
       # symbolic tensors for getting the unnormalized mixture components
       if self.data_normalization:
@@ -185,6 +194,16 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
     LayersPowered.__init__(self, [self.softmax_layer_weights, self.softplus_layer_scales, self.reshape_layer_locs,
                                   self.layer_in_y])
 
+  def export_numpy(self):
+    """ Exports the fitted MDN as a pure numpy predictor which requires neither tensorflow nor edward
+
+      Returns:
+        NumpyMixturePredictor with the same pdf, log_pdf, cdf, sampling and mixture moments as the fitted MDN
+    """
+    mlp, data_statistics = self._export_network()
+    return NumpyMixturePredictor(self.name, self.ndim_x, self.ndim_y, mlp, n_components=self.n_centers,
+                                 data_statistics=data_statistics)
+
   def _param_grid(self):
     param_grid = {
         "n_training_epochs": [500, 1000],
@@ -194,7 +213,7 @@ class MixtureDensityNetwork(BaseNNMixtureEstimator):
     }
     return param_grid
 
-  def _get_mixture_components(self, X):
+  def _compute_mixture_components(self, X):
     assert self.fitted
     weights, locs, scales = self.sess.run([self.weights, self.locs_unnormalized, self.scales_unnormalized], feed_dict={self.X_ph: X})
     assert weights.shape[0] == locs.shape[0] == scales.shape[0] == X.shape[0]
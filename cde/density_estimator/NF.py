@@ -8,6 +8,8 @@ from cde.utils.tf_utils.adamW import AdamWOptimizer
 from .BaseNNEstimator import BaseNNEstimator
 from .normalizing_flows import FLOWS
 from cde.utils.serializable import Serializable
+from cde.utils.callbacks import EpochTimer
+from cde.utils.numpy_predictor import NumpyNormalizingFlowPredictor
 
 
 class NormalizingFlowEstimator(BaseNNEstimator):
@@ -32,13 +34,15 @@ class NormalizingFlowEstimator(BaseNNEstimator):
             weight_normalization: (boolean) whether weight normalization shall be used for the neural network
             data_normalization: (boolean) whether to normalize the data (X and Y) to exhibit zero-mean and uniform-std
             dropout: (float) the probability of switching off nodes during training
+            batch_size: (optional) number of samples per training step - if None, the whole data is used in each step
+            shuffle: (boolean) whether to shuffle the training data before each epoch of mini-batch training
             random_seed: (optional) seed (int) of the random number generators used
     """
 
     def __init__(self, name, ndim_x, ndim_y, flows_type=None, n_flows=10, hidden_sizes=(16, 16),
                  hidden_nonlinearity=tf.tanh, n_training_epochs=1000, x_noise_std=None, y_noise_std=None, adaptive_noise_fn=None,
                  weight_decay=0.0, weight_normalization=True, data_normalization=True, dropout=0.0, l2_reg=0.0, l1_reg=0.0,
-                 random_seed=None):
+                 batch_size=None, shuffle=True, random_seed=None):
         Serializable.quick_init(self, locals())
         self._check_uniqueness_of_scope(name)
 
@@ -85,6 +89,10 @@ class NormalizingFlowEstimator(BaseNNEstimator):
         # the prob of dropping a node
         self.dropout = dropout
 
+        # mini-batch training
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
         # gradients for planar flows tend to explode -> clip them by global norm
         self.gradient_clipping = True if 'planar' in flows_type else False
 
@@ -99,21 +107,48 @@ class NormalizingFlowEstimator(BaseNNEstimator):
         # build tensorflow model
         self._build_model()
 
-    def fit(self, X, Y, random_seed=None, verbose=True, eval_set=None, **kwargs):
+    def fit(self, X, Y, random_seed=None, verbose=True, eval_set=None, patience=None, min_delta=0.0, eval_interval=1,
+            max_fit_time=None, sample_weight=None, callbacks=None, **kwargs):
         """
         Fit the model with to the provided data
 
-        :param X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+        :param X: numpy array to be conditioned on - shape: (n_samples, n_dim_x) - or a callable that returns an iterable
+                  of (X_chunk, Y_chunk) tuples for every epoch, in which case Y must be None and the data is streamed
         :param Y: numpy array of y targets - shape: (n_samples, n_dim_y)
         :param eval_set: (tuple) eval/test dataset - tuple (X_test, Y_test)
         :param verbose: (boolean) controls the verbosity of console output
+        :param patience: (optional) number of evaluations without improvement of the validation log-loss (or the
+                         training log-loss if no eval_set is provided) after which the training is stopped
+        :param min_delta: (float) minimum decrease of the monitored log-loss that counts as an improvement
+        :param eval_interval: (int) number of epochs between two evaluations of the monitored log-loss
+        :param max_fit_time: (optional) wall-clock time budget of the training in seconds
+        :param sample_weight: (optional) non-negative weights of the training samples - numpy array of shape (n_samples,).
+                              The log-likelihood of each sample in the training loss is weighted accordingly.
+        :param callbacks: (optional) list of training callbacks (see cde.utils.callbacks), e.g. collectors of the loss
+                          curve or the wall time per training phase
+        --> if patience or max_fit_time is set, the parameters with the best monitored log-loss are restored at the end
         """
-
-        X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
+        early_stopping = self._early_stopping(patience, min_delta, eval_interval, max_fit_time)
+        data = self._training_data(X, Y, sample_weight=sample_weight)
 
         if eval_set:
             eval_set = tuple(self._handle_input_dimensionality(x) for x in eval_set)
 
+        self._initialize_fit(data)
+        self._partial_fit(data, n_epoch=self._n_fit_epochs(), eval_set=eval_set, verbose=verbose,
+                          early_stopping=early_stopping, callbacks=callbacks)
+        self.fitted = True
+
+    def _conditional_location_scale(self, x_cond):
+        # no closed-form moments -> grid estimates of the conditional mean and standard deviation for the brackets
+        return self._grid_location_scale(x_cond) if self.ndim_y == 1 else None
+
+    def _n_fit_epochs(self):
+        # the normalizing flow is trained for one epoch more than n_training_epochs
+        return self.n_training_epochs + 1
+
+    def _initialize_fit(self, data):
+        # everything of fit except for the training epochs
         # If no session has yet been created, create one and make it the default
         self.sess = tf.get_default_session() if tf.get_default_session() else tf.InteractiveSession()
 
@@ -121,22 +156,39 @@ class NormalizingFlowEstimator(BaseNNEstimator):
         tf.initializers.variables(var_list, name='init').run()
 
         if self.data_normalization:
-            self._compute_data_normalization(X, Y)
+            self._compute_data_normalization(data)
+
+        self._compute_noise_intensity(data)
+
+    def _partial_fit(self, data, n_epoch=1, eval_set=None, verbose=True, early_stopping=None, callbacks=None):
+        """
+        update model - one training step per mini-batch of the training data (TrainingData). If an EarlyStopping
+        monitor is provided, the training may end before n_epoch and the best parameters are restored. The callbacks
+        (see cde.utils.callbacks) are called after every epoch and at the end of the training.
+        """
+        fit_timer, n_epochs_trained = EpochTimer(), 0
+        for i in range(n_epoch):
+            timer, n_epochs_trained = EpochTimer(), i + 1
 
-        self._compute_noise_intensity(X, Y)
+            # one training step per mini-batch - the log-loss of the epoch is accumulated from the batches
+            log_loss, n_samples = self._train_epoch(data, timer)
+            eval_loss_fn = self._eval_loss_fn(eval_set, self.log_loss, timer) if eval_set else None
 
-        for i in range(0, self.n_training_epochs + 1):
-            self.sess.run(self.train_step,
-                          feed_dict={self.X_ph: X, self.Y_ph: Y, self.train_phase: True, self.dropout_ph: self.dropout})
             if verbose and not i % 100:
-                log_loss = self.sess.run(self.log_loss, feed_dict={self.X_ph: X, self.Y_ph: Y})
                 if not eval_set:
-                    print('Step {:4}: train log-loss {: .4f}'.format(i, log_loss))
+                    with timer.phase('progress'):
+                        print('Step {:4}: train log-loss {: .4f}'.format(i, log_loss))
                 else:
-                    eval_ll = self.sess.run(self.log_loss, feed_dict={self.X_ph: eval_set[0], self.Y_ph: eval_set[1]})
-                    print('Step {:4}: train log-loss {: .4f} eval log-loss {: .4f}'.format(i, log_loss, eval_ll))
+                    eval_ll = eval_loss_fn() * eval_set[0].shape[0]
+                    with timer.phase('progress'):
+                        print('Step {:4}: train log-loss {: .4f} eval log-loss {: .4f}'.format(i, log_loss, eval_ll))
 
-        self.fitted = True
+            if self._end_epoch(callbacks, early_stopping, i, log_loss / n_samples, n_samples, timer, eval_loss_fn):
+                break
+
+        self._finish_early_stopping(early_stopping, verbose=verbose)
+        self._invalidate_output_cache()
+        self._end_fit(callbacks, early_stopping, n_epochs_trained, fit_timer)
 
     def reset_fit(self):
         """
@@ -145,6 +197,32 @@ class NormalizingFlowEstimator(BaseNNEstimator):
         tf.reset_default_graph()
         self._build_model()
         self.fitted = False
+        self._invalidate_output_cache()
+
+    def _train_op(self):
+        return self.train_step
+
+    def _optimizer(self):
+        return AdamWOptimizer(self.weight_decay, learning_rate=5e-3) if self.weight_decay else tf.train.AdamOptimizer()
+
+    def _feed_dict(self, X, Y):
+        # with the output cache enabled, the (cached) flow parameters are fed instead of X -> the MLP is skipped
+        if self.output_cache_size:
+            return {self.flow_params_: self._get_flow_params(X), self.Y_ph: Y}
+        return {self.X_ph: X, self.Y_ph: Y}
+
+    def _get_flow_params(self, X):
+        return self._cached_network_outputs(X, lambda x: self.sess.run(self.flow_params_, feed_dict={self.X_ph: x}))
+
+    def export_numpy(self):
+        """
+        Exports the fitted model as a pure numpy predictor which requires neither tensorflow nor edward
+
+        :return: NumpyNormalizingFlowPredictor with the same pdf, log_pdf and cdf as the fitted estimator
+        """
+        mlp, data_statistics = self._export_network()
+        return NumpyNormalizingFlowPredictor(self.name, self.ndim_x, self.ndim_y, mlp, tuple(self.flows_type),
+                                             data_statistics=data_statistics)
 
     def _param_grid(self):
         return {
@@ -192,7 +270,8 @@ class NormalizingFlowEstimator(BaseNNEstimator):
                 weight_normalization=self.weight_normalization,
                 dropout_ph=self.dropout_ph if self.dropout else None
             )
-            outputs = L.get_output(core_network.output_layer)
+            self.core_network = core_network
+            self.flow_params_ = outputs = L.get_output(core_network.output_layer)
             flow_params = tf.split(value=outputs, num_or_size_splits=param_split_sizes, axis=1)
 
             # instanciate the flows with their parameters
@@ -230,22 +309,21 @@ class NormalizingFlowEstimator(BaseNNEstimator):
             if self.data_normalization:
                 self.pdf_ = self.pdf_ / tf.reduce_prod(self.std_y_sym)
                 self.log_pdf_ = self.log_pdf_ - tf.reduce_sum(tf.log(self.std_y_sym))
-                # cdf is only implemented for 1-D
-                if self.ndim_y == 1:
-                    self.cdf_ = self.cdf_ / tf.reduce_prod(self.std_y_sym)
+                # the cdf is invariant under the normalization of y -> no correction
 
             # regularization
             self._add_l1_l2_regularization(core_network)
 
             self.loss = -tf.reduce_prod(self.pdf_)
             self.reg_loss = tf.reduce_sum(tf.losses.get_regularization_losses(scope=self.name)) #r egularization losses
-            self.log_loss = -tf.reduce_sum(self.log_pdf_) + self.reg_loss
+            self.nll_loss = -tf.reduce_sum(self.sample_weight_ph * self.log_pdf_)
+            self.log_loss = self.nll_scale_ph * self.nll_loss + self.reg_loss
 
-            optimizer = AdamWOptimizer(self.weight_decay, learning_rate=5e-3) if self.weight_decay else tf.train.AdamOptimizer()
+            optimizer = self._optimizer()
 
             if self.gradient_clipping:
                 gradients, variables = zip(*optimizer.compute_gradients(self.log_loss))
-                gradients, _ = tf.clip_by_global_norm(gradients, 3e5)
+                gradients, _ = tf.clip_by_global_norm(gradients, self.gradient_clip_norm)
                 self.train_step = optimizer.apply_gradients(zip(gradients, variables))
             else:
                 self.train_step = optimizer.minimize(self.log_loss)
@@ -60,15 +60,18 @@ class NeighborKernelDensityEstimation(BaseDensityEstimator):
     self.has_pdf = True
     self.has_cdf = False
 
-  def fit(self, X, Y, **kwargs):
+  def fit(self, X, Y, sample_weight=None, **kwargs):
     """ Since NKDE is a lazy learner, fit just stores the provided training data (X,Y)
 
       Args:
         X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
         Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+        sample_weight: (optional) non-negative weights of the samples - numpy array of shape (n_samples,). The
+                       neighborhood Gaussians of the samples are weighted accordingly.
 
     """
     X, Y = self._handle_input_dimensionality(X, Y, fitting=True)
+    self.sample_weight = self._handle_sample_weight(sample_weight, X.shape[0])
 
     self._build_model(X, Y)
 
@@ -130,14 +133,15 @@ class NeighborKernelDensityEstimation(BaseDensityEstimator):
     for i in range(self.n_train_points):
       conditional_log_densities[i] = self._log_density(bandwidth, kernel_weights_loo[i, :], self.Y_train[i, :])
 
-    return np.mean(conditional_log_densities)
+    return np.average(conditional_log_densities, weights=self.sample_weight)
 
   def _build_model(self, X, Y):
     # save mean and std of data for normalization
-    self.x_std = np.std(X, axis=0)
-    self.x_mean = np.mean(X, axis=0)
-    self.y_mean = np.std(Y, axis=0)
-    self.y_std = np.std(Y, axis=0)
+    self.x_mean = np.average(X, axis=0, weights=self.sample_weight)
+    self.x_std = np.sqrt(np.average(np.square(X - self.x_mean), axis=0, weights=self.sample_weight))
+    self.y_mean = np.average(Y, axis=0, weights=self.sample_weight)
+    self.y_std = np.sqrt(np.average(np.square(Y - np.average(Y, axis=0, weights=self.sample_weight)), axis=0,
+                                    weights=self.sample_weight))
 
     self.n_train_points = X.shape[0]
 
@@ -199,6 +203,14 @@ class NeighborKernelDensityEstimation(BaseDensityEstimator):
       neighbor_weights[:] = weights[:, None]
       neighbor_weights = np.ma.masked_where(mask, neighbor_weights).filled(fill_value=0)
 
+    if self.sample_weight is not None:
+      # the weights of the Gaussians are proportional to the sample weights of their centers - if all neighbors of a
+      # query point have zero sample weight, the unweighted neighbor weights are kept
+      weighted_neighbor_weights = neighbor_weights * self.sample_weight
+      has_weight = np.sum(weighted_neighbor_weights, axis=1) > 0
+      neighbor_weights = np.where(has_weight[:, None], normalize(weighted_neighbor_weights, norm='l1', axis=1),
+                                  neighbor_weights)
+
     return neighbor_weights
 
   def _log_density(self, bw, neighbor_weights, y):
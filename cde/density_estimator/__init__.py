@@ -5,3 +5,4 @@ from .BaseDensityEstimator import BaseDensityEstimator
 from .CKDE import ConditionalKernelDensityEstimation
 from .MDN import MixtureDensityNetwork
 from .NF import NormalizingFlowEstimator
+from .Ensemble import EnsembleEstimator
@@ -39,6 +39,7 @@ class ArmaJump(BaseConditionalDensitySimulation):
     self.has_cdf = True
     self.has_pdf = True
     self.can_sample = True
+    self.closed_form_moments = True
 
   def pdf(self, X, Y):
     """ Conditional probability density function p(y|x) of the underlying probability model
@@ -111,7 +112,7 @@ class ArmaJump(BaseConditionalDensitySimulation):
 
     return x[burn_in:n_samples + burn_in], x[burn_in+1:n_samples + burn_in + 1]
 
-  def mean_(self, x_cond, n_samples=None):
+  def mean_(self, x_cond, n_samples=None, sampling='mc'):
     """ Conditional mean of the distribution
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
@@ -126,7 +127,7 @@ class ArmaJump(BaseConditionalDensitySimulation):
       means[i, :] = self.jump_prob * (mean + self.jump_mean) + (1-self.jump_prob) * mean
     return means
 
-  def covariance(self, x_cond, n_samples=None):
+  def covariance(self, x_cond, n_samples=None, sampling='mc'):
     """ Covariance of the distribution conditioned on x_cond
 
       Args:
@@ -127,10 +127,13 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
 
     return fig
 
-  def mean_(self, x_cond, n_samples=10**6):
+  def mean_(self, x_cond, n_samples=10**6, sampling='mc'):
     """ Mean of the fitted distribution conditioned on x_cond
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      n_samples: number of samples for monte carlo integration
+      sampling: proposal sampling scheme of the pdf-based monte carlo integration over the y space (ndim_y > 1) -
+                'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
     Returns:
       Means E[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y)
@@ -140,7 +143,7 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
     if self.can_sample:
       return self._mean_mc(x_cond, n_samples=n_samples)
     else:
-      return self._mean_pdf(x_cond)
+      return self._mean_pdf(x_cond, n_samples=n_samples, sampling=sampling)
 
   def std_(self, x_cond, n_samples=10 ** 6):
     """ Standard deviation of the fitted distribution conditioned on x_cond
@@ -155,18 +158,20 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
     assert x_cond.ndim == 2
     return self._std_pdf(x_cond, n_samples=n_samples)
 
-  def covariance(self, x_cond, n_samples=10**6):
+  def covariance(self, x_cond, n_samples=10**6, sampling='mc'):
     """ Covariance of the fitted distribution conditioned on x_cond
 
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
       n_samples: number of samples for monte carlo model_fitting
+      sampling: proposal sampling scheme of the pdf-based monte carlo integration over the y space - 'mc'
+                (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
     Returns:
       Covariances Cov[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
     """
     if self.has_pdf:
-      return self._covariance_pdf(x_cond)
+      return self._covariance_pdf(x_cond, n_samples=n_samples, sampling=sampling)
     elif self.can_sample:
       return self._covariance_mc(x_cond, n_samples=n_samples)
     else:
@@ -181,14 +186,7 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
        Returns:
          Skewness Skew[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
        """
-    x_cond = self._handle_input_dimensionality(x_cond)
-    assert x_cond.ndim == 2
-    if self.has_pdf:
-      return self._skewness_pdf(x_cond, n_samples=n_samples)
-    elif self.can_sample:
-      return self._skewness_pdf(x_cond, n_samples=n_samples)
-    else:
-      raise NotImplementedError()
+    return self.moments(x_cond, orders=(3,), n_samples=n_samples)[0]
 
   def kurtosis(self, x_cond, n_samples=10 ** 6):
     """ Kurtosis of the fitted distribution conditioned on x_cond
@@ -199,12 +197,53 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
        Returns:
          Kurtosis Kurt[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
        """
+    return self.moments(x_cond, orders=(4,), n_samples=n_samples)[0]
+
+  def moments(self, x_cond, orders=(1, 2, 3, 4), n_samples=10 ** 6):
+    """ Computes several moments of the distribution conditioned on x_cond. The pdf (or sampling if no pdf is
+        available) is evaluated only once and all requested statistics are reduced from the same evaluations.
+
+    Args:
+      x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      orders: tuple of moment orders - 1: mean, 2: standard deviation, 3: skewness, 4: excess kurtosis.
+              Orders 3 and 4 are only supported for ndim_y = 1
+      n_samples: number of samples for monte carlo model_fitting
+
+    Returns:
+      tuple with one entry per order
+        - order 1: Means E[y|x] - numpy array of shape (n_values, ndim_y)
+        - order 2: Standard deviations sqrt(Var[y|x]) - numpy array of shape (n_values, ndim_y)
+        - order 3: Skewness Skew[y|x] - numpy array of shape (n_values,)
+        - order 4: Excess kurtosis Kurt[y|x] - 3 - numpy array of shape (n_values,)
+    """
+    x_cond = self._handle_input_dimensionality(x_cond)
+    assert x_cond.ndim == 2
+    if self.has_pdf:
+      return self._moments_pdf(x_cond, orders=orders, n_samples=n_samples)
+    elif self.can_sample:
+      return self._moments_mc(x_cond, orders=orders, n_samples=n_samples)
+    else:
+      raise NotImplementedError()
+
+  def expectation(self, x_cond, func, n_samples=10 ** 6):
+    """ Computes the conditional expectation E[f(y)|x] of an arbitrary function f
+
+    Args:
+      x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      func: vectorized function f - must take a numpy array of shape (n_samples, ndim_y) and return a numpy array
+            of shape (n_samples,) or (n_samples, ndim_out)
+      n_samples: number of samples for monte carlo model_fitting
+
+    Returns:
+      Expectations E[f(y)|x] corresponding to x_cond - numpy array of shape (n_values,) or (n_values, ndim_out)
+    """
+    assert callable(func)
     x_cond = self._handle_input_dimensionality(x_cond)
     assert x_cond.ndim == 2
     if self.has_pdf:
-      return self._kurtosis_pdf(x_cond, n_samples=n_samples)
+      return self._expectation_pdf(x_cond, func, n_samples=n_samples)
     elif self.can_sample:
-      return self._kurtosis_mc(x_cond, n_samples=n_samples)
+      return self._expectation_mc(x_cond, func, n_samples=n_samples)
     else:
       raise NotImplementedError()
 
@@ -229,6 +268,29 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
     else:
       raise NotImplementedError()
 
+  def quantiles(self, x_cond, alphas=(0.01, 0.05, 0.1), n_samples=10**6):
+    """ Computes multiple conditional quantiles of the distribution at once. Only if ndim_y = 1
+
+    Args:
+      x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+      alphas: quantile levels within (0, 1) - array-like of shape (n_alphas)
+      n_samples: number of samples for monte carlo model_fitting
+
+    Returns:
+       quantiles for each x to condition on and each alpha - numpy array of shape (n_values, n_alphas)
+    """
+    assert self.ndim_y == 1, "Quantiles can only be computed when ndim_y = 1"
+    x_cond = self._handle_input_dimensionality(x_cond)
+    alphas = np.asarray(alphas, dtype=np.float64).reshape((-1,))
+    assert x_cond.ndim == 2
+
+    if self.has_cdf:
+      return self._quantiles_cdf(x_cond, alphas)
+    elif self.can_sample:
+      return self._quantiles_mc(x_cond, alphas, n_samples=n_samples)
+    else:
+      raise NotImplementedError()
+
   def conditional_value_at_risk(self, x_cond, alpha=0.01, n_samples=10**6):
     """ Computes the Conditional Value-at-Risk (CVaR) / Expected Shortfall of the fitted distribution. Only if ndim_y = 1
 
@@ -258,17 +320,22 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
 
         Args:
           x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
-          alpha: quantile percentage of the distribution
+          alpha: quantile percentage of the distribution - either a float or an array-like of shape (n_alphas) in
+                 which case the risk measures of all alphas are computed jointly
           n_samples: number of samples for monte carlo model_fitting
 
         Returns:
-          - VaR values for each x to condition on - numpy array of shape (n_values)
-          - CVaR values for each x to condition on - numpy array of shape (n_values)
+          - VaR values for each x to condition on - numpy array of shape (n_values) or (n_values, n_alphas)
+          - CVaR values for each x to condition on - numpy array of shape (n_values) or (n_values, n_alphas)
         """
     assert self.ndim_y == 1, "Value at Risk can only be computed when ndim_y = 1"
     assert x_cond.ndim == 2
 
-    VaRs = self.value_at_risk(x_cond, alpha=alpha, n_samples=n_samples)
+    if np.ndim(alpha) == 0:
+      VaRs = self.value_at_risk(x_cond, alpha=alpha, n_samples=n_samples)
+    else:
+      alpha = np.asarray(alpha, dtype=np.float64)
+      VaRs = self.quantiles(x_cond, alphas=alpha, n_samples=n_samples)
 
     if self.has_pdf:
       CVaRs = self._conditional_value_at_risk_mc_pdf(VaRs, x_cond, alpha=alpha, n_samples=n_samples)
@@ -277,7 +344,7 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
     else:
       raise NotImplementedError("Distribution object must either support pdf or sampling in order to compute CVaR")
 
-    assert VaRs.shape == CVaRs.shape == (len(x_cond),)
+    assert VaRs.shape == CVaRs.shape == (len(x_cond),) + np.shape(alpha)
     return VaRs, CVaRs
 
   def get_configuration(self, deep=True):
@@ -303,6 +370,14 @@ class BaseConditionalDensitySimulation(ConditionalDensity):
     else:
       return X, Y
 
+  def _conditional_location_scale(self, x_cond):
+    # simulations with closed-form mean_ and covariance (closed_form_moments) -> tight per-x integration brackets
+    if not getattr(self, 'closed_form_moments', False):
+      return None
+    means = np.broadcast_to(self.mean_(x_cond), (x_cond.shape[0], self.ndim_y))
+    covs = np.broadcast_to(self.covariance(x_cond), (x_cond.shape[0], self.ndim_y, self.ndim_y))
+    return means[:, 0], np.sqrt(covs[:, 0, 0])
+
   def _compute_data_statistics(self):
     _, Y = self.simulate(n_samples=10**4)
     return np.mean(Y, axis=0), np.std(Y, axis=0)
\ No newline at end of file
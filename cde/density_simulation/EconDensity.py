@@ -32,6 +32,7 @@ class EconDensity(BaseConditionalDensitySimulation):
     self.has_cdf = True
     self.has_pdf = True
     self.can_sample = True
+    self.closed_form_moments = True
 
   def pdf(self, X, Y):
     """ Conditional probability density function p(y|x) of the underlying probability model
@@ -94,7 +95,7 @@ class EconDensity(BaseConditionalDensitySimulation):
     X, Y = X.reshape((n_samples, self.ndim_x)), Y.reshape((n_samples, self.ndim_y))
     return X, Y
 
-  def mean_(self, x_cond, n_samples=None):
+  def mean_(self, x_cond, n_samples=None, sampling='mc'):
     """ Conditional mean of the distribution
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
@@ -118,7 +119,7 @@ class EconDensity(BaseConditionalDensitySimulation):
 
     return x_cond**2
 
-  def covariance(self, x_cond, n_samples=None):
+  def covariance(self, x_cond, n_samples=None, sampling='mc'):
     """ Covariance of the distribution conditioned on x_cond
 
       Args:
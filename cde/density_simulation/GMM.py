@@ -29,6 +29,7 @@ class GaussianMixture(BaseConditionalDensitySimulation):
     self.has_pdf = True
     self.has_cdf = True
     self.can_sample = True
+    self.closed_form_moments = True
 
     """  set parameters, calculate weights, means and covariances """
     self.n_kernels = n_kernels
@@ -171,7 +172,7 @@ class GaussianMixture(BaseConditionalDensitySimulation):
     assert y_samples.shape == (n_samples, self.ndim_y)
     return x_samples, y_samples
 
-  def mean_(self, x_cond, n_samples=None):
+  def mean_(self, x_cond, n_samples=None, sampling='mc'):
     """ Conditional mean of the distribution
      Args:
        x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
@@ -185,7 +186,7 @@ class GaussianMixture(BaseConditionalDensitySimulation):
     means = W_x.dot(self.means_y)
     return means
 
-  def covariance(self, x_cond, n_samples=None):
+  def covariance(self, x_cond, n_samples=None, sampling='mc'):
     """ Covariance of the distribution conditioned on x_cond
 
       Args:
@@ -104,7 +104,7 @@ class LinearStudentT(BaseConditionalDensitySimulation):
     X = self.random_state.normal(loc=0, scale=1, size=(n_samples, self.ndim_x))
     return self.simulate_conditional(X)
 
-  def mean_(self, x_cond, n_samples=None):
+  def mean_(self, x_cond, n_samples=None, sampling='mc'):
     """ Conditional mean of the distribution
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
@@ -131,6 +131,11 @@ class LinearStudentT(BaseConditionalDensitySimulation):
     std = scale * np.sqrt(dof / (dof - 2)).reshape((x_cond.shape[0], self.ndim_y))
     return std
 
+  def _conditional_location_scale(self, x_cond):
+    # the std may be infinite -> the scale is widened such that loc +/- 10 scale brackets all but 1e-8 of the tail mass
+    loc, scale, dof = self._loc_scale_dof_mapping(self._handle_input_dimensionality(x_cond))
+    return loc[:, 0], scale[:, 0] * np.maximum(1, stats.t.ppf(1 - 1e-8, dof) / 10)
+
   def _loc_scale_dof_mapping(self, X):
     return self._loc(X), self._scale(X), self._dof(X)
 
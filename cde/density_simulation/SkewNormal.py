@@ -119,7 +119,7 @@ class SkewNormal(BaseConditionalDensitySimulation):
     assert X.shape == (n_samples, self.ndim_x)
     return X, self.simulate_conditional(X)
 
-  def mean_(self, x_cond, n_samples=None):
+  def mean_(self, x_cond, n_samples=None, sampling='mc'):
     """ Conditional mean of the distribution
     Args:
       x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
@@ -132,6 +132,11 @@ class SkewNormal(BaseConditionalDensitySimulation):
     assert locs.shape == (x_cond.shape[0], self.ndim_y)
     return locs
 
+  def _conditional_location_scale(self, x_cond):
+    # the skew normal tails decay at least as fast as the normal tails with the same location and scale
+    locs, scales, _ = self._loc_scale_skew_mapping(self._handle_input_dimensionality(x_cond))
+    return locs[:, 0], scales[:, 0]
+
 def sigmoid(x):
   return 1 / (1+np.exp(-x))
 
@@ -10,7 +10,8 @@ import itertools
 
 
 from cde.density_estimator import LSConditionalDensityEstimation, KernelMixtureNetwork, MixtureDensityNetwork, \
-    ConditionalKernelDensityEstimation, NeighborKernelDensityEstimation, NormalizingFlowEstimator
+    ConditionalKernelDensityEstimation, NeighborKernelDensityEstimation, NormalizingFlowEstimator, EnsembleEstimator
+from cde.density_estimator.BaseNNEstimator import BaseNNEstimator
 
 from cde.evaluation.empirical_eval.datasets import BostonHousing
 
@@ -168,6 +169,10 @@ def _initialize_model_cv_ml(conf_dict):
 
 
 def _evaluate_params(estimator_class, param_dict, X_train, Y_train, X_valid, Y_valid, seeds):
+        if issubclass(estimator_class, BaseNNEstimator):
+            # all seeds are trained as members of one ensemble in a single graph and session
+            return _evaluate_params_ensemble(estimator_class, param_dict, X_train, Y_train, X_valid, Y_valid, seeds)
+
         eval_scores = []
 
         def _eval_with_seed(seed):
@@ -188,4 +193,19 @@ def _evaluate_params(estimator_class, param_dict, X_train, Y_train, X_valid, Y_v
         executor = LoopExecutor()
         executor.run(_eval_with_seed, seeds)
 
-        return eval_scores
\ No newline at end of file
+        return eval_scores
+
+
+def _evaluate_params_ensemble(estimator_class, param_dict, X_train, Y_train, X_valid, Y_valid, seeds):
+        config = tf.ConfigProto(device_count={"CPU": 1},
+                                inter_op_parallelism_threads=1,
+                                intra_op_parallelism_threads=1)
+        with tf.Session(config=config):
+            param_dict_local = copy.copy(param_dict)
+            param_dict_local.pop('random_seed', None)
+            ensemble = EnsembleEstimator(estimator_class, seeds=seeds, **param_dict_local)
+            ensemble.fit(X_train, Y_train, verbose=False)
+            eval_scores = ensemble.member_scores(X_valid, Y_valid)
+
+        tf.reset_default_graph()
+        return eval_scores
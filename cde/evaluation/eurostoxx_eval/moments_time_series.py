@@ -29,16 +29,10 @@ def main():
                                 random_seed=22, x_noise_std=0.2, y_noise_std=0.1)
     mdn.fit(X,Y)
 
-    # 3) estimate moments
-    n_samples = 10**7
-    print('compute mean')
-    mean = np.squeeze(mdn.mean_(x_cond=X, n_samples=n_samples))
-    print('compute cov')
-    cov = np.squeeze(mdn.covariance(x_cond=X, n_samples=n_samples))
-    print('compute skewness')
-    skew = mdn._skewness_mc(x_cond=X, n_samples=n_samples)
-    print('compute kurtosis')
-    kurt = mdn._kurtosis_mc(x_cond=X, n_samples=n_samples)
+    # 3) estimate moments (closed form from the mixture components)
+    print('compute moments')
+    mean, std, skew, kurt = mdn.moments(x_cond=X, orders=(1, 2, 3, 4))
+    mean, cov = np.squeeze(mean), np.squeeze(std) ** 2
 
     # 4) save data
     data = np.stack([mean, cov, skew, kurt], axis=-1)
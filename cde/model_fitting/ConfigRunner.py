@@ -6,6 +6,7 @@ import traceback
 
 """ do not remove, imports required for globals() call """
 from cde.density_estimator import LSConditionalDensityEstimation, KernelMixtureNetwork, MixtureDensityNetwork, ConditionalKernelDensityEstimation, NeighborKernelDensityEstimation, NormalizingFlowEstimator
+from cde.density_estimator.BaseNNEstimator import BaseNNEstimator
 from cde.density_simulation import EconDensity, GaussianMixture, ArmaJump, JumpDiffusionModel, SkewNormal, LinearGaussian, LinearStudentT
 from cde.model_fitting.GoodnessOfFit import GoodnessOfFit, sample_x_cond
 from cde.model_fitting.GoodnessOfFitResults import GoodnessOfFitResults
@@ -21,6 +22,8 @@ import time
 
 EXP_CONFIG_FILE = 'exp_configs.pkl'
 RESULTS_FILE = 'results.pkl'
+WARM_START_DIR = 'warm_start_params'
+WARM_START_EPOCH_FRACTION = 0.3
 
 class ConfigRunner():
   """
@@ -61,13 +64,21 @@ class ConfigRunner():
     n_x_cond: (int) number of x conditionals to be sampled
 
     n_seeds: (int) number of different seeds for sampling the data
+
+    warm_start: (boolean) if True, the tasks of a neural network estimator that only differ in n_observations are run
+                as a chain of increasing n_observations - every fit starts from the parameters of the fit to the next
+                smaller n_observations and the results are tagged with warm_started = True
+
+    warm_start_epoch_fraction: fraction of n_training_epochs the warm-started fits are trained for
   """
 
   def __init__(self, exp_prefix, est_params, sim_params, observations, keys_of_interest, n_mc_samples=10 ** 7,
-               n_x_cond=5, n_seeds=5, use_gpu=True, tail_measures=True):
+               n_x_cond=5, n_seeds=5, use_gpu=True, tail_measures=True, warm_start=False,
+               warm_start_epoch_fraction=WARM_START_EPOCH_FRACTION):
 
     assert est_params and exp_prefix and sim_params and keys_of_interest
     assert observations.all()
+    assert 0 < warm_start_epoch_fraction <= 1
 
     # every simulator configuration will be run multiple times with different randomness seeds
     sim_params = _add_seeds_to_sim_params(n_seeds, sim_params)
@@ -79,6 +90,8 @@ class ConfigRunner():
     self.exp_prefix = exp_prefix
     self.use_gpu = use_gpu
     self.tail_measures = tail_measures
+    self.warm_start = warm_start
+    self.warm_start_epoch_fraction = warm_start_epoch_fraction
 
     logger.configure(log_directory=config.DATA_DIR, prefix=exp_prefix, color='green')
 
@@ -206,27 +219,53 @@ class ConfigRunner():
 
 
     iters = range(len(tasks))
+    run_fn = self._run_single_task
+
+    if self.warm_start:
+      # the tasks of a chain run sequentially in the same worker, different chains run in parallel
+      tasks = _warm_start_chains(tasks, self.warm_start_epoch_fraction)
+      iters, run_fn = range(len(tasks)), self._run_task_chain
+      logger.log("{:<70s} {:<30s}".format("Number of warm-start chains:", str(len(tasks))))
 
     if multiprocessing:
       executor = AsyncExecutor(n_jobs=n_workers)
-      executor.run(self._run_single_task, iters, tasks)
+      executor.run(run_fn, iters, tasks)
 
     else:
       for i, task in zip(iters, tasks):
-        self._run_single_task(i, task)
-
-
-  def _run_single_task(self, i, task):
+        run_fn(i, task)
+
+  def _run_task_chain(self, chain_idx, chain):
+    """ Runs the (task_idx, task) tuples of a warm-start chain in the order of increasing n_obs - the first task is
+    fitted from scratch, every other task is initialized with the parameters of its predecessor """
+    params = None
+    for position, (i, task) in enumerate(chain):
+      if position > 0 and params is None:
+        logger.log("Warm-start chain {:<1} aborted - no fitted parameters before task {:<1}".format(chain_idx + 1, i + 1))
+        return
+      params = self._run_single_task(i, task, init_params=params, keep_params=len(chain) > 1)
+
+
+  def _run_single_task(self, i, task, init_params=None, keep_params=False):
+    """ Runs a task - if keep_params is True, the parameters of the fitted estimator are stored and returned so that
+    the next task of a warm-start chain can be initialized with them (init_params) """
     start_time = time.time()
     try:
       task_hash = _hash_task_dict(task)  # generate SHA256 hash of task dict as identifier
+      params_path = os.path.join(WARM_START_DIR, task['task_name'] + '.pkl')
 
       # skip task if it has already been completed
       if task_hash in self.gof_single_res_collection.keys():
         logger.log("Task {:<1} {:<63} {:<10} {:<1} {:<1} {:<1}".format(i + 1, "has already been completed:", "Estimator:",
                                                                        task['estimator_name'],
                                                                        " Simulator: ", task["simulator_name"]))
-        return None
+        if not keep_params:
+          return None
+        if os.path.isfile(os.path.join(logger.log_directory, logger.prefix, params_path)):
+          return logger.load_pkl(params_path)
+        # the task was completed without storing its parameters (e.g. by a run without warm start) -> fit it again
+        logger.log("Task {:<1} {:<63}".format(i + 1, "refitting to obtain the parameters for the warm-start chain"))
+        return self._refit_task_params(task, init_params, params_path)
 
       # run task when it has not been completed
       else:
@@ -234,33 +273,24 @@ class ConfigRunner():
           "Task {:<1} {:<63} {:<10} {:<1} {:<1} {:<1}".format(i + 1, "running:", "Estimator:", task['estimator_name'],
                                                               " Simulator: ", task["simulator_name"]))
 
-        tf.reset_default_graph()
-
-        ''' build simulator and estimator model given the specified configurations '''
-
-        simulator = globals()[task['simulator_name']](**task['simulator_config'])
-
-        t = time.time()
-        estimator = globals()[task['estimator_name']](task['task_name'], simulator.ndim_x,
-                                                      simulator.ndim_y, **task['estimator_config'])
-        time_to_initialize = time.time() - t
-
-        # if desired hide gpu devices
-        if not self.use_gpu:
-          os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+        simulator, estimator, time_to_initialize = self._build_task_models(task)
 
         with tf.Session() as sess:
           sess.run(tf.global_variables_initializer())
 
           ''' train the model '''
-          gof = GoodnessOfFit(estimator=estimator, probabilistic_model=simulator, X=task['X'], Y=task['Y'],
-                              n_observations=task['n_obs'], n_mc_samples=task['n_mc_samples'], x_cond=task['x_cond'],
-                              task_name = task['task_name'], tail_measures=self.tail_measures)
+          gof = self._goodness_of_fit(task, simulator, estimator)
+          n_epoch = _n_warm_start_epochs(task, estimator, init_params)
 
           t = time.time()
-          gof.fit_estimator(print_fit_result=True)
+          gof.fit_estimator(print_fit_result=True, init_params=init_params, n_epoch=n_epoch)
           time_to_fit = time.time() - t
 
+          params = None
+          if keep_params:
+            params = estimator.get_param_values()
+            logger.dump_pkl(data=params, path=params_path)
+
           if self.dump_models:
             logger.dump_pkl(data=gof.estimator, path="model_dumps/{}.pkl".format(task['task_name']))
             logger.dump_pkl(data=gof.probabilistic_model, path="model_dumps/{}.pkl".format(task['task_name'] + "_simulator"))
@@ -272,6 +302,11 @@ class ConfigRunner():
 
           gof_results.task_name = task['task_name']
 
+          if 'warm_start' in task:
+            gof_results.warm_started = True
+            gof_results.warm_start_n_obs = task['warm_start']['n_obs']
+            gof_results.n_warm_start_epochs = n_epoch
+
           gof_results.hash = task_hash
 
         logger.log_pkl(data=(task_hash, gof_results), path=RESULTS_FILE)
@@ -282,12 +317,51 @@ class ConfigRunner():
         logger.log(
           "Finished task {:<1} in {:<1.4f} {:<43} {:<10} {:<1} {:<1} {:<2} | {:<1} {:<1.2f} {:<1} {:<1.2f} {:<1} {:<1.2f}".format(i + 1, task_duration, "sec:",
           "Estimator:", task['estimator_name'], " Simulator: ", task["simulator_name"], "t_init:", time_to_initialize, "t_fit:", time_to_fit, "t_eval:", time_to_evaluate))
+        return params
 
     except Exception as e:
       logger.log("error in task: ", str(i + 1))
       logger.log(str(e))
       traceback.print_exc()
 
+  def _build_task_models(self, task):
+    """ builds simulator and estimator model given the specified configurations of the task in a new default graph -
+    returns them together with the time it took to initialize the estimator """
+    tf.reset_default_graph()
+
+    simulator = globals()[task['simulator_name']](**task['simulator_config'])
+
+    t = time.time()
+    estimator = globals()[task['estimator_name']](task['task_name'], simulator.ndim_x,
+                                                  simulator.ndim_y, **task['estimator_config'])
+    time_to_initialize = time.time() - t
+
+    # if desired hide gpu devices
+    if not self.use_gpu:
+      os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+    return simulator, estimator, time_to_initialize
+
+  def _goodness_of_fit(self, task, simulator, estimator):
+    return GoodnessOfFit(estimator=estimator, probabilistic_model=simulator, X=task['X'], Y=task['Y'],
+                         n_observations=task['n_obs'], n_mc_samples=task['n_mc_samples'], x_cond=task['x_cond'],
+                         task_name = task['task_name'], tail_measures=self.tail_measures)
+
+  def _refit_task_params(self, task, init_params, params_path):
+    """ Fits the estimator of an already completed task again - without evaluating it - and stores and returns its
+    parameters, so that a warm-start chain can be resumed after the task was completed without keeping them """
+    simulator, estimator, _ = self._build_task_models(task)
+
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      gof = self._goodness_of_fit(task, simulator, estimator)
+      gof.fit_estimator(print_fit_result=False, init_params=init_params,
+                        n_epoch=_n_warm_start_epochs(task, estimator, init_params))
+      params = estimator.get_param_values()
+
+    logger.dump_pkl(data=params, path=params_path)
+    return params
+
   def _dump_current_state(self):
     #if self.export_csv:
     #  self._export_results(task=task, gof_result=gof_single_result, file_handle_results=self.file_handle_results_csv)
@@ -365,6 +439,43 @@ def _add_seeds_to_sim_params(n_seeds, sim_params):
   return sim_params
 
 
+def _warm_start_chains(tasks, epoch_fraction):
+  """
+  Groups the tasks of neural network estimators that only differ in n_obs into chains of increasing n_obs. All other
+  tasks form chains of length one. Every task of a chain except for the first one gets a 'warm_start' entry with the
+  n_obs of its predecessor - since it is part of the task hash, warm-started and cold-started results do not collide.
+
+  Args:
+    tasks: list of task dicts
+    epoch_fraction: fraction of n_training_epochs the warm-started fits are trained for
+
+  Returns:
+    list of chains - each chain is a list of (task_idx, task) tuples
+  """
+  chains = {}
+  for i, task in enumerate(tasks):
+    if issubclass(globals()[task['estimator_name']], BaseNNEstimator):
+      key = _make_hashable((task['simulator_name'], task['simulator_config'], task['estimator_name'],
+                            task['estimator_config']))
+    else:
+      key = ('task', i)
+    chains.setdefault(key, []).append((i, dict(task)))
+
+  for chain in chains.values():
+    chain.sort(key=lambda i_task: i_task[1]['n_obs'])
+    for (_, prev_task), (_, task) in zip(chain[:-1], chain[1:]):
+      task['warm_start'] = {'n_obs': prev_task['n_obs'], 'epoch_fraction': epoch_fraction}
+  return list(chains.values())
+
+
+def _n_warm_start_epochs(task, estimator, init_params):
+  """ Returns: number of training epochs of a warm-started task - None (i.e. n_training_epochs) for the other tasks """
+  if 'warm_start' not in task:
+    return None
+  assert init_params is not None, "warm-started task requires the parameters of its predecessor"
+  return max(1, int(round(task['warm_start']['epoch_fraction'] * estimator.n_training_epochs)))
+
+
 def _create_configurations(params_tuples, verbose=False):
   confs = {}
   for conf_instance, conf_dict in params_tuples:
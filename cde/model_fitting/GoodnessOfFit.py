@@ -58,18 +58,24 @@ class GoodnessOfFit:
     else:
       self.task_name = type(self.estimator).__name__ + '_' + type(self.probabilistic_model).__name__
 
-  def fit_estimator(self, print_fit_result=True): #todo set to False
+  def fit_estimator(self, print_fit_result=True, init_params=None, n_epoch=None): #todo set to False
     """
     Fits the estimator with the provided data
 
     Args:
       print_fit_result: boolean that specifies whether the fitted distribution shall be plotted (only works if ndim_x and ndim_y = 1)
+      init_params: (optional) parameter values of a neural network estimator with the same configuration - if set, the
+                   fit is warm-started from these parameters (see BaseNNEstimator.fit_warm_start)
+      n_epoch: (optional) number of training epochs of the warm-started fit
     """
 
     self.time_to_fit = None
     if not self.estimator.fitted:  # fit estimator if necessary
       t_start = time.time()
-      self.estimator.fit(self.X, self.Y, verbose=False)
+      if init_params is not None:
+        self.estimator.fit_warm_start(self.X, self.Y, init_params, n_epoch=n_epoch, verbose=False)
+      else:
+        self.estimator.fit(self.X, self.Y, verbose=False)
       self.time_to_fit = (time.time() - t_start) * self.n_observations / 1000  # time to fit per 1000 samples
 
     if print_fit_result and self.estimator.fitted:
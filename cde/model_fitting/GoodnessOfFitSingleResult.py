@@ -8,6 +8,11 @@ class GoodnessOfFitSingleResult:
     self.time_to_fit = None
     self.time_to_predict = None
 
+    # set if the estimator was warm-started from the fit to n_obs = warm_start_n_obs with n_warm_start_epochs epochs
+    self.warm_started = False
+    self.warm_start_n_obs = None
+    self.n_warm_start_epochs = None
+
     self.ndim_x = estimator_params["ndim_x"]
     self.ndim_y = estimator_params["ndim_y"]
 
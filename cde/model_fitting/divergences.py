@@ -1,12 +1,12 @@
 import numpy as np
 from cde.BaseConditionalDensity import ConditionalDensity
-from cde.utils.integration import mc_integration_student_t
+from cde.utils.integration import mc_integration_student_t, N_SAMPLES_BATCH
 
 _FUN_KL = lambda p, q: p * np.log(p / q)
 _FUN_JS = lambda p, q: 0.5 * p * np.log(p / q) + 0.5 * q * np.log(q / p)
 _FUN_HELLINGER_2 = lambda p, q: (np.sqrt(p) - np.sqrt(q))**2
 
-def kl_divergence_pdf(p, q, x_cond, n_samples=10 ** 5):
+def kl_divergence_pdf(p, q, x_cond, n_samples=10 ** 5, std_err_tol=None, sampling='mc'):
   """ Computes the Kullback–Leibler divergence KL[p ; q] via monte carlo integration
   using importance sampling with a student-t proposal distribution
 
@@ -14,14 +14,16 @@ def kl_divergence_pdf(p, q, x_cond, n_samples=10 ** 5):
    p: conditional distribution object p(y|x)
    q: conditional distribution object q(y|x)
    x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
-   n_samples: number of samples for monte carlo integration over the y space
+   n_samples: maximum number of samples for monte carlo integration over the y space
+   std_err_tol: (optional) standard error at which the monte carlo integration stops early
+   sampling: proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
   Returns:
     KL divergence of each x value to condition on - numpy array of shape (n_values,)
   """
-  return _divergence_mc(p, q, x_cond, _FUN_KL, n_samples)
+  return _divergence_mc(p, q, x_cond, _FUN_KL, n_samples, std_err_tol=std_err_tol, sampling=sampling)
 
-def js_divergence_pdf(p, q, x_cond, n_samples=10 ** 5):
+def js_divergence_pdf(p, q, x_cond, n_samples=10 ** 5, std_err_tol=None, sampling='mc'):
   """ Computes the Jensen-Shannon divergence JS[p ; q] via monte carlo integration
   using importance sampling with a student-t proposal distribution
 
@@ -29,15 +31,17 @@ def js_divergence_pdf(p, q, x_cond, n_samples=10 ** 5):
    p: conditional distribution object p(y|x)
    q: conditional distribution object q(y|x)
    x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
-   n_samples: number of samples for monte carlo integration over the y space
+   n_samples: maximum number of samples for monte carlo integration over the y space
+   std_err_tol: (optional) standard error at which the monte carlo integration stops early
+   sampling: proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
   Returns:
     JS divergence of each x value to condition on - numpy array of shape (n_values,)
   """
   divergence_fun = lambda p, q: 0.5 * p * np.log(p / q) + 0.5 * q * np.log(q / p)
-  return _divergence_mc(p, q, x_cond, divergence_fun, n_samples)
+  return _divergence_mc(p, q, x_cond, divergence_fun, n_samples, std_err_tol=std_err_tol, sampling=sampling)
 
-def hellinger_distance_pdf(p, q, x_cond, n_samples=10 ** 5):
+def hellinger_distance_pdf(p, q, x_cond, n_samples=10 ** 5, std_err_tol=None, sampling='mc'):
   """ Computes the Hellinger Distance H[p ; q] via monte carlo integration
   using importance sampling with a student-t proposal distribution
 
@@ -45,15 +49,17 @@ def hellinger_distance_pdf(p, q, x_cond, n_samples=10 ** 5):
    p: conditional distribution object p(y|x)
    q: conditional distribution object q(y|x)
    x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
-   n_samples: number of samples for monte carlo integration over the y space
+   n_samples: maximum number of samples for monte carlo integration over the y space
+   std_err_tol: (optional) standard error at which the monte carlo integration stops early
+   sampling: proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
   Returns:
     Hellinger distance for each x value to condition on - numpy array of shape (n_values,)
   """
-  hellinger_squared = _divergence_mc(p, q, x_cond, _FUN_HELLINGER_2, n_samples)
+  hellinger_squared = _divergence_mc(p, q, x_cond, _FUN_HELLINGER_2, n_samples, std_err_tol=std_err_tol, sampling=sampling)
   return np.sqrt(0.5 * hellinger_squared)
 
-def divergence_measures_pdf(p, q, x_cond, n_samples=10**5):
+def divergence_measures_pdf(p, q, x_cond, n_samples=10**5, std_err_tol=None, sampling='mc'):
   """ Computes the
       - Hellinger Distance H[p ; q]
       - Kullback–Leibler divergence KL[p ; q]
@@ -64,18 +70,22 @@ def divergence_measures_pdf(p, q, x_cond, n_samples=10**5):
      p: conditional distribution object p(y|x)
      q: conditional distribution object q(y|x)
      x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
-     n_samples: number of samples for monte carlo integration over the y space
+     n_samples: maximum number of samples for monte carlo integration over the y space
+     std_err_tol: (optional) standard error at which the monte carlo integration stops early
+     sampling: proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
     Returns:
       (hellinger_dists, kl_divs, js_divs) - tuple of numpy arrays of shape (n_values,)
     """
   fun_div_measures_stack = lambda p, q: np.stack([_FUN_HELLINGER_2(p,q), _FUN_KL(p,q), _FUN_JS(p,q)], axis=1) # np.sqrt(_FUN_HELLINGER_2(p,q))
-  div_measure_stack = _divergence_mc(p, q, x_cond, fun_div_measures_stack, n_samples, n_measures=3)
+  div_measure_stack = _divergence_mc(p, q, x_cond, fun_div_measures_stack, n_samples, n_measures=3,
+                                     std_err_tol=std_err_tol, sampling=sampling)
   assert div_measure_stack.shape == (x_cond.shape[0], 3)
   h_divs, kl_divs, js_divs = div_measure_stack[:, 0], div_measure_stack[:, 1], div_measure_stack[:, 2]
   return np.sqrt(0.5 * h_divs), kl_divs, js_divs
 
-def _divergence_mc(p, q, x_cond, divergenc_fun, n_samples=10 ** 5, n_measures=1):
+def _divergence_mc(p, q, x_cond, divergenc_fun, n_samples=10 ** 5, n_measures=1, std_err_tol=None,
+                   batch_size=N_SAMPLES_BATCH, sampling='mc'):
   assert x_cond.ndim == 2 and x_cond.shape[1] == q.ndim_x
 
   P = p.pdf
@@ -96,9 +106,12 @@ def _divergence_mc(p, q, x_cond, divergenc_fun, n_samples=10 ** 5, n_measures=1)
     distances = np.zeros((x_cond.shape[0], n_measures))
   mu_proposal, std_proposal = p._determine_mc_proposal_dist()
   for i in range(x_cond.shape[0]):
-    x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
-    func = lambda y: _make_2d(_div(x, y))
-    distances[i] = mc_integration_student_t(func, q.ndim_y, n_samples=n_samples, loc_proposal=mu_proposal, scale_proposal=std_proposal)
+    # x is tiled per chunk of proposal samples -> memory does not grow with n_samples
+    x_tiled = lambda y: np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (y.shape[0], 1))
+    func = lambda y: _make_2d(_div(x_tiled(y), y))
+    distances[i] = mc_integration_student_t(func, q.ndim_y, n_samples=n_samples, batch_size=batch_size,
+                                            loc_proposal=mu_proposal, scale_proposal=std_proposal,
+                                            std_err_tol=std_err_tol, sampling=sampling)
   assert distances.shape[0] == x_cond.shape[0]
   return distances
 
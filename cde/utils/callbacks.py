@@ -0,0 +1,170 @@
+import csv
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import pandas as pd
+
+# phases of a training epoch that are timed separately - 'other' is the remaining wall time of the epoch
+PHASES = ('batching', 'feed_dict', 'session_run', 'eval', 'progress', 'early_stopping', 'other')
+TRAIN_PHASES = ('batching', 'feed_dict', 'session_run')
+
+
+class Callback:
+    """
+    Base class of the training callbacks that can be passed to the fit method of the neural network estimators.
+
+    on_epoch_end is called after every training epoch with the logs dict
+        - epoch: (int) index of the epoch
+        - loss: (float) mean training log-loss of the epoch
+        - n_samples: (int) number of training samples of the epoch
+        - eval_loss: (float) mean log-loss on the eval set - only if an eval set is provided
+        - times: dict with the wall time in seconds of the phases (see PHASES) and of the whole epoch ('total')
+
+    on_fit_end is called once the training has ended with the logs dict
+        - n_epochs: (int) number of training epochs
+        - fit_time: (float) wall time of the training in seconds
+        - stopped_epoch: epoch in which the training was stopped early - None if all epochs were trained
+    """
+
+    def on_epoch_end(self, estimator, epoch, logs):
+        pass
+
+    def on_fit_end(self, estimator, logs):
+        pass
+
+
+class EpochTimer:
+    """ Accumulates the wall time of the phases of a training epoch """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._times = OrderedDict()
+        self._nested_times = []
+
+    @contextmanager
+    def phase(self, name):
+        # the time of nested phases (e.g. eval within early_stopping) is only counted for the innermost phase
+        start = time.perf_counter()
+        self._nested_times.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._times[name] = self._times.get(name, 0.0) + elapsed - self._nested_times.pop()
+            if self._nested_times:
+                self._nested_times[-1] += elapsed
+
+    def times(self):
+        """ Returns: dict with the wall times of all phases (see PHASES) and of the whole epoch ('total') so far """
+        times = OrderedDict((name, self._times.get(name, 0.0)) for name in PHASES if name != 'other')
+        times['total'] = time.perf_counter() - self._start
+        times['other'] = max(times['total'] - sum(self._times.values()), 0.0)
+        return times
+
+
+def run_callbacks(callbacks, method, *args):
+    """ Calls the method (e.g. 'on_epoch_end') of all callbacks with the provided arguments """
+    for callback in callbacks or ():
+        getattr(callback, method)(*args)
+
+
+""" Sinks """
+
+
+class MemorySink:
+    """ Keeps the rows of a collector in memory """
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.rows)
+
+
+class CSVSink:
+    """
+    Writes the rows of a collector to a csv file - the header is determined by the first row
+
+    Args:
+        path: (str) path of the csv file
+        append: (bool) if True, the rows are appended to an existing file (without repeating the header)
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self._file, self._writer = None, None
+
+    def write(self, row):
+        if self._writer is None:
+            write_header = not (self.append and os.path.isfile(self.path) and os.path.getsize(self.path) > 0)
+            self._file = open(self.path, 'a' if self.append else 'w', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=list(row.keys()), extrasaction='ignore')
+            if write_header:
+                self._writer.writeheader()
+        self._writer.writerow(row)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file, self._writer = None, None
+            self.append = True  # writing again continues the file
+
+
+""" Collectors """
+
+
+class _Collector(Callback):
+    # writes one row per epoch to its sink - an in-memory sink if none is provided
+
+    def __init__(self, sink=None):
+        self.sink = MemorySink() if sink is None else sink
+
+    def on_epoch_end(self, estimator, epoch, logs):
+        row = OrderedDict([('estimator', getattr(estimator, 'name', type(estimator).__name__)), ('epoch', epoch)])
+        row.update(self._row(logs))
+        self.sink.write(row)
+
+    def on_fit_end(self, estimator, logs):
+        self.sink.flush()
+
+    def _row(self, logs):
+        raise NotImplementedError
+
+
+class PhaseTimes(_Collector):
+    """ Collects the wall time in seconds of the phases of every training epoch (see PHASES) """
+
+    def _row(self, logs):
+        return logs['times']
+
+
+class Throughput(_Collector):
+    """ Collects the number of training examples per second of every epoch - based on the time spent on the training
+    steps (batching, feed dict construction and session runs), i.e. without evaluation and progress output """
+
+    def _row(self, logs):
+        train_time = sum(logs['times'][name] for name in TRAIN_PHASES)
+        return OrderedDict([('n_samples', logs['n_samples']), ('train_time', train_time),
+                            ('examples_per_sec', logs['n_samples'] / train_time if train_time > 0 else float('nan'))])
+
+
+class LossCurve(_Collector):
+    """ Collects the mean training log-loss (and the mean log-loss on the eval set, if provided) of every epoch """
+
+    def _row(self, logs):
+        return OrderedDict([('loss', logs['loss']), ('eval_loss', logs.get('eval_loss'))])
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def build_coreset(X, Y, size, method='sensitivity', random_state=None):
+    """
+    Compresses the data (X, Y) into a small weighted subset, a coreset, which can be passed to the fit method of the
+    density estimators via sample_weight. The weights sum up to (approximately) the number of samples, so that weighted
+    averages over the coreset approximate the averages over the full data.
+
+    Both methods operate on the standardized joint samples z = [x, y]:
+
+    - sensitivity: lightweight coreset (Bachem et al. 2018) - the rows are sampled i.i.d. with probability
+      q(z) = 1/(2n) + d(z, mean)^2 / (2 sum d^2) and weighted with 1 / (size * q(z)). The weights are unbiased.
+    - kmeans++: the rows are selected by D^2 seeding (Arthur & Vassilvitskii 2007), each row is weighted with the
+      number of samples that are closest to it.
+
+    Args:
+        X: numpy array of x values - shape: (n_samples, n_dim_x)
+        Y: numpy array of y values - shape: (n_samples, n_dim_y)
+        size: (int) (maximum) number of rows of the coreset - duplicate draws of the sensitivity sampling are merged
+        method: coreset construction method - choices: [sensitivity, kmeans++]
+        random_state: numpy RandomState
+
+    Returns: tuple (X_coreset, Y_coreset, weights)
+        - X_coreset - numpy array of shape (n_coreset, n_dim_x)
+        - Y_coreset - numpy array of shape (n_coreset, n_dim_y)
+        - weights - non-negative sample weights - numpy array of shape (n_coreset,)
+    """
+    assert method in ['sensitivity', 'kmeans++']
+    assert size > 0
+    random_state = np.random.RandomState() if random_state is None else random_state
+
+    if X.ndim == 1:
+        X = np.expand_dims(X, axis=1)
+    if Y.ndim == 1:
+        Y = np.expand_dims(Y, axis=1)
+    assert X.shape[0] == Y.shape[0], "X and Y must have the same length along axis 0"
+    n_samples = X.shape[0]
+
+    if size >= n_samples:
+        return X, Y, np.ones(n_samples)
+
+    Z = np.concatenate([X, Y], axis=1).astype(np.float64)
+    Z_std = np.std(Z, axis=0)
+    Z = (Z - np.mean(Z, axis=0)) / np.where(Z_std > 0, Z_std, 1.0)
+
+    if method == 'sensitivity':
+        idx, weights = _sensitivity_sampling(Z, size, random_state)
+    else:
+        idx, weights = _kmeans_pp_seeding(Z, size, random_state)
+
+    return X[idx], Y[idx], weights
+
+
+def _sensitivity_sampling(Z, size, random_state):
+    n_samples = Z.shape[0]
+    sq_dist = np.sum(np.square(Z - np.mean(Z, axis=0)), axis=1)
+    if np.sum(sq_dist) > 0:
+        q = 0.5 / n_samples + 0.5 * sq_dist / np.sum(sq_dist)
+    else:
+        q = np.full(n_samples, 1. / n_samples)
+
+    draws = random_state.choice(n_samples, size=size, replace=True, p=q / np.sum(q))
+    idx, counts = np.unique(draws, return_counts=True)
+    return idx, counts / (size * q[idx])
+
+
+def _kmeans_pp_seeding(Z, size, random_state):
+    n_samples = Z.shape[0]
+    centers = [random_state.randint(n_samples)]
+    sq_dist = np.sum(np.square(Z - Z[centers[0]]), axis=1)
+    labels = np.zeros(n_samples, dtype=np.int64)
+
+    # D^2 seeding - the squared distances to and the index of the closest center are updated incrementally
+    for k in range(1, size):
+        if np.sum(sq_dist) <= 0:  # all samples coincide with a center
+            break
+        center = random_state.choice(n_samples, p=sq_dist / np.sum(sq_dist))
+        sq_dist_center = np.sum(np.square(Z - Z[center]), axis=1)
+        closer = sq_dist_center < sq_dist
+        labels[closer] = k
+        sq_dist = np.where(closer, sq_dist_center, sq_dist)
+        centers.append(center)
+
+    return np.asarray(centers), np.bincount(labels, minlength=len(centers)).astype(np.float64)
@@ -0,0 +1,111 @@
+import multiprocessing
+import numpy as np
+
+
+def fork_context():
+    """
+    The workers are target closures over the data and shared buffers of the parent process, which cannot be pickled for
+    the 'spawn' or 'forkserver' start methods. They are therefore always forked - regardless of the default start method
+    of the platform - which restricts the data-parallel training to POSIX systems. The forked workers must not use the
+    tensorflow graph or session of the parent process but build their own.
+
+    Returns: multiprocessing context with the 'fork' start method
+    """
+    assert 'fork' in multiprocessing.get_all_start_methods(), "data-parallel training requires the 'fork' start " \
+                                                               "method, which is only available on POSIX systems"
+    return multiprocessing.get_context('fork')
+
+
+class SharedAllReduce:
+    """
+    Sums vectors (e.g. flattened gradients) of n_workers local processes through shared memory. Every worker writes
+    its vector into its own row of a shared buffer and, once all workers have written, reads the sum over the rows.
+    All workers compute the sum in the same order and therefore obtain bit-identical results.
+
+    Must be created before the worker processes are forked.
+
+    Args:
+        n_workers: (int) number of worker processes
+        size: (int) length of the vectors
+        timeout: (optional) max. number of seconds a worker waits for the others before the reduction is aborted
+    """
+
+    def __init__(self, n_workers, size, timeout=None):
+        self.n_workers, self.size = n_workers, size
+        context = fork_context()
+        self._buffer = np.frombuffer(context.RawArray('d', n_workers * size)).reshape((n_workers, size))
+        self._barrier = context.Barrier(n_workers, timeout=timeout)
+
+    def all_reduce(self, rank, vector):
+        """
+        Args:
+            rank: (int) index of the calling worker in [0, n_workers)
+            vector: numpy array of shape (size,)
+
+        Returns:
+            sum of the vectors of all workers - numpy array of shape (size,)
+        """
+        self._buffer[rank] = vector
+        self._barrier.wait()
+        total = np.sum(self._buffer, axis=0)
+        # the buffer may only be overwritten once every worker has read the sum
+        self._barrier.wait()
+        return total
+
+    def abort(self):
+        """ Releases all waiting workers with a BrokenBarrierError, e.g. after another worker failed """
+        self._barrier.abort()
+
+
+def shared_array(size):
+    """ Returns: float64 numpy array of shape (size,) in shared memory - visible to all processes forked afterwards """
+    return np.frombuffer(fork_context().RawArray('d', size))
+
+
+def shard_batches(shard_indices, n_steps, shuffle=True, random_state=None):
+    """
+    Splits the row indices of a worker's data shard into exactly n_steps mini-batches - all workers perform the same
+    number of synchronous steps per epoch, even if their shards differ in size
+
+    Args:
+        shard_indices: row indices of the shard - numpy array of shape (n_shard,)
+        n_steps: (int) number of mini-batches per epoch
+        shuffle: (bool) whether to shuffle the rows of the shard
+        random_state: numpy RandomState used for shuffling
+
+    Returns:
+        list of n_steps index arrays
+    """
+    if shuffle:
+        random_state = np.random if random_state is None else random_state
+        shard_indices = random_state.permutation(shard_indices)
+    return np.array_split(shard_indices, n_steps)
+
+
+def run_workers(target, n_workers, all_reduce=None):
+    """
+    Runs target(rank) in n_workers forked processes (see fork_context - POSIX only) and waits for all of them. If a
+    worker fails, the all-reduce is aborted so that the remaining workers do not wait forever, and a RuntimeError is
+    raised.
+
+    Args:
+        target: callable with signature target(rank)
+        n_workers: (int) number of worker processes
+        all_reduce: (optional) SharedAllReduce used by the workers
+    """
+    context = fork_context()
+    workers = [context.Process(target=target, args=(rank,)) for rank in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    aborted = False
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(timeout=0.1)
+            if worker.exitcode not in (None, 0) and all_reduce is not None and not aborted:
+                all_reduce.abort()
+                aborted = True
+
+    exitcodes = [worker.exitcode for worker in workers]
+    if any(exitcode != 0 for exitcode in exitcodes):
+        raise RuntimeError("data-parallel worker processes failed with exit codes %s" % str(exitcodes))
@@ -0,0 +1,338 @@
+import threading
+import queue
+import numpy as np
+
+# number of batches that are prepared in a background thread while the current batch is processed
+N_PREFETCH_BATCHES = 2
+
+# streamed data is shuffled within a buffer of SHUFFLE_BUFFER_BATCHES * batch_size rows
+SHUFFLE_BUFFER_BATCHES = 10
+
+# number of rows that are processed at once when computing statistics of memory-mapped or streamed data
+STATISTICS_CHUNK_SIZE = 10 ** 5
+
+
+class TrainingData:
+    """
+    Source of the training data (X, Y) for the (mini-batch) training of the neural network based estimators. Either
+
+    - numpy arrays X, Y (also np.memmap - these are only read batch-wise), or
+    - a callable data_fn that returns a fresh iterable of (X_chunk, Y_chunk) tuples for every epoch, e.g. a generator
+      function reading the data from disk. The chunks may have arbitrary sizes and are re-chunked into mini-batches.
+
+    Args:
+        X: numpy array to be conditioned on - shape: (n_samples, n_dim_x) - or the callable data_fn
+        Y: numpy array of y targets - shape: (n_samples, n_dim_y) - or None if X is a callable
+        ndim_x: (int) dimensionality of x
+        ndim_y: (int) dimensionality of y
+        sample_weight: (optional) non-negative weights of the samples - numpy array of shape (n_samples,). If given,
+                       the batches are (X, Y, weights) tuples and the statistics are weighted. Not supported for data_fn.
+    """
+
+    def __init__(self, X, Y, ndim_x, ndim_y, sample_weight=None):
+        self.ndim_x, self.ndim_y = ndim_x, ndim_y
+        self._statistics = None
+
+        if callable(X):
+            assert Y is None, "Y must be None if the data is provided by a callable data_fn"
+            assert sample_weight is None, "sample weights are not supported for streamed data"
+            self.data_fn, self.X, self.Y = X, None, None
+        else:
+            assert X.shape[0] == Y.shape[0], "X and Y must have the same length along axis 0"
+            self.data_fn, self.X, self.Y = None, X, Y
+
+        if sample_weight is not None:
+            sample_weight = np.asarray(sample_weight, dtype=np.float64)
+            assert sample_weight.shape == (X.shape[0],), "sample_weight must have shape (n_samples,)"
+            assert np.all(sample_weight >= 0) and np.sum(sample_weight) > 0, "sample weights must be non-negative"
+        self.sample_weight = sample_weight
+
+    @property
+    def in_memory(self):
+        """ True if the data is held in (non-memory-mapped) numpy arrays """
+        return self.data_fn is None and not isinstance(self.X, np.memmap) and not isinstance(self.Y, np.memmap)
+
+    @property
+    def n_samples(self):
+        if self.data_fn is None:
+            return self.X.shape[0]
+        return self.statistics()['n_samples']
+
+    def batches(self, batch_size=None, shuffle=True, random_state=None, n_prefetch=N_PREFETCH_BATCHES):
+        """
+        Iterates once over the data (one epoch) in mini-batches
+
+        Args:
+            batch_size: (int) number of rows per batch - None: the whole data as one batch
+            shuffle: (bool) whether to shuffle the rows - streamed data is shuffled within a bounded buffer and
+                     memory-mapped data by shuffling the order of contiguous blocks
+            random_state: numpy RandomState used for shuffling
+            n_prefetch: number of batches that are prepared ahead in a background thread - 0 disables prefetching
+
+        Returns:
+            iterator over (X_batch, Y_batch) tuples - or (X_batch, Y_batch, weights_batch) if sample weights are given
+        """
+        random_state = np.random if random_state is None else random_state
+
+        if batch_size is None and self.data_fn is None:
+            return iter([self._rows(slice(None))])
+        elif self.data_fn is None:
+            batch_iter = self._array_batches(batch_size, shuffle, random_state)
+        else:
+            batch_iter = self._stream_batches(batch_size, shuffle, random_state)
+
+        if n_prefetch > 0:
+            return prefetch(batch_iter, n_prefetch=n_prefetch)
+        return batch_iter
+
+    def statistics(self, n_y_sample=STATISTICS_CHUNK_SIZE, random_state=None):
+        """
+        Computes the number of samples, mean and std of X and Y and a uniform random sub-sample of Y in one pass over
+        the data. Memory-mapped and streamed data are processed chunk-wise with bounded memory. With sample weights,
+        mean and std are weighted and the sub-sample of Y is drawn with probabilities proportional to the weights.
+
+        Returns:
+            dict with the keys 'n_samples', 'X_mean', 'X_std', 'Y_mean', 'Y_std' and 'Y_sample'
+        """
+        if self._statistics is not None:
+            return self._statistics
+        random_state = np.random if random_state is None else random_state
+
+        if self.in_memory and self.sample_weight is None:
+            Y_sample = self.Y
+            self._statistics = {'n_samples': self.X.shape[0], 'X_mean': np.mean(self.X, axis=0),
+                                'X_std': np.std(self.X, axis=0), 'Y_mean': np.mean(self.Y, axis=0),
+                                'Y_std': np.std(self.Y, axis=0), 'Y_sample': Y_sample}
+            return self._statistics
+
+        # running (n, mean, M2) of X and Y, merged chunk-wise (Chan et al.), and a bottom-k sample of Y with
+        # uniform random keys which is a uniform sub-sample of all rows seen so far - with sample weights, n is the
+        # sum of the weights and the keys are exponentially distributed with rate w (weighted sampling, Efraimidis)
+        n_samples, n, x_mean, x_m2, y_mean, y_m2 = 0, 0.0, 0.0, 0.0, 0.0, 0.0
+        y_sample, y_keys = np.zeros((0, self.ndim_y)), np.zeros(0)
+        for chunk in self._chunks():
+            X, Y = chunk[0].astype(np.float64), chunk[1].astype(np.float64)
+            weights = chunk[2] if self.sample_weight is not None else None
+            n_chunk = X.shape[0] if weights is None else np.sum(weights)
+            if n_chunk == 0:
+                continue
+            x_mean, x_m2 = merge_moments(n, x_mean, x_m2, X, weights=weights)
+            y_mean, y_m2 = merge_moments(n, y_mean, y_m2, Y, weights=weights)
+            n += n_chunk
+            n_samples += X.shape[0]
+
+            keys = random_state.uniform(size=X.shape[0])
+            if weights is not None:
+                with np.errstate(divide='ignore'):
+                    keys = - np.log(keys) / weights
+            y_sample, y_keys = np.concatenate([y_sample, Y]), np.concatenate([y_keys, keys])
+            if y_keys.shape[0] > n_y_sample:
+                keep = np.argpartition(y_keys, n_y_sample)[:n_y_sample]
+                y_sample, y_keys = y_sample[keep], y_keys[keep]
+
+        assert n > 0, "the training data must not be empty"
+        self._statistics = {'n_samples': n_samples, 'X_mean': x_mean, 'X_std': np.sqrt(x_m2 / n), 'Y_mean': y_mean,
+                            'Y_std': np.sqrt(y_m2 / n), 'Y_sample': y_sample}
+        return self._statistics
+
+    def _rows(self, idx):
+        # (X, Y) - or (X, Y, weights) - of the selected rows
+        if self.sample_weight is None:
+            return np.asarray(self.X[idx]), np.asarray(self.Y[idx])
+        return np.asarray(self.X[idx]), np.asarray(self.Y[idx]), self.sample_weight[idx]
+
+    def _chunks(self):
+        if self.data_fn is None:
+            for start in range(0, self.X.shape[0], STATISTICS_CHUNK_SIZE):
+                yield self._rows(slice(start, start + STATISTICS_CHUNK_SIZE))
+        else:
+            for X, Y in self.data_fn():
+                yield np.asarray(X).reshape((-1, self.ndim_x)), np.asarray(Y).reshape((-1, self.ndim_y))
+
+    def _array_batches(self, batch_size, shuffle, random_state):
+        n = self.X.shape[0]
+        if not shuffle:
+            for start in range(0, n, batch_size):
+                yield self._rows(slice(start, start + batch_size))
+        elif self.in_memory:
+            perm = random_state.permutation(n)
+            for start in range(0, n, batch_size):
+                yield self._rows(perm[start:start + batch_size])
+        else:
+            # random access into memory-mapped files is slow -> contiguous blocks in random order, shuffled within
+            for start in random_state.permutation(np.arange(0, n, batch_size)):
+                block = self._rows(slice(start, start + batch_size))
+                perm = random_state.permutation(block[0].shape[0])
+                yield tuple(array[perm] for array in block)
+
+    def _stream_batches(self, batch_size, shuffle, random_state):
+        assert batch_size is not None, "streamed data requires a batch_size"
+        buffer_size = batch_size * SHUFFLE_BUFFER_BATCHES if shuffle else batch_size
+        X_buffer, Y_buffer, n_buffer = [], [], 0
+
+        def _drain(X_buffer, Y_buffer, flush):
+            X, Y = np.concatenate(X_buffer), np.concatenate(Y_buffer)
+            if shuffle:
+                perm = random_state.permutation(X.shape[0])
+                X, Y = X[perm], Y[perm]
+            n_out = X.shape[0] if flush else (X.shape[0] // batch_size) * batch_size
+            batches = [(X[start:start + batch_size], Y[start:start + batch_size]) for start in range(0, n_out, batch_size)]
+            return batches, X[n_out:], Y[n_out:]
+
+        for X, Y in self._chunks():
+            X_buffer.append(X)
+            Y_buffer.append(Y)
+            n_buffer += X.shape[0]
+            if n_buffer >= buffer_size:
+                batches, X_rest, Y_rest = _drain(X_buffer, Y_buffer, flush=False)
+                for batch in batches:
+                    yield batch
+                X_buffer, Y_buffer, n_buffer = [X_rest], [Y_rest], X_rest.shape[0]
+
+        if n_buffer > 0:
+            batches, _, _ = _drain(X_buffer, Y_buffer, flush=True)
+            for batch in batches:
+                yield batch
+
+
+def prefetch(iterator, n_prefetch=N_PREFETCH_BATCHES):
+    """
+    Consumes an iterator in a background thread and yields its items, keeping up to n_prefetch items ready.
+    Exceptions raised in the background thread are re-raised in the consuming thread.
+
+    Args:
+        iterator: iterator to consume
+        n_prefetch: (int) max. number of items that are kept in the queue
+
+    Returns:
+        generator yielding the items of iterator
+    """
+    item_queue = queue.Queue(maxsize=n_prefetch)
+    end_of_data = object()
+    stop = threading.Event()
+
+    def _producer():
+        try:
+            for item in iterator:
+                while not stop.is_set():
+                    try:
+                        item_queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            item_queue.put(end_of_data)
+        except Exception as e:
+            item_queue.put(e)
+
+    thread = threading.Thread(target=_producer, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = item_queue.get()
+            if item is end_of_data:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def merge_moments(n, mean, m2, chunk, weights=None):
+    """
+    Merges the running mean and sum of squared deviations (M2) of n rows with those of a new chunk of rows
+    (Welford / Chan et al.). With weights, n is the running sum of weights and M2 the weighted sum of squared
+    deviations.
+
+    Returns:
+        (mean, M2) of all n + len(chunk) rows
+    """
+    if weights is None:
+        n_chunk = chunk.shape[0]
+        chunk_mean = np.mean(chunk, axis=0)
+        chunk_m2 = np.sum((chunk - chunk_mean) ** 2, axis=0)
+    else:
+        n_chunk = np.sum(weights)
+        chunk_mean = np.average(chunk, axis=0, weights=weights)
+        chunk_m2 = np.sum(weights[:, None] * (chunk - chunk_mean) ** 2, axis=0)
+    delta = chunk_mean - mean
+    n_total = n + n_chunk
+    return mean + delta * n_chunk / n_total, m2 + chunk_m2 + delta ** 2 * n * n_chunk / n_total
+
+
+def update_mean_std(n, mean, std, chunk, decay=None):
+    """
+    Updates the running mean and std of n rows with a new chunk of rows
+
+    Args:
+        n: (int) number of rows the running statistics are based on
+        mean: running mean - numpy array of shape (n_dim,)
+        std: running std - numpy array of shape (n_dim,)
+        chunk: new rows - numpy array of shape (n_chunk, n_dim)
+        decay: (optional) float in (0, 1] - if None, the statistics of all n + n_chunk rows are computed exactly
+               (Welford). Otherwise they are the mean and std of the mixture that weights the previous statistics
+               with (1 - decay) and the new chunk with decay, i.e. an exponential moving average that forgets old data.
+
+    Returns:
+        (mean, std) of the updated statistics
+    """
+    chunk = np.asarray(chunk, dtype=np.float64)
+    if chunk.shape[0] == 0:
+        return mean, std
+    if decay is None:
+        mean, m2 = merge_moments(n, mean, n * std ** 2, chunk)
+        return mean, np.sqrt(m2 / (n + chunk.shape[0]))
+
+    assert 0.0 < decay <= 1.0, "decay must be in (0, 1]"
+    chunk_mean, chunk_var = np.mean(chunk, axis=0), np.var(chunk, axis=0)
+    delta = chunk_mean - mean
+    var = (1 - decay) * std ** 2 + decay * chunk_var + decay * (1 - decay) * delta ** 2
+    return mean + decay * delta, np.sqrt(var)
+
+
+class ReservoirBuffer:
+    """
+    Bounded buffer holding a uniform random sub-sample of all rows (x, y) that were ever added to it (reservoir
+    sampling). Used to replay past training data when a model is updated incrementally.
+
+    Args:
+        max_size: (int) max. number of rows kept in the buffer
+        ndim_x: (int) dimensionality of x
+        ndim_y: (int) dimensionality of y
+        random_state: numpy RandomState used for the replacement decisions and sampling
+    """
+
+    def __init__(self, max_size, ndim_x, ndim_y, random_state=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.random_state = np.random if random_state is None else random_state
+        self.X, self.Y = np.zeros((0, ndim_x)), np.zeros((0, ndim_y))
+        self.n_seen = 0
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def add(self, X, Y):
+        """ Adds the rows of X, Y - each of the rows seen so far is kept with the same probability """
+        assert X.shape[0] == Y.shape[0]
+        n_fill = min(self.max_size - len(self), X.shape[0])
+        if n_fill > 0:
+            self.X, self.Y = np.concatenate([self.X, X[:n_fill]]), np.concatenate([self.Y, Y[:n_fill]])
+
+        # the t-th row (0-based) replaces a random slot with probability max_size / (t + 1) - for slots drawn
+        # several times the last row wins, as in the sequential algorithm
+        t = self.n_seen + np.arange(n_fill, X.shape[0])
+        slots = np.floor(self.random_state.uniform(size=t.shape[0]) * (t + 1)).astype(np.int64)
+        replace = slots < self.max_size
+        self.X[slots[replace]], self.Y[slots[replace]] = X[n_fill:][replace], Y[n_fill:][replace]
+        self.n_seen += X.shape[0]
+
+    def sample(self, n_samples=None):
+        """ Returns: (X, Y) - n_samples rows drawn without replacement from the buffer (all rows if None) """
+        if n_samples is None or n_samples >= len(self):
+            return self.X, self.Y
+        idx = self.random_state.choice(len(self), size=n_samples, replace=False)
+        return self.X[idx], self.Y[idx]
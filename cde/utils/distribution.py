@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.special import gamma, gammaln, stdtr
+from scipy.special import gamma, gammaln, stdtr, stdtrit
 
 """ Multivariate Student-t pdf and rvs """
 
@@ -98,4 +98,121 @@ def multivariate_t_rvs(loc, cov, dof=np.inf, n=1, random_state=None):
 def _standard_student_t_pdf(x, dof):
   p = np.exp(gammaln((dof + 1) / 2) - gammaln(dof / 2))
   p /= np.sqrt(dof * np.pi) * (1 + (x ** 2) / dof) ** ((dof + 1) / 2)
-  return p
\ No newline at end of file
+  return p
+
+""" Quasi-Monte Carlo (low-discrepancy) points """
+
+QMC_METHODS = ['sobol', 'halton']
+
+SOBOL_MAX_DIM = 10
+_SOBOL_BITS = 32
+# degree s, coefficients a of the primitive polynomials and initial direction numbers m of the dimensions 2 - 10
+# (S. Joe and F. Y. Kuo, Constructing Sobol sequences with better two-dimensional projections, 2008)
+_SOBOL_PARAMS = [(1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]), (4, 1, [1, 1, 3, 3]),
+                 (4, 4, [1, 3, 5, 13]), (5, 2, [1, 1, 5, 5, 17]), (5, 4, [1, 1, 5, 5, 5]), (5, 7, [1, 1, 7, 11, 19])]
+
+_HALTON_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97]
+
+
+def qmc_uniform(n, ndim, method='sobol', start=0, shift=None):
+  """ Randomized low-discrepancy points in the unit cube [0, 1)^ndim. The points with index start, ..., start + n - 1
+  of the sequence are returned, so that a sequence can be generated in consecutive chunks. The points are randomized
+  with a random digital shift (sobol) or a random shift modulo 1 (halton) - the same shift must be used for all chunks.
+
+  Args:
+    n: (int) number of points
+    ndim: (int) number of dimensions
+    method: (str) low-discrepancy sequence - either 'sobol' or 'halton'
+    start: (int) index of the first point in the sequence
+    shift: (optional) random shift - numpy array of shape (ndim,) with values in [0, 1). If None, the points are not
+           randomized
+
+  Returns:
+    points - numpy array of shape (n, ndim)
+  """
+  assert method in QMC_METHODS, "method must be one of %s" % str(QMC_METHODS)
+  assert shift is None or np.shape(shift) == (ndim,)
+  idx = np.arange(start, start + n, dtype=np.uint64)
+
+  if method == 'sobol':
+    assert ndim <= SOBOL_MAX_DIM, "sobol sequence only supports up to %i dimensions" % SOBOL_MAX_DIM
+    directions = _sobol_direction_numbers(ndim)
+    points = np.zeros((n, ndim), dtype=np.uint64)
+    for bit in range(_SOBOL_BITS):
+      mask = ((idx >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+      points[mask] ^= directions[:, bit]
+    if shift is not None:
+      points ^= np.floor(np.asarray(shift) * 2 ** _SOBOL_BITS).astype(np.uint64)
+    return points.astype(np.float64) / 2 ** _SOBOL_BITS
+
+  else:
+    assert ndim <= len(_HALTON_PRIMES), "halton sequence only supports up to %i dimensions" % len(_HALTON_PRIMES)
+    points = np.stack([_radical_inverse(idx + np.uint64(1), base) for base in _HALTON_PRIMES[:ndim]], axis=1)
+    if shift is not None:
+      points = np.mod(points + np.asarray(shift), 1.)
+    return points
+
+
+def multidim_t_qmc_rvs(mu, sigma, dof, N=1, method='sobol', start=0, shift=None):
+  ''' maps randomized low-discrepancy points through the inverse cdf of independent univariate t distributions
+
+  Args:
+      mu = mean - array of shape (ndim_x, )
+      sigma: squared scale - array of shape (ndim_x, )
+      dof: (numeric) degrees of freedom
+      N: (int) number of points
+      method: (str) low-discrepancy sequence - either 'sobol' or 'halton'
+      start: (int) index of the first point in the sequence
+      shift: random shift of the low-discrepancy points - array of shape (ndim_x, ) with values in [0, 1)
+
+  Returns:
+      rvs: ndarray, (N, ndim_x)
+  '''
+  u = qmc_uniform(N, mu.shape[0], method=method, start=start, shift=shift)
+  u = np.clip(u, 2. ** -(_SOBOL_BITS + 1), 1. - 2. ** -(_SOBOL_BITS + 1))
+  return mu + np.sqrt(sigma) * stdtrit(dof, u)
+
+
+def product_t_pdf(x, mu, sigma, dof):
+  '''
+  Density of independent univariate t distributions - proposal density of multidim_t_qmc_rvs
+
+  Args:
+      x: points where to calculate the pdf - array of shape (batch_size, ndim_x)
+      mu: mean - array of shape (ndim_x, )
+      sigma: squared scale -  array of shape (ndim_x, )
+      dof = degrees of freedom
+
+  Returns:
+      p: probability density p(x) - array of shape (batch_size)
+  '''
+  scale = np.sqrt(sigma)
+  p = np.prod(_standard_student_t_pdf((x - mu) / scale, dof) / scale, axis=-1)
+  assert p.ndim == 1
+  return p
+
+
+def _sobol_direction_numbers(ndim):
+  directions = np.zeros((ndim, _SOBOL_BITS), dtype=np.uint64)
+  directions[0] = [1 << (_SOBOL_BITS - 1 - k) for k in range(_SOBOL_BITS)]
+  for d in range(1, ndim):
+    s, a, m = _SOBOL_PARAMS[d - 1]
+    v = [m[k] << (_SOBOL_BITS - 1 - k) for k in range(s)]
+    for k in range(s, _SOBOL_BITS):
+      v_k = v[k - s] ^ (v[k - s] >> s)
+      for j in range(1, s):
+        if (a >> (s - 1 - j)) & 1:
+          v_k ^= v[k - j]
+      v.append(v_k)
+    directions[d] = v
+  return directions
+
+
+def _radical_inverse(idx, base):
+  idx = idx.copy()
+  inverse, factor = np.zeros(idx.shape[0]), 1. / base
+  while np.any(idx > 0):
+    inverse += factor * (idx % np.uint64(base)).astype(np.float64)
+    idx //= np.uint64(base)
+    factor /= base
+  return inverse
@@ -0,0 +1,75 @@
+import time
+import numpy as np
+
+
+class EarlyStopping:
+    """
+    Monitors the (validation) loss of a neural network estimator during training and decides when to stop. Every time
+    the monitored loss improves by more than min_delta, the parameter vector of the estimator is snapshotted with
+    get_param_values. When the training ends, the best snapshot is restored with set_param_values.
+
+    Args:
+        estimator: Parameterized estimator (provides get_param_values / set_param_values)
+        patience: (int) number of evaluations without improvement after which the training is stopped - if None, the
+                  training is only stopped by max_fit_time
+        min_delta: (float) minimum decrease of the monitored loss that counts as an improvement
+        eval_interval: (int) number of epochs between two evaluations of the monitored loss
+        max_fit_time: (float) wall-clock time budget in seconds - if None, the fit time is not limited
+    """
+
+    def __init__(self, estimator, patience=None, min_delta=0.0, eval_interval=1, max_fit_time=None):
+        assert patience is None or patience > 0
+        assert eval_interval > 0
+        self.estimator = estimator
+        self.patience = patience
+        self.min_delta = min_delta
+        self.eval_interval = eval_interval
+        self.max_fit_time = max_fit_time
+
+        self.start_time = time.time()
+        self.best_loss = np.inf
+        self.best_epoch = None
+        self.best_params = None
+        self.stopped_epoch = None
+        self._n_evals_without_improvement = 0
+
+    @property
+    def active(self):
+        return self.patience is not None or self.max_fit_time is not None
+
+    def is_eval_epoch(self, epoch):
+        return self.active and epoch % self.eval_interval == 0
+
+    def update(self, epoch, loss):
+        """
+        Registers the monitored loss of an evaluation epoch and snapshots the parameters if it improved
+
+        Args:
+            epoch: (int) current epoch
+            loss: (float) monitored loss, e.g. the mean log-loss on the validation set
+
+        Returns:
+            (boolean) True if the training should be stopped
+        """
+        if loss < self.best_loss - self.min_delta:
+            self.best_loss, self.best_epoch = loss, epoch
+            self.best_params = self.estimator.get_param_values()
+            self._n_evals_without_improvement = 0
+        else:
+            self._n_evals_without_improvement += 1
+
+        if self.patience is not None and self._n_evals_without_improvement >= self.patience:
+            self.stopped_epoch = epoch
+        return self.stop(epoch)
+
+    def stop(self, epoch):
+        """ Returns: (boolean) True if the patience is exhausted or the time budget is used up """
+        if self.stopped_epoch is None and self.max_fit_time is not None \
+                and time.time() - self.start_time > self.max_fit_time:
+            self.stopped_epoch = epoch
+        return self.stopped_epoch is not None
+
+    def restore_best_params(self):
+        """ Sets the parameters of the estimator to the best snapshot (if any) """
+        if self.best_params is not None:
+            self.estimator.set_param_values(self.best_params)
@@ -0,0 +1,360 @@
+import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import norm
+
+from cde.utils.optimizers import find_root_bracketed
+
+
+class GaussianMixtureMixin:
+    """
+    Closed-form statistics of conditional gaussian mixtures with diagonal components, computed in numpy from the
+    mixture components. Requires the class to provide ndim_y, fitted, can_sample and the method
+    _get_mixture_components(X) which returns the weights - numpy array of shape (n_samples, n_centers) - as well as
+    the locs and scales (standard deviations) - numpy arrays of shape (n_samples, n_centers, ndim_y) - of p(y|x).
+    """
+
+    def mean_(self, x_cond, n_samples=None, sampling='mc'):
+        """ Mean of the fitted distribution conditioned on x_cond
+        Args:
+          x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+
+        Returns:
+          Means E[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y)
+        """
+        assert self.fitted, "model must be fitted"
+        x_cond = self._handle_input_dimensionality(x_cond)
+        return self._mixture_central_moments(x_cond, max_order=1)[0]
+
+    def std_(self, x_cond, n_samples=10 ** 6):
+        """ Standard deviation of the fitted distribution conditioned on x_cond
+
+        Args:
+          x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+
+        Returns:
+          Standard deviations  sqrt(Var[y|x]) corresponding to x_cond - numpy array of shape (n_values, ndim_y)
+        """
+        covs = self.covariance(x_cond, n_samples=n_samples)
+        return np.sqrt(np.diagonal(covs, axis1=1, axis2=2))
+
+    def covariance(self, x_cond, n_samples=None, sampling='mc'):
+        """ Covariance of the fitted distribution conditioned on x_cond
+
+          Args:
+            x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+
+          Returns:
+            Covariances Cov[y|x] corresponding to x_cond - numpy array of shape (n_values, ndim_y, ndim_y)
+        """
+        assert self.fitted, "model must be fitted"
+        x_cond = self._handle_input_dimensionality(x_cond)
+        return self._mixture_central_moments(x_cond, max_order=2)[1]
+
+    def mean_std(self, x_cond, n_samples=None):
+        """ Computes Mean and Covariance of the fitted distribution conditioned on x_cond.
+            Computationally more efficient than calling mean and covariance computatio separately
+
+        Args:
+          x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+
+        Returns:
+          Means E[y|x] and Covariances Cov[y|x]
+        """
+        return self.moments(x_cond, orders=(1, 2))
+
+    def moments(self, x_cond, orders=(1, 2, 3, 4), n_samples=None):
+        """ Computes several moments of the fitted distribution conditioned on x_cond in closed form from the mixture
+            components, which are obtained with a single forward pass of the network
+
+        Args:
+          x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+          orders: tuple of moment orders - 1: mean, 2: standard deviation, 3: skewness, 4: excess kurtosis.
+                  Orders 3 and 4 are only supported for ndim_y = 1
+
+        Returns:
+          tuple with one entry per order
+            - order 1: Means E[y|x] - numpy array of shape (n_values, ndim_y)
+            - order 2: Standard deviations sqrt(Var[y|x]) - numpy array of shape (n_values, ndim_y)
+            - order 3: Skewness Skew[y|x] - numpy array of shape (n_values,)
+            - order 4: Excess kurtosis Kurt[y|x] - 3 - numpy array of shape (n_values,)
+        """
+        assert self.fitted, "model must be fitted"
+        self._assert_moment_orders(orders)
+        x_cond = self._handle_input_dimensionality(x_cond)
+
+        central_moments = self._mixture_central_moments(x_cond, max_order=4 if self.ndim_y == 1 else 2)
+        means, stds = central_moments[0], np.sqrt(np.diagonal(central_moments[1], axis1=1, axis2=2))
+        if self.ndim_y == 1:
+            return self._select_moments(orders, means, stds, central_moments[2][:, 0, 0, 0],
+                                        central_moments[3][:, 0, 0, 0, 0])
+        return self._select_moments(orders, means, stds, None, None)
+
+    def sample(self, X, random_state=None):
+        """ sample from the conditional mixture distributions - requires the model to be fitted
+
+          Args:
+            X: values to be conditioned on when sampling - numpy array of shape (n_instances, n_dim_x)
+            random_state: (optional) seeded numpy Generator or int seed - if None, the generator is seeded from the
+                          global numpy random state
+
+          Returns: tuple (X, Y)
+            - X - the values to conditioned on that were provided as argument - numpy array of shape (n_samples, ndim_x)
+            - Y - conditional samples from the model p(y|x) - numpy array of shape (n_samples, ndim_y)
+        """
+        assert self.fitted, "model must be fitted to compute likelihood score"
+        assert self.can_sample
+
+        X = self._handle_input_dimensionality(X)
+        rng = self._get_generator(random_state)
+
+        if np.all(np.all(X == X[0, :], axis=1)):
+            # identical rows -> the network only needs to be evaluated once
+            Y = self._sample_mixture(*self._get_mixture_components(X[:1]), rows=np.zeros(X.shape[0], dtype=np.int64),
+                                     rng=rng)
+        else:
+            Y = self._sample_mixture(*self._get_mixture_components(X), rows=np.arange(X.shape[0]), rng=rng)
+        assert Y.shape == (X.shape[0], self.ndim_y)
+        return X, Y
+
+    def sample_n(self, x_cond, n_per_x, random_state=None):
+        """ draws n_per_x samples from each of the conditional mixture distributions p(y|x_cond) - the network is
+            evaluated only once per x_cond
+
+          Args:
+            x_cond: values to be conditioned on when sampling - numpy array of shape (n_values, n_dim_x)
+            n_per_x: (int) number of samples per x_cond
+            random_state: (optional) seeded numpy Generator or int seed - if None, the generator is seeded from the
+                          global numpy random state
+
+          Returns:
+            conditional samples from the model p(y|x) - numpy array of shape (n_values, n_per_x, ndim_y)
+        """
+        assert self.fitted, "model must be fitted to compute likelihood score"
+        assert self.can_sample
+
+        x_cond = self._handle_input_dimensionality(x_cond)
+        rng = self._get_generator(random_state)
+
+        rows = np.repeat(np.arange(x_cond.shape[0]), n_per_x)
+        Y = self._sample_mixture(*self._get_mixture_components(x_cond), rows=rows, rng=rng)
+        return Y.reshape((x_cond.shape[0], n_per_x, self.ndim_y))
+
+    def conditional_value_at_risk(self, x_cond, alpha=0.01, n_samples=10**7):
+        """ Computes the Conditional Value-at-Risk (CVaR) / Expected Shortfall of a GMM. Only if ndim_y = 1
+
+            Based on formulas from section 2.3.2 in "Expected shortfall for distributions in finance",
+            Simon A. Broda, Marc S. Paolella, 2011
+
+           Args:
+             x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+             alpha: quantile percentage of the distribution
+
+           Returns:
+             CVaR values for each x to condition on - numpy array of shape (n_values)
+           """
+        _, CVaRs = self.tail_risk_measures(x_cond, alpha=alpha, n_samples=n_samples)
+        return CVaRs
+
+    def tail_risk_measures(self, x_cond, alpha=0.01, n_samples=10 ** 7):
+        """ Computes the Value-at-Risk (VaR) and Conditional Value-at-Risk (CVaR). Both are computed from the mixture
+            components which are obtained with a single forward pass of the network
+
+            Args:
+              x_cond: different x values to condition on - numpy array of shape (n_values, ndim_x)
+              alpha: quantile percentage of the distribution - either a float or an array-like of shape (n_alphas) in
+                     which case the risk measures of all alphas are computed jointly
+              n_samples: number of samples for monte carlo model_fitting
+
+            Returns:
+              - VaR values for each x to condition on - numpy array of shape (n_values) or (n_values, n_alphas)
+              - CVaR values for each x to condition on - numpy array of shape (n_values) or (n_values, n_alphas)
+            """
+        assert self.fitted, "model must be fitted"
+        assert self.ndim_y == 1, "Value at Risk can only be computed when ndim_y = 1"
+        x_cond = self._handle_input_dimensionality(x_cond)
+        assert x_cond.ndim == 2
+
+        alphas = np.asarray(alpha, dtype=np.float64).reshape((-1,))
+        weights, locs, scales = self._get_mixture_components(x_cond)
+
+        VaRs = self._quantiles_mixture(weights, locs, scales, alphas)
+        CVaRs = self._conditional_value_at_risk_mixture(VaRs, weights, locs, scales, alphas)
+
+        shape = (len(x_cond),) + np.shape(alpha)
+        return VaRs.reshape(shape), CVaRs.reshape(shape)
+
+    def cdf(self, X, Y):
+        """ Predicts the conditional cumulative probability p(Y<=y|X=x). Requires the model to be fitted.
+
+           Args:
+             X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+             Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+           Returns:
+             conditional cumulative probability p(Y<=y|X=x) - numpy array of shape (n_query_samples, )
+
+        """
+        assert self.fitted, "model must be fitted to compute likelihood score"
+        assert hasattr(self, '_get_mixture_components'), "cdf computation requires _get_mixture_components method"
+
+        X, Y = self._handle_input_dimensionality(X, Y, fitting=False)
+
+        weights, locs, scales = self._get_mixture_components(X)
+
+        # the mixture components are gaussians with diagonal covariance -> their cdfs factorize into products of
+        # univariate normal cdfs which are evaluated for all (n_samples, n_centers, ndim_y) at once
+        component_cdfs = np.prod(norm.cdf((Y[:, None, :] - locs) / scales), axis=2)
+        P = np.sum(weights * component_cdfs, axis=1)
+        return P
+
+    def _quantiles_cdf(self, x_cond, alphas, eps=1e-8):
+        # replaces the generic root finding on self.cdf -> the mixture components are computed only once
+        weights, locs, scales = self._get_mixture_components(x_cond)
+        return self._quantiles_mixture(weights, locs, scales, alphas, eps=eps)
+
+    def _quantiles_mixture(self, weights, locs, scales, alphas, eps=1e-8):
+        """ Solves F(q|x) = alpha of the univariate gaussian mixtures for all (x, alpha) pairs in numpy, using newton
+        steps with the analytic mixture pdf within the brackets [min_k q_k, max_k q_k] spanned by the alpha-quantiles
+        q_k of the individual components
+
+        Returns:
+          quantiles - numpy array of shape (n_values, n_alphas)
+        """
+        assert np.all(alphas > 0) and np.all(alphas < 1), "quantile levels alpha must be within (0, 1)"
+        n_values, n_alphas = weights.shape[0], alphas.shape[0]
+        W = np.repeat(weights, n_alphas, axis=0)
+        L = np.repeat(locs.reshape(weights.shape), n_alphas, axis=0)
+        S = np.repeat(scales.reshape(weights.shape), n_alphas, axis=0)
+        A = np.tile(alphas, n_values)
+
+        # every component cdf is <= alpha left of all component quantiles and >= alpha right of them
+        component_quantiles = L + S * norm.ppf(A)[:, None]
+        left, right = np.min(component_quantiles, axis=1) - eps, np.max(component_quantiles, axis=1) + eps
+        x0 = np.sum(W * component_quantiles, axis=1)
+
+        cdf_fun = lambda y, idx: np.sum(W[idx] * norm.cdf((y[:, None] - L[idx]) / S[idx]), axis=1) - A[idx]
+        pdf_fun = lambda y, idx: np.sum(W[idx] * norm.pdf((y[:, None] - L[idx]) / S[idx]) / S[idx], axis=1)
+
+        quantiles = find_root_bracketed(cdf_fun, left=left, right=right, x0=x0, grad=pdf_fun, eps=eps)
+        return quantiles.reshape((n_values, n_alphas))
+
+    def _conditional_value_at_risk_mixture(self, VaRs, weights, locs, scales, alphas):
+        """
+        Based on formulas from section 2.3.2 in "Expected shortfall for distributions in finance",
+        Simon A. Broda, Marc S. Paolella, 2011
+
+        --> CVaR = sum_k w_k / alpha * (mu_k Phi(c_k) - sigma_k phi(c_k))  with  c_k = (VaR - mu_k) / sigma_k,
+            evaluated for all (n_values, n_alphas, n_centers) at once
+
+        Returns:
+          CVaRs - numpy array of shape (n_values, n_alphas)
+        """
+        locs = locs.reshape(weights.shape)[:, None, :]
+        scales = scales.reshape(weights.shape)[:, None, :]
+
+        c = (VaRs.reshape((weights.shape[0], -1))[:, :, None] - locs) / scales
+        tail_expectations = locs * norm.cdf(c) - scales * norm.pdf(c)
+        CVaRs = np.sum(weights[:, None, :] * tail_expectations, axis=2) / alphas
+        return CVaRs
+
+    def _mixture_central_moments(self, x_cond, max_order=4):
+        """ Exact mean and central (co-)moment tensors up to max_order of the gaussian mixtures with diagonal components.
+        With the component deviations a_k = mu_k - mean and component covariances S_k, the central moments are the
+        weighted sums of  E[(z + a_k)^(x r)]  with z ~ N(0, S_k) in which all odd moments of z vanish, e.g.
+        M3_ijl = sum_k w_k (a_i a_j a_l + S_ij a_l + S_il a_j + S_jl a_i)  --> all contracted with einsum
+
+        Args:
+          x_cond: x values to condition on - numpy array of shape (n_values, ndim_x)
+          max_order: (int) highest moment order within 1 - 4
+
+        Returns:
+          list with the means - numpy array of shape (n_values, ndim_y) followed by the central moment tensors of order
+          2, ..., max_order - numpy arrays of shape (n_values,) + (ndim_y,) * order
+        """
+        assert hasattr(self, '_get_mixture_components')
+        assert 1 <= max_order <= 4
+        weights, locs, scales = self._get_mixture_components(x_cond)
+        assert weights.ndim == 2 and locs.ndim == 3
+
+        means = np.einsum('nk,nki->ni', weights, locs)
+        a = locs - means[:, None, :]
+        S = np.einsum('nki,ij->nkij', scales ** 2, np.eye(self.ndim_y))
+
+        central_moments = [means]
+        if max_order >= 2:
+            central_moments.append(np.einsum('nk,nkij->nij', weights, S) + np.einsum('nk,nki,nkj->nij', weights, a, a))
+        if max_order >= 3:
+            terms = ['nki,nkj,nkl', 'nkij,nkl', 'nkil,nkj', 'nkjl,nki']
+            operands = {1: a, 2: S}
+            central_moments.append(sum(self._weighted_einsum(weights, t, '->nijl', operands) for t in terms))
+        if max_order >= 4:
+            terms = ['nki,nkj,nkl,nkm', 'nkij,nkl,nkm', 'nkil,nkj,nkm', 'nkim,nkj,nkl', 'nkjl,nki,nkm', 'nkjm,nki,nkl',
+                     'nklm,nki,nkj', 'nkij,nklm', 'nkil,nkjm', 'nkim,nkjl']
+            operands = {1: a, 2: S}
+            central_moments.append(sum(self._weighted_einsum(weights, t, '->nijlm', operands) for t in terms))
+        return central_moments
+
+    @staticmethod
+    def _weighted_einsum(weights, term, output, operands):
+        # component weighted einsum of a product of deviations (1 free index) and covariances (2 free indices)
+        subscripts = term.split(',')
+        return np.einsum('nk,' + term + output, weights, *[operands[len(sub) - 2] for sub in subscripts], optimize=True)
+
+    def _conditional_location_scale(self, x_cond):
+        # closed-form mixture mean and standard deviation -> tight per-x integration brackets
+        means, stds = self.mean_std(x_cond)
+        return means[:, 0], stds[:, 0]
+
+    def _sample_mixture(self, weights, locs, scales, rows, rng):
+        """ vectorized sampling from the gaussian mixtures of the given rows - the components are selected by inverse
+        cdf sampling on the cumulative weights, followed by one batched draw of standard normals
+
+        Args:
+          weights, locs, scales: mixture components - numpy arrays of shape (n_mixtures, n_centers) and
+                                 (n_mixtures, n_centers, ndim_y)
+          rows: index of the mixture of each sample - numpy array of shape (n_samples,)
+          rng: numpy Generator
+
+        Returns:
+          samples - numpy array of shape (n_samples, ndim_y)
+        """
+        assert locs.shape[1] == scales.shape[1] == weights.shape[1]
+
+        n_centers = weights.shape[1]
+        cum_weights = np.cumsum(weights.astype(np.float64), axis=1)
+        cum_weights /= cum_weights[:, -1:]
+
+        # offsetting the cumulative weights of mixture i by i makes them one sorted array over all mixtures
+        # -> a single binary search selects the components of all samples
+        offset_cum_weights = (cum_weights + np.arange(weights.shape[0])[:, None]).flatten()
+        u = rng.random(rows.shape[0])
+        components = np.searchsorted(offset_cum_weights, rows + u, side='right') - rows * n_centers
+        components = np.clip(components, 0, n_centers - 1)
+
+        return locs[rows, components] + scales[rows, components] * rng.standard_normal((rows.shape[0], self.ndim_y))
+
+    @staticmethod
+    def _get_generator(random_state):
+        if isinstance(random_state, np.random.Generator):
+            return random_state
+        if random_state is None:
+            random_state = np.random.randint(0, 2 ** 31 - 1)
+        return np.random.default_rng(random_state)
+
+
+def mixture_log_pdf(log_weights, locs, scales, Y):
+    """ log-density of gaussian mixtures with diagonal components, reduced over the components with a logsumexp
+
+    Args:
+      log_weights: log-weights of the components - numpy array of shape (n_samples, n_centers)
+      locs: locations of the components - numpy array of shape (n_samples or 1, n_centers, ndim_y)
+      scales: standard deviations of the components - numpy array of the same shape as locs
+      Y: numpy array of shape (n_samples, ndim_y)
+
+    Returns:
+      log-densities log p(y) - numpy array of shape (n_samples,)
+    """
+    z = (Y[:, None, :] - locs) / scales
+    component_log_probs = - 0.5 * np.sum(np.square(z), axis=2) - np.sum(np.log(scales), axis=2) \
+                          - 0.5 * Y.shape[1] * np.log(2 * np.pi)
+    return logsumexp(log_weights + component_log_probs, axis=1)
@@ -7,9 +7,30 @@ import numbers
 
 import scipy.integrate as integrate
 
-from cde.utils.distribution import multidim_t_pdf, multidim_t_rvs, multivariate_t_rvs
+from cde.utils.distribution import multidim_t_pdf, multidim_t_rvs, multivariate_t_rvs, multidim_t_qmc_rvs, \
+  product_t_pdf, QMC_METHODS
 
 N_SAMPLES_ADAPT = 10**3
+N_SAMPLES_BATCH = 10**5
+MAX_EVALS_ADAPT = 10**5 # max. number of integrand evaluations per integral of the adaptive quadrature
+
+""" Gauss-Kronrod (7, 15) rule on [-1, 1] - nodes and weights from QUADPACK (qk15) """
+_GK15_NODES_HALF = np.array([0.991455371120812639206854697526329, 0.949107912342758524526189684047851,
+                             0.864864423359769072789712788640926, 0.741531185599394439863864773280788,
+                             0.586087235467691130294144845693013, 0.405845151377397166906606412076961,
+                             0.207784955007898467600689403773245])
+_GK15_WEIGHTS_KRONROD_HALF = np.array([0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+                                       0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+                                       0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+                                       0.204432940075298892414161999234649])
+_GK15_WEIGHTS_GAUSS_HALF = np.array([0., 0.129484966168869693270611432679082, 0., 0.279705391489276667901467771423780,
+                                     0., 0.381830050505118944950369775488975, 0.])
+
+GK15_NODES = np.concatenate([-_GK15_NODES_HALF, [0.], _GK15_NODES_HALF[::-1]])
+GK15_WEIGHTS_KRONROD = np.concatenate([_GK15_WEIGHTS_KRONROD_HALF, [0.209482141084727828012999174891714],
+                                       _GK15_WEIGHTS_KRONROD_HALF[::-1]])
+GK15_WEIGHTS_GAUSS = np.concatenate([_GK15_WEIGHTS_GAUSS_HALF, [0.417959183673469387755102040816327],
+                                     _GK15_WEIGHTS_GAUSS_HALF[::-1]])
 
 def numeric_integation(func, n_samples=10 ** 5, bound_lower=-10**3, bound_upper=10**3):
   """ Numeric integration over one dimension using the trapezoidal rule
@@ -29,46 +50,204 @@ def numeric_integation(func, n_samples=10 ** 5, bound_lower=-10**3, bound_upper=
   return integral
 
 
-def mc_integration_student_t(func, ndim, n_samples=10 ** 6, batch_size=None, loc_proposal=0,
-                             scale_proposal=2, dof=6):
-    """ Monte carlo integration using importance sampling with a cauchy distribution
+def adaptive_gauss_kronrod(func, lower, upper, rtol=1e-8, atol=1e-12, n_subintervals=16, max_iter=30,
+                           max_evals=MAX_EVALS_ADAPT):
+  """ Vectorized adaptive Gauss-Kronrod (7, 15) quadrature of many one-dimensional integrals at once
+
+  The intervals [lower_i, upper_i] are first split into n_subintervals equally sized subintervals. In each iteration,
+  the integrand is evaluated on the 15 Kronrod nodes of all active subintervals (of all integrals) with a single
+  func call. A subinterval is accepted once the difference between its Kronrod and Gauss estimates is below its share
+  max(atol, rtol * |integral_i|) * length / (upper_i - lower_i) of the tolerance - otherwise it is bisected.
+
+  The integrand cannot be integrated more accurately than its rounding errors: the precision eps of its dtype (e.g.
+  float32 for the pdfs of the tensorflow estimators) raises rtol to at least 10 * eps, and - as in QUADPACK - the
+  error estimate of a subinterval is not required to fall below 50 * eps * int |f|. Once the bisection of an integral
+  would exceed max_evals integrand evaluations, its remaining subintervals are accepted.
+
+  Args:
+    func: vectorized integrand func(y, idx) - must take a numpy array y of shape (n_intervals, 15) and an index array
+          idx of shape (n_intervals,) that maps each row of y to its integral and return a numpy array of shape
+          (n_intervals, 15) or (n_intervals, 15, ndim_out)
+    lower: lower integration bounds - numpy array of shape (n_integrals,)
+    upper: upper integration bounds - numpy array of shape (n_integrals,)
+    rtol: (float) relative error tolerance
+    atol: (float) absolute error tolerance
+    n_subintervals: (int) number of subintervals of the initial partition
+    max_iter: (int) maximum number of bisection rounds - remaining subintervals are accepted afterwards
+    max_evals: (int) budget of integrand evaluations per integral
+
+  Returns:
+    (integrals, errors) - approximated integrals and their estimated absolute errors - numpy arrays of shape
+    (n_integrals,) or (n_integrals, ndim_out)
+  """
+  lower, upper = np.atleast_1d(np.asarray(lower, dtype=np.float64)), np.atleast_1d(np.asarray(upper, dtype=np.float64))
+  assert lower.ndim == 1 and lower.shape == upper.shape
+  assert n_subintervals >= 1 and max_iter >= 1
+
+  n_integrals = lower.shape[0]
+  total_length = np.abs(upper - lower)
+  total_length[total_length == 0] = 1.
+
+  edges = np.linspace(lower, upper, num=n_subintervals + 1, axis=-1)
+  a, b = edges[:, :-1].flatten(), edges[:, 1:].flatten()
+  idx = np.repeat(np.arange(n_integrals), n_subintervals)
+
+  n_nodes, n_evals = GK15_NODES.shape[0], np.zeros(n_integrals, dtype=np.int64)
+  integrals, errors = None, None
+  for i in range(max_iter):
+    center, half_length = (a + b) / 2, (b - a) / 2
+    y = center[:, None] + half_length[:, None] * GK15_NODES[None, :]
+
+    values = np.asarray(func(y, idx))
+    assert values.shape[:2] == y.shape, "func must return a numpy array of shape (n_intervals, 15) or (n_intervals, 15, ndim_out)"
+    scalar_output = values.ndim == 2
+    if i == 0:
+      eps = np.finfo(values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64).eps
+      rtol = max(rtol, 10 * eps)
+    values = values.reshape(y.shape + (-1,)).astype(np.float64, copy=False)
+
+    kronrod = half_length[:, None] * np.einsum('ijk,j->ik', values, GK15_WEIGHTS_KRONROD)
+    gauss = half_length[:, None] * np.einsum('ijk,j->ik', values, GK15_WEIGHTS_GAUSS)
+    err = np.abs(kronrod - gauss)
+    # round-off floor of the error estimate
+    err_floor = 50 * eps * half_length[:, None] * np.einsum('ijk,j->ik', np.abs(values), GK15_WEIGHTS_KRONROD)
+
+    if integrals is None:
+      integrals, errors = np.zeros((n_integrals, kronrod.shape[1])), np.zeros((n_integrals, kronrod.shape[1]))
+
+    # current estimate of the integrals -> accepted subintervals plus the kronrod estimates of the active ones
+    estimates = integrals.copy()
+    np.add.at(estimates, idx, kronrod)
+    tol = np.maximum(atol, rtol * np.abs(estimates))[idx] * (np.abs(b - a) / total_length[idx])[:, None]
+
+    converged = np.all(err <= np.maximum(tol, err_floor), axis=1) | (i == max_iter - 1)
+
+    # integrals whose next bisection round would exceed the evaluation budget accept their remaining subintervals
+    n_evals += n_nodes * np.bincount(idx, minlength=n_integrals)
+    n_evals_next = n_evals + 2 * n_nodes * np.bincount(idx[~converged], minlength=n_integrals)
+    converged |= (n_evals_next > max_evals)[idx]
+    np.add.at(integrals, idx[converged], kronrod[converged])
+    np.add.at(errors, idx[converged], err[converged])
+
+    # bisect the subintervals that are not accurate enough yet
+    active = ~converged
+    if not np.any(active):
+      break
+    a, b = np.concatenate([a[active], center[active]]), np.concatenate([center[active], b[active]])
+    idx = np.concatenate([idx[active], idx[active]])
+
+  if scalar_output:
+    return integrals[:, 0], errors[:, 0]
+  return integrals, errors
+
+
+def mc_integration_student_t(func, ndim, n_samples=10 ** 6, batch_size=N_SAMPLES_BATCH, loc_proposal=0,
+                             scale_proposal=2, dof=6, std_err_tol=None, return_std_err=False, sampling='mc'):
+    """ Monte carlo integration using importance sampling with a student-t proposal distribution
+
+    The proposal samples are drawn and evaluated in chunks of batch_size samples so that the peak memory does not
+    depend on n_samples. A running mean and variance of the importance weighted function values (Welford / Chan et al.)
+    is kept across the chunks - the integration stops early once the standard error of all output dimensions is below
+    std_err_tol or the budget of n_samples is exhausted.
+
+    With sampling = 'sobol' or 'halton', the proposal samples are randomized quasi-monte carlo points that are mapped
+    through the inverse cdf of independent univariate student-t distributions. In that case the reported standard
+    error is the (conservative) i.i.d. estimate.
 
     Args:
       func: function to integrate over - must take numpy arrays of shape (n_samples, ndim) as first argument
             and return a numpy array of shape (n_samples, ndim_out)
       ndim: (int) number of dimensions to integrate over
-      n_samples: (int) number of samples
-      batch_size: (int) batch_size for junking the n_samples in batches (optional)
+      n_samples: (int) maximum number of samples
+      batch_size: (int) number of samples per chunk
+      std_err_tol: (optional) absolute standard error at which the integration stops early
+      return_std_err: (bool) whether to also return the standard error of the estimate
+      sampling: (str) proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
     Returns:
       approximated integral - numpy array of shape (ndim_out,)
+      (optional) standard error of the approximated integral - numpy array of shape (ndim_out,)
+    """
+    n, mean, m2 = 0, 0., 0.
+    for samples, f in student_t_proposal_chunks(ndim, n_samples=n_samples, batch_size=batch_size,
+                                                loc_proposal=loc_proposal, scale_proposal=scale_proposal, dof=dof,
+                                                sampling=sampling):
+        n_batch = samples.shape[0]
+        r = func(samples)
+        assert r.ndim == 2, 'func must return a 2-dimensional numpy array'
+        values = r / np.expand_dims(f, axis=1)
+
+        # merge the statistics of the chunk into the running mean and sum of squared deviations
+        mean, m2 = merge_chunk_statistics(n, mean, m2, values)
+        n += n_batch
+
+        std_err = np.sqrt(m2 / max(n - 1, 1) / n)
+        if std_err_tol is not None and n > 1 and np.all(std_err <= std_err_tol):
+            break
+
+    if return_std_err:
+        return mean, std_err
+    return mean
+
+
+def merge_chunk_statistics(n, mean, m2, values, axis=0):
+    """ Merges a chunk of values into the running mean and sum of squared deviations m2 of n previous values
+    (Welford / Chan et al.) - unlike the one-pass formula sum(v^2) / n - (sum(v) / n)^2, the variance m2 / (n - 1)
+    does not suffer from cancellation
+
+    Args:
+      n: (int) number of previous values
+      mean: running mean of the previous values - scalar or numpy array of the shape of the values without axis
+      m2: running sum of squared deviations of the previous values - same shape as mean
+      values: chunk of values - numpy array with the samples along axis
+      axis: (int) axis of the samples
 
+    Returns:
+      (mean, m2) - running statistics of the n + values.shape[axis] values
     """
-    if batch_size is None:
-        n_batches = 1
-        batch_size = n_samples
-    else:
-        n_batches = n_samples // batch_size + int(n_samples % batch_size > 0)
+    n_chunk = values.shape[axis]
+    chunk_mean = np.mean(values, axis=axis)
+    chunk_m2 = np.sum((values - np.expand_dims(chunk_mean, axis)) ** 2, axis=axis)
+    delta = chunk_mean - mean
+    mean = mean + delta * n_chunk / (n + n_chunk)
+    m2 = m2 + chunk_m2 + delta ** 2 * n * n_chunk / (n + n_chunk)
+    return mean, m2
+
+
+def student_t_proposal_chunks(ndim, n_samples=10 ** 6, batch_size=N_SAMPLES_BATCH, loc_proposal=0, scale_proposal=2,
+                              dof=6, sampling='mc'):
+    """ Generates the samples of the student-t proposal distribution in chunks of (at most) batch_size samples
+
+    Args:
+      ndim: (int) number of dimensions
+      n_samples: (int) total number of samples
+      batch_size: (int) number of samples per chunk
+      sampling: (str) proposal sampling scheme - 'mc' (pseudo-random), 'sobol' or 'halton' (randomized quasi-monte carlo)
 
-    batch_results = []
+    Yields:
+      (samples, proposal_pdf) - proposal samples - numpy array of shape (n_batch, ndim) and their proposal
+      density - numpy array of shape (n_batch,)
+    """
+    assert n_samples > 0 and batch_size > 0
+    assert sampling == 'mc' or sampling in QMC_METHODS, "sampling must be one of %s" % str(['mc'] + QMC_METHODS)
 
     if isinstance(loc_proposal, numbers.Number):
         loc_proposal = np.ones(ndim) * loc_proposal
     if isinstance(scale_proposal, numbers.Number):
         scale_proposal = np.ones(ndim) * scale_proposal
 
+    # one random shift of the low-discrepancy sequence that is shared by all chunks
+    qmc_shift = np.random.uniform(size=ndim) if sampling in QMC_METHODS else None
 
-    for j in range(n_batches):
-        samples = multidim_t_rvs(loc_proposal, scale_proposal, dof=dof, N=batch_size)
-        f = np.expand_dims(multidim_t_pdf(samples, loc_proposal, scale_proposal, dof), axis=1)
-        r = func(samples)
-        assert r.ndim == 2, 'func must return a 2-dimensional numpy array'
-        f = np.tile(f, (1, r.shape[1]))  # bring f into same shape like r
-        assert (f.shape == r.shape)
-        batch_results.append(np.mean(r / f, axis=0))
-
-    result = np.mean(np.stack(batch_results, axis=0), axis=0)
-    return result
+    for start in range(0, n_samples, batch_size):
+        n_batch = min(batch_size, n_samples - start)
+        if sampling in QMC_METHODS:
+            samples = multidim_t_qmc_rvs(loc_proposal, scale_proposal, dof, N=n_batch, method=sampling, start=start,
+                                         shift=qmc_shift)
+            yield samples, product_t_pdf(samples, loc_proposal, scale_proposal, dof)
+        else:
+            samples = multidim_t_rvs(loc_proposal, scale_proposal, dof=dof, N=n_batch)
+            yield samples, multidim_t_pdf(samples, loc_proposal, scale_proposal, dof)
 
 """ Other helpers """
 import os, sys
@@ -0,0 +1,308 @@
+import numpy as np
+from scipy.special import expit, logsumexp
+from scipy.stats import norm
+
+from cde import ConditionalDensity
+from cde.utils.gaussian_mixture import GaussianMixtureMixin, mixture_log_pdf
+
+# numpy counterparts of the nonlinearities of the network layers - keyed by the name of the tensorflow function
+ACTIVATIONS = {
+    'identity': lambda x: x,
+    'tanh': np.tanh,
+    'sigmoid': expit,
+    'relu': lambda x: np.maximum(x, 0.),
+    'elu': lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0.))),
+    'softplus': lambda x: np.logaddexp(0., x),
+}
+
+# offset of the std in the data normalization layers (see cde.utils.tf_utils.layers.NormalizationLayer)
+NORMALIZATION_EPS = 1e-8
+
+
+def softplus(x):
+    return np.logaddexp(0., x)
+
+
+class NumpyMLP:
+    """
+    Forward pass of the multi-layer perceptron of a fitted neural network estimator in numpy
+
+    Args:
+        weights: list with the weight matrices of the dense layers - numpy arrays of shape (n_in, n_out)
+        biases: list with the bias vectors of the dense layers - numpy arrays of shape (n_out,)
+        activations: list with the names of the nonlinearities of the dense layers (see ACTIVATIONS)
+        x_mean: (optional) mean of the x training data - the inputs are normalized if provided
+        x_std: (optional) std of the x training data
+    """
+
+    def __init__(self, weights, biases, activations, x_mean=None, x_std=None):
+        assert len(weights) == len(biases) == len(activations) > 0
+        assert all(activation in ACTIVATIONS for activation in activations), \
+            "unsupported nonlinearity - must be one of %s" % list(ACTIVATIONS.keys())
+        self.weights = [np.asarray(W, dtype=np.float64) for W in weights]
+        self.biases = [np.asarray(b, dtype=np.float64) for b in biases]
+        self.activations = list(activations)
+        self.x_mean = None if x_mean is None else np.asarray(x_mean, dtype=np.float64)
+        self.x_std = None if x_std is None else np.asarray(x_std, dtype=np.float64)
+
+    def __call__(self, X):
+        """
+        Args:
+            X: numpy array of shape (n_samples, n_in)
+
+        Returns: output of the network - numpy array of shape (n_samples, n_out)
+        """
+        H = np.asarray(X, dtype=np.float64)
+        if self.x_mean is not None:
+            H = (H - self.x_mean) / (self.x_std + NORMALIZATION_EPS)
+        for W, b, activation in zip(self.weights, self.biases, self.activations):
+            H = ACTIVATIONS[activation](H.dot(W) + b)
+        return H
+
+
+class _NumpyPredictor(ConditionalDensity):
+    # common base of the numpy predictors - the network maps x to the parameters of p(y|x) in the normalized y space
+
+    def __init__(self, name, ndim_x, ndim_y, mlp, data_statistics=None):
+        self.name = name
+        self.ndim_x = ndim_x
+        self.ndim_y = ndim_y
+        self.mlp = mlp
+        self.data_statistics = data_statistics
+
+        # same attributes as the estimators -> same integration bounds and proposal distributions
+        if data_statistics is not None:
+            self.x_mean, self.x_std = data_statistics['X_mean'], data_statistics['X_std']
+            self.y_mean, self.y_std = data_statistics['Y_mean'], data_statistics['Y_std']
+
+        self.fitted = True
+
+    def pdf(self, X, Y):
+        """ Predicts the conditional likelihood p(y|x)
+
+           Args:
+             X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+             Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+           Returns:
+              conditional likelihood p(y|x) - numpy array of shape (n_query_samples, )
+         """
+        return np.exp(self.log_pdf(X, Y))
+
+    def log_pdf(self, X, Y):
+        """ Predicts the conditional log-probability log p(y|x)
+
+           Args:
+             X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+             Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+           Returns:
+              conditional log-probability log p(y|x) - numpy array of shape (n_query_samples, )
+         """
+        raise NotImplementedError
+
+    def score(self, X, Y):
+        """ Computes the mean conditional log-likelihood of the provided data (X, Y) """
+        return np.mean(self.log_pdf(X, Y))
+
+    def value_at_risk(self, x_cond, alpha=0.01, n_samples=None):
+        """ Value-at-Risk (VaR) of p(y|x) - numpy array of shape (n_values,). Only if ndim_y = 1 """
+        return self.quantiles(x_cond, alphas=(alpha,))[:, 0]
+
+    def quantiles(self, x_cond, alphas=(0.01, 0.05, 0.1), n_samples=None):
+        """ Conditional quantiles of p(y|x) - numpy array of shape (n_values, n_alphas). Only if ndim_y = 1 """
+        assert self.ndim_y == 1 and self.has_cdf, "Quantiles can only be computed when ndim_y = 1"
+        x_cond = self._handle_input_dimensionality(x_cond)
+        return self._quantiles_cdf(x_cond, np.asarray(alphas, dtype=np.float64).reshape((-1,)))
+
+    def _normalize_y(self, Y):
+        if self.data_statistics is None:
+            return Y
+        return (Y - self.y_mean) / (self.y_std + NORMALIZATION_EPS)
+
+    def _log_std_y(self):
+        # log-determinant of the change of variables from the normalized to the original y
+        return 0.0 if self.data_statistics is None else np.sum(np.log(self.y_std))
+
+
+class NumpyMixturePredictor(GaussianMixtureMixin, _NumpyPredictor):
+    """
+    Pure numpy predictor of a fitted mixture density network or kernel mixture network, obtained with
+    export_numpy() of the estimator. Neither requires tensorflow nor edward.
+
+    Args:
+        name: (str) name of the exported estimator
+        ndim_x: (int) dimensionality of x variable
+        ndim_y: (int) dimensionality of y variable
+        mlp: NumpyMLP that maps x to the mixture parameters
+        n_components: (int) number of mixture components
+        kernel_locs: (optional) locations of the components that are shared by all x - numpy array of shape
+                     (n_components, ndim_y). If provided (KMN), the network only outputs the logits of the component
+                     weights, otherwise (MDN) it outputs the locations, scales and logits of all components
+        kernel_scales: (optional) scales of the shared components - numpy array of shape (n_components, ndim_y)
+        data_statistics: (optional) dict with the mean and std of the training data (X_mean, X_std, Y_mean, Y_std)
+                         if the estimator normalizes the data
+    """
+
+    def __init__(self, name, ndim_x, ndim_y, mlp, n_components, kernel_locs=None, kernel_scales=None,
+                 data_statistics=None):
+        super(NumpyMixturePredictor, self).__init__(name, ndim_x, ndim_y, mlp, data_statistics=data_statistics)
+        assert (kernel_locs is None) == (kernel_scales is None)
+        self.n_components = n_components
+        self.kernel_locs = kernel_locs
+        self.kernel_scales = kernel_scales
+
+        self.can_sample = True
+        self.has_pdf = True
+        self.has_cdf = True
+
+    def log_pdf(self, X, Y):
+        X, Y = self._handle_input_dimensionality(X, Y)
+        log_weights, locs, scales = self._log_mixture_components(X)
+        return mixture_log_pdf(log_weights, locs, scales, self._normalize_y(Y)) - self._log_std_y()
+
+    def _get_mixture_components(self, X):
+        log_weights, locs, scales = self._log_mixture_components(X)
+        shape = (X.shape[0], self.n_components, self.ndim_y)
+        locs, scales = np.broadcast_to(locs, shape), np.broadcast_to(scales, shape)
+        if self.data_statistics is not None:
+            locs, scales = locs * self.y_std + self.y_mean, scales * self.y_std
+        return np.exp(log_weights), locs, scales
+
+    def _log_mixture_components(self, X):
+        # log-weights (n_samples, n_components) and the locs and scales of the components in the normalized y space
+        output = self.mlp(X)
+        n_components, ndim_y = self.n_components, self.ndim_y
+
+        if self.kernel_locs is None:
+            locs = output[:, :n_components * ndim_y].reshape((-1, n_components, ndim_y))
+            scales = softplus(output[:, n_components * ndim_y:2 * n_components * ndim_y].reshape((-1, n_components, ndim_y)))
+            logits = output[:, 2 * n_components * ndim_y:]
+        else:
+            locs, scales = self.kernel_locs[None, :, :], self.kernel_scales[None, :, :]
+            logits = output
+
+        assert logits.shape[1] == n_components
+        return logits - logsumexp(logits, axis=1, keepdims=True), locs, scales
+
+
+""" Inverse flows - map y to the base space and return the log-determinant of the jacobian """
+
+
+def _affine_inverse(y, params):
+    n_dims = y.shape[1]
+    a, b = params[:, :n_dims], params[:, n_dims:]
+    return (y - b) * np.exp(-a), - np.sum(a, axis=1)
+
+
+def _planar_inverse(y, params):
+    n_dims = y.shape[1]
+    u, w, b = params[:, :n_dims], params[:, n_dims:2 * n_dims], params[:, 2 * n_dims:]
+
+    # constrained u, such that the flow is invertible
+    wtu = np.sum(w * u, axis=1, keepdims=True)
+    u = u + (-1. + softplus(wtu) + 1e-3 - wtu) * w / np.sum(w ** 2, axis=1, keepdims=True)
+
+    wzb = np.sum(w * y, axis=1, keepdims=True) + b
+    psi = (1. - np.tanh(wzb) ** 2) * w
+    return y + u * np.tanh(wzb), np.log(np.abs(1. + np.sum(u * psi, axis=1)))
+
+
+def _radial_inverse(y, params):
+    n_dims = y.shape[1]
+    alpha, beta, gamma = softplus(params[:, :1]), np.exp(params[:, 1:2]) - 1., params[:, 2:]
+
+    r = np.sum(np.abs(y - gamma), axis=1, keepdims=True)
+    h = 1. / (alpha + r)
+    ab = alpha * beta
+    det = (1. + ab * h) ** (n_dims - 1) * (1. + ab * h - ab * h ** 2 * r)
+    return y + ab * h * (y - gamma), np.log(det[:, 0])
+
+
+def _identity_inverse(y, params):
+    return y, np.zeros(y.shape[0])
+
+
+# name of the flow -> (size of the parameter space as a function of n_dims, inverse flow)
+FLOWS = {
+    'affine': (lambda n_dims: 2 * n_dims, _affine_inverse),
+    'planar': (lambda n_dims: 2 * n_dims + 1, _planar_inverse),
+    'radial': (lambda n_dims: n_dims + 2, _radial_inverse),
+    'identity': (lambda n_dims: 0, _identity_inverse),
+}
+
+
+class NumpyNormalizingFlowPredictor(_NumpyPredictor):
+    """
+    Pure numpy predictor of a fitted normalizing flow estimator, obtained with export_numpy() of the estimator.
+    Neither requires tensorflow nor edward. As the estimator, it supports no sampling and a cdf only for ndim_y = 1.
+
+    Args:
+        name: (str) name of the exported estimator
+        ndim_x: (int) dimensionality of x variable
+        ndim_y: (int) dimensionality of y variable
+        mlp: NumpyMLP that maps x to the parameters of the flows
+        flows_type: (tuple of strings) the chain of flows (see FLOWS) in the order of the estimator, i.e. from the
+                    base distribution to the transformed distribution
+        data_statistics: (optional) dict with the mean and std of the training data (X_mean, X_std, Y_mean, Y_std)
+                         if the estimator normalizes the data
+    """
+
+    def __init__(self, name, ndim_x, ndim_y, mlp, flows_type, data_statistics=None):
+        super(NumpyNormalizingFlowPredictor, self).__init__(name, ndim_x, ndim_y, mlp, data_statistics=data_statistics)
+        assert all([f in FLOWS.keys() for f in flows_type])
+        self.flows_type = flows_type
+
+        self.can_sample = False
+        self.has_pdf = True
+        self.has_cdf = True if self.ndim_y == 1 else False
+
+    def log_pdf(self, X, Y):
+        X, Y = self._handle_input_dimensionality(X, Y)
+        z, log_det = self._inverse(X, Y)
+        return np.sum(norm.logpdf(z), axis=1) + log_det - self._log_std_y()
+
+    def cdf(self, X, Y):
+        """ Predicts the conditional cumulative probability p(Y<=y|X=x) - only for ndim_y = 1
+
+           Args:
+             X: numpy array to be conditioned on - shape: (n_samples, n_dim_x)
+             Y: numpy array of y targets - shape: (n_samples, n_dim_y)
+
+           Returns:
+             conditional cumulative probability p(Y<=y|X=x) - numpy array of shape (n_query_samples, )
+        """
+        assert self.has_cdf, "cdf is only available for ndim_y = 1"
+        X, Y = self._handle_input_dimensionality(X, Y)
+        z, _ = self._inverse(X, Y)
+        return norm.cdf(z[:, 0])
+
+    def mean_(self, x_cond, n_samples=10 ** 6, sampling='mc'):
+        """ Mean E[y|x] - numpy array of shape (n_values, ndim_y) - obtained by numerical integration of the pdf """
+        return self._mean_pdf(self._handle_input_dimensionality(x_cond), n_samples=n_samples, sampling=sampling)
+
+    def covariance(self, x_cond, n_samples=10 ** 6, sampling='mc'):
+        """ Covariance Cov[y|x] - numpy array of shape (n_values, ndim_y, ndim_y) - obtained by numerical integration
+        of the pdf """
+        return self._covariance_pdf(self._handle_input_dimensionality(x_cond), n_samples=n_samples, sampling=sampling)
+
+    def std_(self, x_cond, n_samples=10 ** 6):
+        """ Standard deviation sqrt(Var[y|x]) - numpy array of shape (n_values, ndim_y) """
+        return self._std_pdf(self._handle_input_dimensionality(x_cond), n_samples=n_samples)
+
+    def moments(self, x_cond, orders=(1, 2, 3, 4), n_samples=10 ** 6):
+        """ Moments of p(y|x) - see BaseDensityEstimator.moments - obtained by numerical integration of the pdf """
+        return self._moments_pdf(self._handle_input_dimensionality(x_cond), orders=orders, n_samples=n_samples)
+
+    def _inverse(self, X, Y):
+        # y is passed through the inverse flows in reverse order, i.e. starting with the last flow of the chain
+        flow_params = self.mlp(X)
+        split_sizes = [FLOWS[flow][0](self.ndim_y) for flow in self.flows_type]
+        assert flow_params.shape[1] == sum(split_sizes)
+        flow_params = np.split(flow_params, np.cumsum(split_sizes)[:-1], axis=1)
+
+        z, log_det = self._normalize_y(np.asarray(Y, dtype=np.float64)), np.zeros(Y.shape[0])
+        for flow, params in reversed(list(zip(self.flows_type, flow_params))):
+            z, flow_log_det = FLOWS[flow][1](z, params)
+            log_det += flow_log_det
+        return z, log_det
@@ -150,4 +150,92 @@ def find_root_by_bounding(fun, left, right, eps=1e-8, max_iter=1e4):
             warnings.warn("Max_iter has been reached - stopping newton method for determining quantiles")
             return np.NaN
 
-    return middle
\ No newline at end of file
+    return middle
+
+def find_root_bracketed(fun, left, right, x0=None, grad=None, eps=1e-8, max_iter=100, max_expansions=60):
+    """
+    Vectorized safeguarded root finding for many univariate problems f_i(x) = 0 with increasing f_i. The brackets
+    [left_i, right_i] are expanded until they contain a sign change. Then each iteration takes a newton step (if grad
+    is provided) and otherwise, or if the newton step leaves the bracket, a regula falsi step with the Illinois
+    modification. Bisection is used if neither candidate lies within the bracket.
+    --> in each iteration, fun (and grad) is called once with the problems that have not converged yet
+
+    Args:
+        fun (callable): vectorized function fun(x, idx) that evaluates f_i(x_i) for the problems idx - must take
+                        numpy arrays x and idx of shape (n,) and return a numpy array of shape (n,)
+        left (np.ndarray): initial left bounds - shape (n_problems,)
+        right (np.ndarray): initial right bounds - shape (n_problems,)
+        x0 (np.ndarray): (optional) initial guesses within the brackets - shape (n_problems,)
+        grad (callable): (optional) derivative grad(x, idx) of fun with the same signature
+        eps (float): tolerance of the roots
+        max_iter (int): maximum iterations
+        max_expansions (int): maximum number of doublings of the brackets
+
+    Returns:
+        numpy array of shape (n_problems,) with the roots - problems that did not converge are np.NaN
+    """
+    assert callable(fun)
+    left, right = np.array(left, dtype=np.float64).flatten(), np.array(right, dtype=np.float64).flatten()
+    assert left.shape == right.shape and np.all(left < right)
+    n = left.shape[0]
+
+    # expand the brackets until f(left) <= 0 <= f(right)
+    all_idx = np.arange(n)
+    f_both = np.asarray(fun(np.concatenate([left, right]), np.concatenate([all_idx, all_idx]))).flatten()
+    f_left, f_right = f_both[:n], f_both[n:]
+    for _ in range(max_expansions):
+        invalid_left, invalid_right = f_left > 0, f_right < 0
+        if not np.any(invalid_left | invalid_right):
+            break
+        width = right - left
+        idx = np.concatenate([all_idx[invalid_left], all_idx[invalid_right]])
+        x = np.concatenate([left[invalid_left] - width[invalid_left], right[invalid_right] + width[invalid_right]])
+        f = np.asarray(fun(x, idx)).flatten()
+        n_left = np.sum(invalid_left)
+        left[invalid_left], f_left[invalid_left] = x[:n_left], f[:n_left]
+        right[invalid_right], f_right[invalid_right] = x[n_left:], f[n_left:]
+    bracketed = (f_left <= 0) & (f_right >= 0)
+
+    x = (left + right) / 2 if x0 is None else np.clip(np.array(x0, dtype=np.float64).flatten(), left, right)
+    roots = np.full(n, np.NaN)
+    active = bracketed.copy()
+    last_side = np.zeros(n, dtype=bool) # whether the left bound was updated in the previous iteration
+
+    for _ in range(max_iter):
+        idx = all_idx[active]
+        if idx.shape[0] == 0:
+            break
+        xa = x[idx]
+        f = np.asarray(fun(xa, idx)).flatten()
+
+        # shrink the brackets - Illinois: halve the function value of a bound that is retained twice in a row
+        below = f < 0
+        retained_twice = below == last_side[idx]
+        f_right[idx[below & retained_twice]] /= 2
+        f_left[idx[~below & retained_twice]] /= 2
+        left[idx[below]], f_left[idx[below]] = xa[below], f[below]
+        right[idx[~below]], f_right[idx[~below]] = xa[~below], f[~below]
+        last_side[idx] = below
+        l, r, fl, fr = left[idx], right[idx], f_left[idx], f_right[idx]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            candidate = r - fr * (r - l) / (fr - fl)
+            if grad is not None:
+                newton = xa - f / np.asarray(grad(xa, idx)).flatten()
+                candidate = np.where(np.isfinite(newton) & (newton > l) & (newton < r), newton, candidate)
+
+        middle = (l + r) / 2
+        in_bracket = np.isfinite(candidate) & (candidate > l) & (candidate < r)
+        x[idx] = np.where(in_bracket, candidate, middle)
+
+        converged_step = in_bracket & (np.abs(candidate - xa) <= eps)
+        converged = converged_step | (r - l <= 2 * eps) | (f == 0)
+        roots[idx] = np.where(f == 0, xa, np.where(converged_step, candidate, middle))
+        active[idx[converged]] = False
+
+    if np.any(active):
+        warnings.warn("Max_iter has been reached - stopping root finding for %i problems" % np.sum(active))
+        roots[active] = np.NaN
+    if not np.all(bracketed):
+        warnings.warn("No sign change within the expanded brackets for %i problems" % np.sum(~bracketed))
+    return roots
@@ -0,0 +1,235 @@
+import queue
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+# default max. number of rows that are evaluated in one vectorized call
+MAX_BATCH_SIZE = 1024
+# default max. time in seconds that the first request of a micro-batch waits for further requests
+MAX_WAIT_TIME = 0.002
+# number of most recent request latencies that are kept for the percentiles
+LATENCY_WINDOW = 10 ** 4
+
+# methods of the estimator that can be served - all of them are vectorized over the rows of x
+METHODS = ('pdf', 'log_pdf', 'cdf', 'value_at_risk')
+
+
+class _Request:
+
+    def __init__(self, method, X, Y, alpha):
+        self.method, self.X, self.Y, self.alpha = method, X, Y, alpha
+        self.future = Future()
+        self.submit_time = time.perf_counter()
+
+    @property
+    def key(self):
+        # requests with the same key are evaluated jointly
+        return self.method, self.alpha
+
+    @property
+    def n_rows(self):
+        return self.X.shape[0]
+
+
+class MicroBatchServer:
+    """
+    In-process serving layer for a fitted estimator that coalesces concurrent requests into micro-batches. A
+    background thread collects the requests until max_batch_size rows are queued or the first request of the batch
+    has waited max_wait_time seconds and then evaluates all requests of the same method (and alpha) with a single
+    vectorized call. Thereby, the per-call overhead (e.g. the session run of the tensorflow estimators) is paid once
+    per batch instead of once per request.
+
+    The server can be used as context manager - it is started on enter and stopped on exit.
+
+    Args:
+        estimator: fitted estimator (or numpy predictor obtained with export_numpy) whose pdf, log_pdf, cdf and
+                   value_at_risk are served
+        max_batch_size: (int) max. number of rows per micro-batch - larger requests are evaluated as a batch of their own
+        max_wait_time: (float) max. time in seconds that a request waits for further requests before its batch is run
+        latency_window: (int) number of most recent request latencies that are kept for latency_percentiles
+    """
+
+    def __init__(self, estimator, max_batch_size=MAX_BATCH_SIZE, max_wait_time=MAX_WAIT_TIME,
+                 latency_window=LATENCY_WINDOW):
+        assert max_batch_size > 0 and max_wait_time >= 0
+        assert getattr(estimator, 'fitted', True), "estimator must be fitted"
+        self.estimator = estimator
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+
+        self._queue = queue.Queue()
+        self._pending = None  # request that did not fit into the previous batch
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        self._lock = threading.Lock()  # guards the statistics, which are updated by the background thread
+        self._latencies = deque(maxlen=latency_window)
+        self._batch_sizes = deque(maxlen=latency_window)
+        self.n_requests, self.n_batches, self.n_calls = 0, 0, 0
+
+    def start(self):
+        """ Starts the background thread that runs the micro-batches """
+        assert self._thread is None, "server is already running"
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name='MicroBatchServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the background thread after all queued requests have been answered """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+            # requests that were submitted while the server was stopping
+            while not self._queue.empty():
+                self._queue.get_nowait().future.set_exception(RuntimeError("server has been stopped"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def submit(self, method, X, Y=None, alpha=None):
+        """ Queues a request without blocking
+
+        Args:
+          method: (str) estimator method to be evaluated - choices: pdf, log_pdf, cdf, value_at_risk
+          X: x values of the request - numpy array of shape (n_rows, ndim_x), a single row of shape (ndim_x,) or a scalar
+          Y: y values of the request (pdf, log_pdf and cdf) - numpy array of shape (n_rows, ndim_y) or a single row
+          alpha: (float) quantile level of the value_at_risk
+
+        Returns:
+          concurrent.futures.Future whose result is a numpy array of shape (n_rows,)
+        """
+        assert method in METHODS, "method must be one of %s" % str(METHODS)
+        assert self._thread is not None and not self._stop_event.is_set(), "server must be running"
+
+        X = np.asarray(X, dtype=np.float64).reshape((-1, self.estimator.ndim_x))
+        if method == 'value_at_risk':
+            assert Y is None and alpha is not None, "value_at_risk requires alpha instead of Y"
+            alpha = float(alpha)
+        else:
+            assert Y is not None and alpha is None, "%s requires Y" % method
+            Y = np.asarray(Y, dtype=np.float64).reshape((-1, self.estimator.ndim_y))
+            assert X.shape[0] == Y.shape[0], "X and Y must have the same number of rows"
+
+        request = _Request(method, X, Y, alpha)
+        self._queue.put(request)
+        return request.future
+
+    def pdf(self, X, Y, timeout=None):
+        """ Conditional likelihood p(y|x) of the request rows - blocks until the micro-batch has been evaluated """
+        return self.submit('pdf', X, Y).result(timeout=timeout)
+
+    def log_pdf(self, X, Y, timeout=None):
+        """ Conditional log-likelihood log p(y|x) of the request rows - blocks until the micro-batch has been evaluated """
+        return self.submit('log_pdf', X, Y).result(timeout=timeout)
+
+    def cdf(self, X, Y, timeout=None):
+        """ Conditional cumulative probability p(Y<=y|X=x) of the request rows - blocks until the micro-batch has been
+        evaluated """
+        return self.submit('cdf', X, Y).result(timeout=timeout)
+
+    def value_at_risk(self, X, alpha=0.01, timeout=None):
+        """ Value-at-Risk of the request rows - blocks until the micro-batch has been evaluated """
+        return self.submit('value_at_risk', X, alpha=alpha).result(timeout=timeout)
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """ Percentiles of the latencies (from submit to result) of the most recent requests
+
+        Args:
+          percentiles: tuple of percentiles within [0, 100]
+
+        Returns:
+          OrderedDict mapping the percentiles to the latencies in seconds - nan if no request has been answered yet
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+        return OrderedDict((p, float(np.percentile(latencies, p)) if latencies.size else float('nan'))
+                           for p in percentiles)
+
+    def stats(self):
+        """ Returns: dict with the number of answered requests, micro-batches and vectorized calls, the mean number of
+        rows per micro-batch and the latency percentiles """
+        with self._lock:
+            stats = {'n_requests': self.n_requests, 'n_batches': self.n_batches, 'n_calls': self.n_calls,
+                     'mean_batch_size': float(np.mean(self._batch_sizes)) if self._batch_sizes else float('nan')}
+        stats['latency_percentiles'] = self.latency_percentiles()
+        return stats
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._run_batch(batch)
+            elif self._stop_event.is_set() and self._queue.empty():
+                return
+
+    def _next_batch(self):
+        # the first request opens the batch, further requests are collected until the batch is full or the wait
+        # time of the first request has elapsed
+        first = self._pending if self._pending is not None else self._get(timeout=0.05)
+        self._pending = None
+        if first is None:
+            return []
+
+        batch, n_rows = [first], first.n_rows
+        deadline = first.submit_time + self.max_wait_time
+        while n_rows < self.max_batch_size:
+            request = self._get(timeout=deadline - time.perf_counter())
+            if request is None:
+                break
+            if n_rows + request.n_rows > self.max_batch_size:
+                self._pending = request
+                break
+            batch.append(request)
+            n_rows += request.n_rows
+        return batch
+
+    def _get(self, timeout):
+        try:
+            if timeout <= 0:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _run_batch(self, batch):
+        groups = OrderedDict()
+        for request in batch:
+            if request.future.set_running_or_notify_cancel():  # skips requests that were cancelled by the client
+                groups.setdefault(request.key, []).append(request)
+
+        for (method, alpha), requests in groups.items():
+            X = np.concatenate([request.X for request in requests], axis=0)
+            try:
+                if method == 'value_at_risk':
+                    result = self.estimator.value_at_risk(X, alpha=alpha)
+                else:
+                    result = getattr(self.estimator, method)(X, np.concatenate([request.Y for request in requests],
+                                                                               axis=0))
+                result = np.asarray(result).reshape((X.shape[0],))
+            except Exception as e:  # the error is raised in the clients, the server keeps running
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                with self._lock:
+                    self.n_calls += 1
+
+            # split the vectorized result into the rows of the requests
+            offsets = np.cumsum([request.n_rows for request in requests])[:-1]
+            for request, request_result in zip(requests, np.split(result, offsets)):
+                request.future.set_result(request_result)
+
+        end_time = time.perf_counter()
+        with self._lock:
+            self._latencies.extend(end_time - request.submit_time for request in batch)
+            self._batch_sizes.append(sum(request.n_rows for request in batch))
+            self.n_requests += len(batch)
+            self.n_batches += 1
@@ -1,5 +1,6 @@
 import random
 import unittest
+import numpy as np
 import config
 import shutil
 import tensorflow as tf
@@ -8,7 +9,7 @@ import os
 from ml_logger import logger
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from cde.model_fitting.ConfigRunner import ConfigRunner
+from cde.model_fitting.ConfigRunner import ConfigRunner, _warm_start_chains, _hash_task_dict, WARM_START_DIR
 from cde.evaluation.simulation_eval.question1_noise_reg_xy import question1
 
 NUM_CONFIGS_TO_TEST = 1
@@ -62,6 +63,60 @@ class configrunner(unittest.TestCase):
           self.assertTrue(model.plot3d(show=False))
 
 
+  def test_warm_start_chains(self):
+    tasks = []
+    for n_obs in [500, 100, 200]:
+      for estimator_name, config in [('MixtureDensityNetwork', {'n_centers': 10}), ('MixtureDensityNetwork', {'n_centers': 20}),
+                                     ('ConditionalKernelDensityEstimation', {'bandwidth': 'cv_ml'})]:
+        tasks.append({'simulator_name': 'EconDensity', 'simulator_config': {'random_seed': 22}, 'n_obs': n_obs,
+                      'estimator_name': estimator_name, 'estimator_config': config, 'task_name': 'task_%i' % len(tasks)})
+
+    chains = _warm_start_chains(tasks, epoch_fraction=0.3)
+    self.assertEqual(sorted(len(chain) for chain in chains), [1, 1, 1, 3, 3])
+
+    for chain in chains:
+      chain_tasks = [task for _, task in chain]
+      self.assertEqual([task['n_obs'] for task in chain_tasks], sorted(task['n_obs'] for task in chain_tasks))
+      self.assertNotIn('warm_start', chain_tasks[0])
+      for (_, prev_task), (i, task) in zip(chain[:-1], chain[1:]):
+        self.assertEqual(task['warm_start'], {'n_obs': prev_task['n_obs'], 'epoch_fraction': 0.3})
+        self.assertEqual(task['estimator_config'], prev_task['estimator_config'])
+        # warm-started tasks must not collide with the cold-started tasks in the results
+        self.assertNotEqual(_hash_task_dict(task), _hash_task_dict(tasks[i]))
+
+    # the chains are deterministic and the original tasks remain unchanged
+    self.assertEqual(chains, _warm_start_chains(tasks, epoch_fraction=0.3))
+    self.assertTrue(all('warm_start' not in task for task in tasks))
+
+  def test_warm_start_resume(self):
+    exp_prefix = 'test_warm_start_resume'
+    logger.configure(log_directory=config.DATA_DIR, prefix=exp_prefix)
+    test_dir = os.path.join(logger.log_directory, logger.prefix)
+    if os.path.exists(test_dir):
+      shutil.rmtree(test_dir)
+
+    est_params = {'MixtureDensityNetwork': {'n_centers': [5], 'n_training_epochs': [10], 'hidden_sizes': [(8, 8)],
+                                            'random_seed': [22]}}
+    sim_params = {'EconDensity': {'std': [1], 'heteroscedastic': [True]}}
+    observations = np.array([100, 200])
+    keys_of_interest = ['task_name', 'estimator', 'simulator', 'n_observations', 'hellinger_distance']
+
+    # a cold run completes the chain head without storing its parameters
+    ConfigRunner(exp_prefix, est_params, sim_params, observations=observations, keys_of_interest=keys_of_interest,
+                 n_mc_samples=10 ** 2, n_seeds=1).run_configurations(multiprocessing=False)
+    self.assertFalse(os.path.exists(os.path.join(test_dir, WARM_START_DIR)))
+
+    # the resumed run with warm start refits the completed head and continues the chain
+    conf_runner = ConfigRunner(exp_prefix, est_params, sim_params, observations=observations,
+                               keys_of_interest=keys_of_interest, n_mc_samples=10 ** 2, n_seeds=1, warm_start=True)
+    conf_runner.run_configurations(multiprocessing=False)
+
+    results = dict(logger.load_pkl_log(RESULTS_FILE))
+    self.assertEqual(len(results), 3)
+    warm_started = [result for result in results.values() if getattr(result, 'warm_started', False)]
+    self.assertEqual(len(warm_started), 1)
+    self.assertEqual(warm_started[0].warm_start_n_obs, 100)
+
 
 if __name__ == '__main__':
 
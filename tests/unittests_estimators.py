@@ -2,6 +2,7 @@ import unittest
 from scipy.stats import norm
 import warnings
 import pickle
+import time
 import tensorflow as tf
 import sys
 import os
@@ -10,7 +11,12 @@ import scipy.stats as stats
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from cde.density_estimator import MixtureDensityNetwork, KernelMixtureNetwork, \
-  ConditionalKernelDensityEstimation, LSConditionalDensityEstimation, NeighborKernelDensityEstimation, NormalizingFlowEstimator
+  ConditionalKernelDensityEstimation, LSConditionalDensityEstimation, NeighborKernelDensityEstimation, NormalizingFlowEstimator, \
+  EnsembleEstimator
+from cde.density_estimator.BaseNNEstimator import BaseNNEstimator
+import cde.density_estimator.CKDE as CKDE
+from cde.utils.callbacks import PhaseTimes, Throughput, LossCurve
+from cde.utils.data_pipeline import TrainingData
 
 class TestConditionalDensityEstimators_2d_gaussian(unittest.TestCase):
 
@@ -105,6 +111,49 @@ class TestConditionalDensityEstimators_2d_gaussian(unittest.TestCase):
     self.assertGreaterEqual(score2, score1)
     self.assertGreaterEqual(score3, score2 - 0.1)
 
+  def test_sample_weight_kernel_estimators(self):
+    rng = np.random.RandomState(22)
+    X = rng.normal(size=(100, 1))
+    Y = X + rng.normal(scale=0.5, size=(100, 1))
+    X_test, Y_test = rng.normal(size=(20, 1)), rng.normal(size=(20, 1))
+
+    # integer sample weights are equivalent to duplicated samples
+    weights = rng.randint(0, 3, size=100)
+    model1 = NeighborKernelDensityEstimation(epsilon=3.0, bandwidth=0.5, param_selection=None)
+    model1.fit(X, Y, sample_weight=weights)
+    model2 = NeighborKernelDensityEstimation(epsilon=3.0, bandwidth=0.5, param_selection=None)
+    model2.fit(np.repeat(X, weights, axis=0), np.repeat(Y, weights, axis=0))
+    self.assertTrue(np.allclose(model1.pdf(X_test, Y_test), model2.pdf(X_test, Y_test)))
+
+    # uniform sample weights are equivalent to the unweighted estimator
+    model1 = ConditionalKernelDensityEstimation(bandwidth='normal_reference')
+    model1.fit(X, Y)
+    model2 = ConditionalKernelDensityEstimation(bandwidth='normal_reference')
+    model2.fit(X, Y, sample_weight=np.full(100, 2.0))
+    self.assertTrue(np.allclose(model1.pdf(X_test, Y_test), model2.pdf(X_test, Y_test)))
+    self.assertTrue(np.allclose(model1.cdf(X_test, Y_test), model2.cdf(X_test, Y_test)))
+
+    # the weighted kernel sums are evaluated in chunks of the query points
+    kernel_batch_size = CKDE.KERNEL_BATCH_SIZE
+    try:
+      CKDE.KERNEL_BATCH_SIZE = 250
+      self.assertTrue(np.allclose(model2.pdf(X_test, Y_test), model2._weighted_pdf_batch(X_test, Y_test)))
+      self.assertTrue(np.allclose(model2.cdf(X_test, Y_test), model2._weighted_cdf_batch(X_test, Y_test)))
+    finally:
+      CKDE.KERNEL_BATCH_SIZE = kernel_batch_size
+
+  def test_NKDE_zero_weight_neighborhood(self):
+    rng = np.random.RandomState(22)
+    X = rng.normal(size=(300, 1))
+    Y = X + rng.normal(size=(300, 1))
+    weights = (X[:, 0] > 0).astype(np.float64)
+
+    # all neighbors of x=-0.5 have zero sample weight -> the unweighted neighbors are used
+    model = NeighborKernelDensityEstimation(epsilon=0.1, param_selection=None)
+    model.fit(X, Y, sample_weight=weights)
+    p = model.pdf(np.array([[-0.5], [0.5]]), np.array([[-0.5], [0.5]]))
+    self.assertTrue(np.all(np.isfinite(p)) and np.all(p > 0))
+
   def test_LSCD_with_4d_gaussian(self):
     mu = 5
     std = 2.0
@@ -225,6 +274,198 @@ class TestConditionalDensityEstimators_2d_gaussian(unittest.TestCase):
     self.assertAlmostEqual(np.mean(y_sample), float(model.mean_(y_sample[1])), places=0)
     self.assertAlmostEqual(np.std(y_sample), float(model.covariance(y_sample[1])), places=0)
 
+  def test_mixture_sample_n(self):
+    X, Y = self.get_samples()
+
+    model = MixtureDensityNetwork("mdn_sample_n", 1, 1, n_centers=5, n_training_epochs=200)
+    model.fit(X, Y)
+
+    x_cond = np.array([[1.0], [3.0]])
+    y_sample = model.sample_n(x_cond, n_per_x=10**6, random_state=np.random.default_rng(22))
+    self.assertEqual(y_sample.shape, (2, 10**6, 1))
+
+    means, stds = model.mean_std(x_cond)
+    for i in range(2):
+      self.assertAlmostEqual(np.mean(y_sample[i]), means[i, 0], places=2)
+      self.assertAlmostEqual(np.std(y_sample[i]), stds[i, 0], places=2)
+
+    # same seed -> same samples
+    _, y_sample1 = model.sample(x_cond, random_state=22)
+    _, y_sample2 = model.sample(x_cond, random_state=22)
+    self.assertTrue(np.all(y_sample1 == y_sample2))
+
+  def test_output_cache(self):
+    X, Y = self.get_samples()
+    x_cond, y = np.array([[1.0], [3.0]]), np.array([[1.0], [2.0]])
+
+    model = MixtureDensityNetwork("mdn_output_cache", 1, 1, n_centers=5, n_training_epochs=50)
+    model.fit(X, Y)
+    mean, p = model.mean_(x_cond), model.cdf(x_cond, y)
+
+    model.set_output_cache_size(2)
+    self.assertTrue(np.allclose(model.mean_(x_cond), mean))
+    self.assertTrue(np.allclose(model.cdf(x_cond, y), p))
+    model.tail_risk_measures(x_cond, alpha=[0.01, 0.05])
+    self.assertEqual(model.output_cache_info()['misses'], 1)
+    self.assertEqual(model.output_cache_info()['hits'], 2)
+
+    # parameter updates invalidate the cache
+    model.set_param_values(model.get_param_values())
+    model.mean_(x_cond)
+    self.assertEqual(model.output_cache_info()['misses'], 2)
+
+    nf = NormalizingFlowEstimator("nf_output_cache", 1, 1, n_training_epochs=50)
+    nf.fit(X, Y)
+    p = nf.pdf(x_cond, y)
+    nf.set_output_cache_size(2)
+    self.assertTrue(np.allclose(nf.pdf(x_cond, y), p))
+    self.assertTrue(np.allclose(nf.pdf(x_cond, y), p))
+    self.assertEqual(nf.output_cache_info()['hits'], 1)
+
+  def test_minibatch_training(self):
+    mu, std = -5, 2.5
+    X, Y = self.get_samples(mu=mu, std=std)
+
+    def data_fn():
+      for start in range(0, X.shape[0], 500):
+        yield X[start:start + 500], Y[start:start + 500]
+
+    y = np.arange(mu - 3 * std, mu + 3 * std, 6 * std / 20)
+    x = np.asarray([mu for i in range(y.shape[0])])
+    p_true = norm.pdf(y, loc=mu, scale=std)
+
+    for i, (X_train, Y_train) in enumerate([(X, Y), (data_fn, None)]):
+      for model in [MixtureDensityNetwork("mdn_minibatch_%i" % i, 1, 1, n_centers=5, n_training_epochs=100, batch_size=256),
+                    KernelMixtureNetwork("kmn_minibatch_%i" % i, 1, 1, n_centers=20, n_training_epochs=100, batch_size=256),
+                    NormalizingFlowEstimator("nf_minibatch_%i" % i, 1, 1, n_training_epochs=100, batch_size=256)]:
+        model.fit(X_train, Y_train)
+        p_est = model.pdf(x, y)
+        self.assertLessEqual(np.mean(np.abs(p_true - p_est)), 0.1)
+
+  def test_early_stopping(self):
+    mu, std = -5, 2.5
+    X, Y = self.get_samples(mu=mu, std=std)
+    X_test, Y_test = self.get_samples(mu=mu, std=std)
+
+    for model in [MixtureDensityNetwork("mdn_early_stopping", 1, 1, n_centers=5, n_training_epochs=2000),
+                  NormalizingFlowEstimator("nf_early_stopping", 1, 1, n_training_epochs=2000)]:
+      t = time.time()
+      model.fit(X, Y, eval_set=(X_test, Y_test), patience=5, eval_interval=10, max_fit_time=60)
+      self.assertLessEqual(time.time() - t, 90)
+      self.assertGreaterEqual(model.score(X_test, Y_test), np.mean(norm.logpdf(Y_test, loc=mu, scale=std)) - 0.1)
+
+  def test_partial_fit(self):
+    X, Y = self.get_samples(mu=-5, std=2.5)
+    X_new, Y_new = self.get_samples(mu=5, std=2.5)
+
+    for model in [MixtureDensityNetwork("mdn_partial_fit", 1, 1, n_centers=5, data_normalization=True),
+                  NormalizingFlowEstimator("nf_partial_fit", 1, 1, data_normalization=True)]:
+      model.set_replay_buffer_size(200)
+      model.fit(X, Y)
+      self.assertEqual(len(model._replay_buffer), 200)
+
+      # warm start - the normalization statistics are those of all data seen so far
+      model.partial_fit(X_new, Y_new, n_epoch=200)
+      Y_all = np.concatenate([Y, Y_new])
+      self.assertEqual(model.n_samples_seen, 2 * len(Y))
+      self.assertAlmostEqual(float(model.y_mean), np.mean(Y_all), places=4)
+      self.assertAlmostEqual(float(model.y_std), np.std(Y_all), places=4)
+      self.assertGreater(model.score(X_new, Y_new), np.mean(norm.logpdf(Y_new, loc=5, scale=2.5)) - 0.5)
+
+  def test_fit_warm_start(self):
+    X, Y = self.get_samples(mu=-5, std=2.5)
+    X_test, Y_test = self.get_samples(mu=-5, std=2.5)
+
+    model = MixtureDensityNetwork("mdn_warm_start_1", 1, 1, n_centers=5, data_normalization=True, random_seed=22)
+    model.fit(X[:200], Y[:200])
+
+    # the warm-started model reaches a good fit with a fraction of the epochs
+    model_warm = MixtureDensityNetwork("mdn_warm_start_2", 1, 1, n_centers=5, data_normalization=True, random_seed=22)
+    model_warm.fit_warm_start(X, Y, model.get_param_values(), n_epoch=100)
+    self.assertTrue(model_warm.fitted)
+    self.assertAlmostEqual(float(model_warm.y_mean), np.mean(Y), places=4)
+    self.assertGreater(model_warm.score(X_test, Y_test), np.mean(norm.logpdf(Y_test, loc=-5, scale=2.5)) - 0.2)
+
+  def test_fit_callbacks(self):
+    X, Y = self.get_samples(mu=-5, std=2.5)
+    X_test, Y_test = self.get_samples(mu=-5, std=2.5)
+
+    for model in [MixtureDensityNetwork("mdn_callbacks", 1, 1, n_centers=5, n_training_epochs=20, batch_size=100),
+                  NormalizingFlowEstimator("nf_callbacks", 1, 1, n_training_epochs=20, batch_size=100)]:
+      phase_times, throughput, loss_curve = PhaseTimes(), Throughput(), LossCurve()
+      model.fit(X, Y, eval_set=(X_test, Y_test), verbose=False, callbacks=[phase_times, throughput, loss_curve])
+
+      losses = loss_curve.sink.to_dataframe()
+      self.assertGreaterEqual(len(losses), 20)
+      self.assertLess(losses['loss'].iloc[-1], losses['loss'].iloc[0])
+      self.assertAlmostEqual(losses['eval_loss'].iloc[-1], -model.score(X_test, Y_test), delta=0.1)
+      self.assertTrue(np.all(throughput.sink.to_dataframe()['n_samples'] == len(X)))
+      times = phase_times.sink.to_dataframe()
+      self.assertTrue(np.all(times['session_run'] > 0) and np.all(times['eval'] > 0))
+
+  def test_ensemble(self):
+    mu, std = -5, 2.5
+    X, Y = self.get_samples(mu=mu, std=std)
+
+    for estimator_class in [MixtureDensityNetwork, NormalizingFlowEstimator]:
+      ensemble = EnsembleEstimator(estimator_class, "ensemble_" + estimator_class.__name__, 1, 1, seeds=[22, 23, 24],
+                                   n_training_epochs=500)
+      ensemble.fit(X, Y)
+
+      member_scores = ensemble.member_scores(X, Y)
+      self.assertEqual(len(member_scores), 3)
+      self.assertAlmostEqual(member_scores[1], ensemble.members[1].score(X, Y), places=5)
+
+      # mixture of members: mean of the member densities, at least as good as the average member (Jensen)
+      y = np.linspace(mu - 3 * std, mu + 3 * std, 20)
+      x = np.full(20, mu)
+      self.assertTrue(np.allclose(ensemble.pdf(x, y), np.mean([m.pdf(x, y) for m in ensemble.members], axis=0)))
+      self.assertGreaterEqual(ensemble.score(X, Y), np.mean(member_scores) - 1e-6)
+      self.assertLessEqual(np.mean(np.abs(ensemble.pdf(x, y) - norm.pdf(y, loc=mu, scale=std))), 0.1)
+
+  def test_lockstep_epochs(self):
+    # lock-step training yields the same parameters as fitting the members one after another
+    X, Y = self.get_samples(mu=-5, std=2.5)
+
+    for estimator_class in [MixtureDensityNetwork, NormalizingFlowEstimator]:
+      ensemble = EnsembleEstimator(estimator_class, "ensemble_lockstep_" + estimator_class.__name__, 1, 1,
+                                   seeds=[22, 23], n_training_epochs=10, shuffle=False)
+      data = ensemble.members[0]._training_data(X, Y)
+      for member in ensemble.members:
+        member._initialize_fit(data)
+      init_params = [member.get_param_values() for member in ensemble.members]
+      BaseNNEstimator._fit_lockstep(ensemble.members, [data] * 2)
+      lockstep_params = [member.get_param_values() for member in ensemble.members]
+
+      for member, params, expected_params in zip(ensemble.members, init_params, lockstep_params):
+        member._initialize_fit(data)
+        member.set_param_values(params)
+        member._partial_fit(data, n_epoch=member._n_fit_epochs(), verbose=False)
+        self.assertTrue(np.allclose(member.get_param_values(), expected_params))
+
+  def test_sample_weight_MDN(self):
+    np.random.seed(22)
+    X = np.random.normal(size=(2000, 1))
+    Y = np.where(np.random.uniform(size=(2000, 1)) < 0.5, -3.0, 3.0) + np.random.normal(scale=0.3, size=(2000, 1))
+
+    # only the samples of the upper mode are weighted
+    model = MixtureDensityNetwork("mdn_sample_weight", 1, 1, n_centers=3, n_training_epochs=200)
+    model.fit(X, Y, sample_weight=(Y[:, 0] > 0).astype(np.float64))
+
+    x = np.zeros((1, 1))
+    self.assertGreater(model.pdf(x, np.full((1, 1), 3.0))[0], 0.5)
+    self.assertLess(model.pdf(x, np.full((1, 1), -3.0))[0], 0.05)
+
+  def test_fit_data_parallel(self):
+    mu, std = -5, 2.5
+    X, Y = self.get_samples(mu=mu, std=std)
+
+    for model in [MixtureDensityNetwork("mdn_data_parallel", 1, 1, n_centers=5, batch_size=500),
+                  NormalizingFlowEstimator("nf_data_parallel", 1, 1)]:
+      model.fit_data_parallel(X, Y, n_workers=2)
+      self.assertTrue(model.fitted)
+      self.assertGreaterEqual(model.score(X, Y), np.mean(norm.logpdf(Y, loc=mu, scale=std)) - 0.1)
+
   def test_MDN_with_2d_gaussian(self):
     mu = 200
     std = 23
@@ -262,6 +503,75 @@ class TestConditionalDensityEstimators_2d_gaussian(unittest.TestCase):
     p_true = norm.cdf(y, loc=mu, scale=std)
     self.assertLessEqual(np.mean(np.abs(p_true - p_est)), 0.1)
 
+  def test_mixture_cdf_closed_form(self):
+    np.random.seed(22)
+    X = np.random.normal(size=(1000, 1))
+    Y = np.random.normal(loc=X, scale=[1.0, 2.0], size=(1000, 2))
+
+    for model in [MixtureDensityNetwork("mdn_cdf", 1, 2, n_centers=3, n_training_epochs=50),
+                  KernelMixtureNetwork("kmn_cdf", 1, 2, n_centers=5, n_training_epochs=50)]:
+      model.fit(X, Y)
+
+      x, y = X[:20], Y[:20]
+      p_est = model.cdf(x, y)
+      self.assertEqual(p_est.shape, (20,))
+
+      weights, locs, scales = model._get_mixture_components(x)
+      p_true = [sum(weights[i, j] * stats.multivariate_normal.cdf(y[i], mean=locs[i, j], cov=np.diag(scales[i, j] ** 2))
+                    for j in range(weights.shape[1])) for i in range(x.shape[0])]
+      self.assertLessEqual(np.max(np.abs(p_true - p_est)), 1e-4)
+
+  def test_mixture_log_pdf_fused(self):
+    np.random.seed(22)
+    X = np.random.normal(size=(1000, 1))
+    Y = np.random.normal(loc=X, scale=[1.0, 2.0], size=(1000, 2))
+
+    for model in [MixtureDensityNetwork("mdn_fused", 1, 2, n_centers=3, n_training_epochs=50, data_normalization=True),
+                  KernelMixtureNetwork("kmn_fused", 1, 2, n_centers=200, init_scales=[0.3, 0.7, 1.5],
+                                       n_training_epochs=50, data_normalization=True)]:
+      model.fit(X, Y)
+
+      x, y = X[:20], Y[:20]
+      weights, locs, scales = model._get_mixture_components(x)
+      component_log_probs = np.sum(norm.logpdf(y[:, None, :], loc=locs, scale=scales), axis=2)
+      log_p_true = np.log(np.sum(weights * np.exp(component_log_probs), axis=1))
+      self.assertLessEqual(np.max(np.abs(model.log_pdf(x, y) - log_p_true)), 1e-3)
+      self.assertLessEqual(np.max(np.abs(model.pdf(x, y) - np.exp(log_p_true))), 1e-4)
+
+  def test_export_numpy(self):
+    np.random.seed(22)
+    X = np.random.normal(size=(1000, 1))
+    Y = np.random.normal(loc=X, scale=[1.0, 2.0], size=(1000, 2))
+
+    for model in [MixtureDensityNetwork("mdn_export", 1, 2, n_centers=3, n_training_epochs=50),
+                  KernelMixtureNetwork("kmn_export", 1, 2, n_centers=20, init_scales=[0.5, 1.0], n_training_epochs=50,
+                                       data_normalization=True),
+                  NormalizingFlowEstimator("nf_export", 1, 2, flows_type=('affine', 'planar', 'radial'),
+                                           n_training_epochs=50)]:
+      model.fit(X, Y, verbose=False)
+      predictor = pickle.loads(pickle.dumps(model.export_numpy()))
+
+      x, y = X[:20], Y[:20]
+      self.assertLessEqual(np.max(np.abs(predictor.log_pdf(x, y) - model.log_pdf(x, y))), 1e-3)
+      self.assertLessEqual(np.max(np.abs(predictor.pdf(x, y) - model.pdf(x, y))), 1e-4)
+      if model.has_cdf:
+        self.assertLessEqual(np.max(np.abs(predictor.cdf(x, y) - model.cdf(x, y))), 1e-4)
+      if model.can_sample:
+        self.assertTrue(np.allclose(predictor.mean_(x), model.mean_(x), atol=1e-3))
+        self.assertTrue(np.allclose(predictor.covariance(x), model.covariance(x), atol=1e-3))
+        self.assertEqual(predictor.sample(x, random_state=22)[1].shape, (20, 2))
+
+  def test_export_numpy_nf_cdf(self):
+    X, Y = self.get_samples(mu=5, std=2)
+    model = NormalizingFlowEstimator("nf_export_cdf", 1, 1, n_flows=2, n_training_epochs=100, data_normalization=True)
+    model.fit(X, Y, verbose=False)
+    predictor = model.export_numpy()
+
+    x, y = np.full(12, 5.0), np.linspace(1, 9, 12)
+    self.assertLessEqual(np.max(np.abs(predictor.pdf(x, y) - model.pdf(x, y))), 1e-4)
+    self.assertLessEqual(np.max(np.abs(predictor.cdf(x, y) - model.cdf(x, y))), 1e-4)
+    self.assertLessEqual(np.mean(np.abs(predictor.cdf(x, y) - norm.cdf(y, loc=5, scale=2))), 0.1)
+
   def test_CDE_with_2d_gaussian(self):
     X, Y = self.get_samples()
 
@@ -592,6 +902,25 @@ class TestRegularization(unittest.TestCase):
 
     self.assertLessEqual(err_reg_l1, err_no_reg)
 
+  def test_minibatch_regularization_scale(self):
+    # the objective of the mini-batches (nll scaled to the whole data + regularization) must equal the full-batch one
+    X, Y = self.get_samples(mu=5, std=5, n_samples=500)
+    X, Y = X.reshape((-1, 1)), Y.reshape((-1, 1))
+    data = TrainingData(X, Y, 1, 1)
+
+    for model in [MixtureDensityNetwork("mdn_minibatch_reg", 1, 1, n_centers=5, n_training_epochs=10, l2_reg=1.0,
+                                        batch_size=100, weight_normalization=False),
+                  NormalizingFlowEstimator("nf_minibatch_reg", 1, 1, n_training_epochs=10, l2_reg=1.0, batch_size=100,
+                                           weight_normalization=False)]:
+      model.fit(X, Y)
+      loss = model.train_loss if hasattr(model, 'train_loss') else model.log_loss
+
+      full_batch_loss = model.sess.run(loss, feed_dict={model.X_ph: X, model.Y_ph: Y})
+      minibatch_losses = [model.sess.run(loss, feed_dict={model.X_ph: X[i:i + 100], model.Y_ph: Y[i:i + 100],
+                                                          model.nll_scale_ph: model._nll_scale(data, (X[i:i + 100],))})
+                          for i in range(0, 500, 100)]
+      self.assertAlmostEqual(np.mean(minibatch_losses) / full_batch_loss, 1.0, places=4)
+
   def test_MDN_dropout(self):
     mu = -8
     std = 2.5
@@ -719,6 +1048,24 @@ class TestConditionalDensityEstimators_fit_by_crossval(unittest.TestCase):
     self.assertEqual(model.get_params()["n_centers"], 10)
     self.assertLessEqual(np.mean(np.abs(p_true - p_est)), 0.2)
 
+  def test_3_MDN_fit_by_crossval_vectorized_folds(self):
+    X, Y = self.get_samples()
+
+    param_grid = {
+      "n_centers": [2, 10],
+      "n_training_epochs": [300, 500]
+    }
+
+    model = MixtureDensityNetwork("mdn_cv_lockstep")
+    model.fit_by_cv(X, Y, param_grid=param_grid, vectorize_folds=True)
+
+    y = np.arange(-1, 5, 0.5)
+    x = np.asarray([2 for i in range(y.shape[0])])
+    p_est = model.pdf(x, y)
+    p_true = norm.pdf(y, loc=2, scale=1)
+    self.assertEqual(model.get_params()["n_centers"], 10)
+    self.assertLessEqual(np.mean(np.abs(p_true - p_est)), 0.2)
+
 if __name__ == '__main__':
   warnings.filterwarnings("ignore")
 
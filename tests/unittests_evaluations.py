@@ -53,6 +53,22 @@ class TestRiskMeasures(unittest.TestCase):
       self.assertAlmostEqual(VaR_est[0], VaR_true, places=2)
       self.assertAlmostEqual(VaR_est[1], VaR_true, places=2)
 
+  def test_quantiles(self):
+    alphas = np.array([0.01, 0.05, 0.5, 0.9])
+    for mu, sigma in [(-2, 0.5), (22, 3)]:
+      for has_cdf in [True, False]:
+        est = GaussianDummy(mean=np.array([mu]), cov=np.identity(n=1)*sigma**2, ndim_x=1, ndim_y=1, has_cdf=has_cdf)
+        est.fit(None, None)
+
+        quantiles = est.quantiles(x_cond=np.array([[0], [1], [2]]), alphas=alphas)
+        self.assertEqual(quantiles.shape, (3, 4))
+        for i in range(3):
+          for j, alpha in enumerate(alphas):
+            self.assertAlmostEqual(quantiles[i, j] / sigma, norm.ppf(alpha, loc=mu, scale=sigma) / sigma, places=2)
+
+        VaR = est.value_at_risk(x_cond=np.array([[0], [1], [2]]), alpha=0.05)
+        self.assertLessEqual(np.max(np.abs(VaR - quantiles[:, 1])), 0.02 * sigma)
+
   def test_conditional_value_at_risk_mc(self):
     for mu, sigma, alpha in [(1, 1, 0.05), (0.4, 0.1, 0.02), (0.1, 2, 0.01)]:
       # prepare estimator dummy
@@ -87,6 +103,22 @@ class TestRiskMeasures(unittest.TestCase):
       self.assertAlmostEqual(CVaR_est[0], CVaR_true, places=2)
       self.assertAlmostEqual(CVaR_est[1], CVaR_true, places=2)
 
+  def test_tail_risk_measures_multi_alpha(self):
+    alphas = np.array([0.01, 0.025, 0.05, 0.1])
+    for mu, sigma in [(-6, 0.25), (22, 3)]:
+      for has_pdf in [True, False]:
+        est = GaussianDummy(mean=np.array([mu]), cov=np.identity(n=1)*sigma**2, ndim_x=1, ndim_y=1, has_pdf=has_pdf)
+        est.fit(None, None)
+
+        VaRs, CVaRs = est.tail_risk_measures(x_cond=np.array([[0], [1]]), alpha=alphas, n_samples=2*10**6)
+        self.assertEqual(VaRs.shape, (2, 4))
+        self.assertEqual(CVaRs.shape, (2, 4))
+
+        CVaRs_true = mu - sigma / alphas * norm.pdf(norm.ppf(alphas))
+        for i in range(2):
+          self.assertLessEqual(np.max(np.abs(VaRs[i] - norm.ppf(alphas, loc=mu, scale=sigma))), 0.02 * sigma)
+          self.assertLessEqual(np.max(np.abs(CVaRs[i] - CVaRs_true)), 0.02 * sigma)
+
   def test_mean_mc(self):
     # prepare estimator dummy
     mu = np.array([0,1])
@@ -168,6 +200,23 @@ class TestRiskMeasures(unittest.TestCase):
     self.assertAlmostEqual(cov_est[0][0][0], sigma[0][0], places=2)
     self.assertAlmostEqual(cov_est[0][1][0], sigma[1][0], places=2)
 
+  def test_covariance3(self):
+    # prepare estimator dummy
+    mu = np.array([0, 1, 2])
+    sigma = np.array([[1, -0.2, 0.1], [-0.2, 2, 0], [0.1, 0, 0.5]])
+    est = GaussianDummy(mean=mu, cov=sigma, ndim_x=2, ndim_y=3, can_sample=False)
+    est.fit(None, None)
+
+    x_cond = np.array([[0, 1], [1, 2]])
+    cov_est = est._covariance_pdf(x_cond, mean=np.tile(mu, (2, 1)))
+    self.assertEqual(cov_est.shape, (2, 3, 3))
+    self.assertLessEqual(np.max(np.abs(cov_est - np.transpose(cov_est, (0, 2, 1)))), 1e-10)
+    self.assertLessEqual(np.max(np.abs(cov_est - sigma)), 0.02)
+
+    # early stop once the standard error of all entries is below the tolerance
+    cov_est = est._covariance_pdf(x_cond, mean=np.tile(mu, (2, 1)), std_err_tol=0.01)
+    self.assertLessEqual(np.max(np.abs(cov_est - sigma)), 0.05)
+
   def test_mean_std(self):
     mu = np.array([0, 1])
     sigma = np.array([[1, -0.2], [-0.2, 2]])
@@ -180,6 +229,48 @@ class TestRiskMeasures(unittest.TestCase):
     self.assertAlmostEqual(std_est[0][0]**2, sigma[0][0], places=2)
     self.assertAlmostEqual(std_est[0][1]**2, sigma[1][1], places=2)
 
+  def test_adaptive_integral_batching(self):
+    mu = np.array([0.5])
+    sigma = np.array([[2.0]])
+    est = GaussianDummy(mean=mu, cov=sigma, ndim_x=1, ndim_y=1, can_sample=False)
+    est.fit(None, None)
+
+    x_cond = np.linspace(-1, 1, num=7).reshape((7, 1))
+
+    mean_one_pass = est._adaptive_integral(x_cond, lambda y, idx: y)
+    mean_chunked = est._adaptive_integral(x_cond, lambda y, idx: y, batch_size=100)
+    self.assertEqual(mean_one_pass.shape, (7,))
+    self.assertLessEqual(np.max(np.abs(mean_one_pass - mean_chunked)), 1e-10)
+    self.assertAlmostEqual(mean_one_pass[0], mu[0], places=6)
+
+    # individual integration bounds per x_cond
+    uppers = np.linspace(0, 3, num=7)
+    probs = est._adaptive_integral(x_cond, lambda y, idx: np.ones(y.shape), upper=uppers, batch_size=100)
+    for i, upper in enumerate(uppers):
+      self.assertAlmostEqual(probs[i], norm.cdf(upper, loc=mu[0], scale=np.sqrt(sigma[0][0])), places=6)
+
+  def test_adaptive_integral_brackets(self):
+    # narrow conditional densities far away from the global bounds are only found with per-x brackets
+    locs, scales = np.array([-40., 3., 25.]), np.array([0.01, 1., 0.5])
+
+    class ShiftedGaussianDummy(GaussianDummy):
+      def pdf(self, X, Y):
+        X, Y = self._handle_input_dimensionality(X, Y)
+        return norm.pdf(Y[:, 0], loc=locs[X[:, 0].astype(int)], scale=scales[X[:, 0].astype(int)])
+
+      def _conditional_location_scale(self, x_cond):
+        return locs[x_cond[:, 0].astype(int)], scales[x_cond[:, 0].astype(int)]
+
+    est = ShiftedGaussianDummy(mean=np.array([0.]), ndim_x=1, ndim_y=1, can_sample=False)
+    est.fit(None, None)
+
+    mean, std, skew, kurt = est.moments(np.array([[0], [1], [2]]))
+    for i in range(3):
+      self.assertAlmostEqual(mean[i][0], locs[i], places=6)
+      self.assertAlmostEqual(std[i][0], scales[i], places=6)
+      self.assertAlmostEqual(skew[i], 0.0, places=4)
+      self.assertAlmostEqual(kurt[i], 0.0, places=4)
+
   def test_covariance_mixture(self):
     np.random.seed(24)
     from tensorflow import set_random_seed
@@ -198,6 +289,22 @@ class TestRiskMeasures(unittest.TestCase):
     self.assertLessEqual(np.abs(cov_est[0][1][0] - 0.0), 0.2)
     self.assertLessEqual(np.abs(np.sqrt(cov_est[0][0][0]) - scale),1.0)
 
+  def test_moments_mixture(self):
+    X, Y = self.get_samples(std=0.5)
+    model = KernelMixtureNetwork("kmn-moments", 1, 1, center_sampling_method="k_means", n_centers=5,
+                                 n_training_epochs=50)
+    model.fit(X, Y)
+
+    x_cond = np.array([[0], [1], [2]])
+    moments_closed_form = model.moments(x_cond)
+    moments_pdf = BaseDensityEstimator.moments(model, x_cond)
+    for m_closed_form, m_pdf in zip(moments_closed_form, moments_pdf):
+      self.assertLessEqual(np.max(np.abs(m_closed_form - m_pdf)), 1e-4)
+
+    skew, kurt = model.skewness(x_cond), model.kurtosis(x_cond)
+    self.assertLessEqual(np.max(np.abs(skew - moments_pdf[2])), 1e-4)
+    self.assertLessEqual(np.max(np.abs(kurt - moments_pdf[3])), 1e-4)
+
   def test_skewness1(self):
     mu = np.array([-0.001])
     sigma = np.array([[0.02]])
@@ -254,6 +361,52 @@ class TestRiskMeasures(unittest.TestCase):
 
     print("True Kurtosis value", est.kurtosis)
 
+  def test_moments_single_pass(self):
+    est = SkewNormalDummy(shape=-2, ndim_x=2, ndim_y=1)
+    est.fit(None, None)
+
+    x_cond = np.array([[0, 1], [1, 0]])
+    mean, std, skew, kurt = est.moments(x_cond, orders=(1, 2, 3, 4))
+    self.assertEqual(mean.shape, (2, 1))
+    self.assertEqual(std.shape, (2, 1))
+    self.assertEqual(skew.shape, (2,))
+    self.assertAlmostEqual(mean[0][0], est.distribution.mean(), places=2)
+    self.assertAlmostEqual(std[0][0], est.distribution.std(), places=2)
+    self.assertAlmostEqual(skew[1], est.skewness, places=2)
+    self.assertAlmostEqual(kurt[1], est.kurtosis, places=2)
+
+    # same result as the separately computed statistics
+    skew_pdf = est._skewness_pdf(x_cond, mean=mean, std=std)
+    self.assertAlmostEqual(skew[0], skew_pdf[0], places=3)
+
+  def test_moments_2d(self):
+    mu = np.array([0, 1])
+    sigma = np.array([[1, -0.2], [-0.2, 2]])
+    est = GaussianDummy(mean=mu, cov=sigma, ndim_x=2, ndim_y=2, can_sample=False)
+    est.fit(None, None)
+
+    mean, std = est.moments(x_cond=np.array([[0, 1]]), orders=(1, 2))
+    self.assertAlmostEqual(mean[0][0], mu[0], places=2)
+    self.assertAlmostEqual(mean[0][1], mu[1], places=2)
+    self.assertAlmostEqual(std[0][0], np.sqrt(sigma[0][0]), places=2)
+    self.assertAlmostEqual(std[0][1], np.sqrt(sigma[1][1]), places=2)
+
+    with self.assertRaises(AssertionError):
+      est.moments(x_cond=np.array([[0, 1]]), orders=(1, 3))
+
+  def test_expectation(self):
+    mu, sigma = 1.5, 0.5
+    for has_pdf in [True, False]:
+      est = GaussianDummy(mean=np.array([mu]), cov=np.array([[sigma ** 2]]), ndim_x=1, ndim_y=1, has_pdf=has_pdf)
+      est.fit(None, None)
+
+      func = lambda y: np.concatenate([y, y ** 2, (y < mu).astype(float)], axis=1)
+      expectations = est.expectation(np.array([[0], [1]]), func)
+      self.assertEqual(expectations.shape, (2, 3))
+      self.assertAlmostEqual(expectations[0][0], mu, places=2)
+      self.assertAlmostEqual(expectations[1][1], mu ** 2 + sigma ** 2, places=2)
+      self.assertAlmostEqual(expectations[1][2], 0.5, places=2)
+
   def test_conditional_value_at_risk_mixture(self):
     np.random.seed(20)
     X, Y = self.get_samples(std=0.5)
@@ -290,6 +443,26 @@ class TestRiskMeasures(unittest.TestCase):
     diff_var = np.mean(np.abs(VaR_mixture - VaR_cdf))
     self.assertAlmostEqual(diff_var, 0, places=1)
 
+  def test_tail_risks_mixture_multi_alpha(self):
+    X, Y = self.get_samples(std=0.5)
+    model = KernelMixtureNetwork("kmn-var3", 1, 1, center_sampling_method="k_means", n_centers=5, n_training_epochs=50)
+    model.fit(X, Y)
+
+    x_cond = np.array([[0], [1], [2]])
+    alphas = np.array([0.01, 0.025, 0.05, 0.1])
+
+    VaRs, CVaRs = model.tail_risk_measures(x_cond, alpha=alphas)
+    self.assertEqual(VaRs.shape, (3, 4))
+    self.assertEqual(CVaRs.shape, (3, 4))
+
+    _, CVaRs_pdf = BaseDensityEstimator.tail_risk_measures(model, x_cond, alpha=alphas)
+    self.assertLessEqual(np.max(np.abs(CVaRs - CVaRs_pdf)), 1e-4)
+
+    for j, alpha in enumerate(alphas):
+      p = model.cdf(x_cond, VaRs[:, j])
+      self.assertLessEqual(np.max(np.abs(p - alpha)), 1e-6)
+      self.assertLessEqual(np.max(np.abs(model.value_at_risk(x_cond, alpha=alpha) - VaRs[:, j])), 1e-6)
+
 class TestDivergenceMeasures(unittest.TestCase):
 
   def setUp(self):
@@ -403,6 +576,31 @@ class TestDivergenceMeasures(unittest.TestCase):
     self.assertAlmostEqual(kl_est[0], kl_true, places=1)
     self.assertAlmostEqual(h_est[0], h_true, places=1)
 
+  def test_divmeasures_qmc_2d(self):
+    x_cond = np.array([[0.0, 1.0]])
+    js_true = 0.5 * _kl_gaussians(self.mu3, self.cov3, self.mu4, self.cov4) + 0.5 * _kl_gaussians(self.mu4, self.cov4,
+                                                                                                  self.mu3, self.cov3)
+    h_true = _hellinger_gaussians(self.mu3, self.cov3, self.mu4, self.cov4)
+    kl_true = _kl_gaussians(self.mu3, self.cov3, self.mu4, self.cov4)
+
+    for sampling in ['sobol', 'halton']:
+      # a small fraction of the samples suffices with low-discrepancy proposals
+      h_est, kl_est, js_est = divergence_measures_pdf(self.gaussian3, self.gaussian4, x_cond=x_cond, n_samples=2 ** 13,
+                                                      sampling=sampling)
+      self.assertAlmostEqual(js_est[0], js_true, places=1)
+      self.assertAlmostEqual(kl_est[0], kl_true, places=1)
+      self.assertAlmostEqual(h_est[0], h_true, places=1)
+
+  def test_mean_cov_qmc_2d(self):
+    self.gaussian3.fit(None, None)
+    mean_est = self.gaussian3.mean_(x_cond=np.array([[0, 1]]), n_samples=2 ** 14, sampling='sobol')
+    self.assertAlmostEqual(mean_est[0][0], self.mu3[0], places=1)
+    self.assertAlmostEqual(mean_est[0][1], self.mu3[1], places=1)
+
+    cov_est = self.gaussian3.covariance(x_cond=np.array([[0, 1]]), n_samples=2 ** 14, sampling='sobol')
+    self.assertAlmostEqual(cov_est[0][0][0], self.cov3[0][0], places=1)
+    self.assertAlmostEqual(cov_est[0][1][0], self.cov3[1][0], places=1)
+
 def _kl_gaussians(mu1, cov1, mu2, cov2):
   assert cov1.shape == cov2.shape
   assert mu1.shape == mu2.shape
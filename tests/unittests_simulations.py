@@ -8,6 +8,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 print(sys.path)
 from cde.density_simulation import SkewNormal, GaussianMixture, EconDensity, JumpDiffusionModel, ArmaJump, LinearStudentT
 from cde.utils.integration import mc_integration_student_t
+from cde.BaseConditionalDensity import N_SUBINTERVALS_INT_TIGHT_BOUNDS
 from tests.dummies import SimulationDummy
 
 
@@ -73,6 +74,13 @@ class TestGaussianMixture(unittest.TestCase):
     cov_mc = covariance_pdf(gmm, x_cond)
     self.assertLessEqual(np.sum((cov_mc - cov) ** 2), 0.1)
 
+  def test_closed_form_sampling_kwarg(self):
+    # the closed-form moments accept (and ignore) the sampling scheme of the monte carlo integration
+    gmm = GaussianMixture(n_kernels=2, random_seed=54, ndim_x=2, ndim_y=2)
+    x_cond = np.array([[1.0, 1.0]])
+    self.assertTrue(np.allclose(gmm.mean_(x_cond, sampling='sobol'), gmm.mean_(x_cond)))
+    self.assertTrue(np.allclose(gmm.covariance(x_cond, sampling='halton'), gmm.covariance(x_cond)))
+
   def test_sampling(self):
     gmm = GaussianMixture(n_kernels=5, random_seed=54, ndim_x=3, ndim_y=2)
 
@@ -453,6 +461,20 @@ class TestRiskMeasures(unittest.TestCase):
     self.assertAlmostEqual(CVaR_est[0], CVaR_true, places=2)
     self.assertAlmostEqual(CVaR_est[1], CVaR_true, places=2)
 
+  def test_tail_risk_measures_multi_alpha(self):
+    alphas = [0.01, 0.025, 0.05, 0.1]
+    est = SimulationDummy(mean=np.array([1]), cov=np.identity(n=1) * 4, ndim_x=1, ndim_y=1, has_cdf=True)
+
+    VaRs, CVaRs = est.tail_risk_measures(x_cond=np.array([[0], [1]]), alpha=alphas)
+    self.assertEqual(VaRs.shape, (2, 4))
+    self.assertEqual(CVaRs.shape, (2, 4))
+
+    for j, alpha in enumerate(alphas):
+      VaR, CVaR = est.tail_risk_measures(x_cond=np.array([[0], [1]]), alpha=alpha)
+      self.assertAlmostEqual(VaRs[0, j], stats.norm.ppf(alpha, loc=1, scale=2), places=4)
+      self.assertAlmostEqual(CVaRs[0, j], 1 - 2 / alpha * stats.norm.pdf(stats.norm.ppf(alpha)), places=4)
+      self.assertAlmostEqual(CVaRs[1, j], CVaR[1], places=6)
+
   def test_conditional_value_at_risk_mc_2dim_xcond(self):
     # prepare estimator dummy
     mu = 0
@@ -487,6 +509,20 @@ class TestRiskMeasures(unittest.TestCase):
     self.assertAlmostEqual(CVaR_est[0], CVaR_true, places=2)
     self.assertAlmostEqual(CVaR_est[1], CVaR_true, places=2)
 
+  def test_integration_brackets(self):
+    x_cond = np.array([[0.2], [0.5], [2.0]])
+    for sim in [SkewNormal(random_seed=22), GaussianMixture(ndim_x=1, ndim_y=1, random_seed=22), EconDensity(random_seed=22),
+                ArmaJump(random_seed=22), LinearStudentT(ndim_x=1, random_seed=22)]:
+      # per-x brackets from the location and scale of the simulation - the density mass lies within the brackets
+      _, _, n_subintervals = sim._integration_brackets(x_cond)
+      self.assertEqual(n_subintervals, N_SUBINTERVALS_INT_TIGHT_BOUNDS)
+      self.assertTrue(np.allclose(sim._adaptive_integral(x_cond, lambda y, idx: np.ones_like(y)), 1.0, atol=1e-6))
+
+    # grid estimate of the location and scale for densities without closed-form moments
+    est = SimulationDummy(mean=np.array([1.]), cov=np.array([[4.]]), ndim_x=1, ndim_y=1)
+    loc, scale = est._grid_location_scale(x_cond)
+    self.assertTrue(np.allclose(loc, 1.0, atol=1e-2) and np.allclose(scale, 2.0, atol=1e-2))
+
   def test_mean_mc(self):
     # prepare estimator dummy
     mu = np.array([0,1])
@@ -517,12 +553,24 @@ class TestRiskMeasures(unittest.TestCase):
     self.assertAlmostEqual(cov_est[0][0][0], sigma[0][0], places=2)
     self.assertAlmostEqual(cov_est[0][1][0], sigma[1][0], places=2)
 
+  def test_moments(self):
+    mu = np.array([-1])
+    sigma = np.array([[0.25]])
+    for has_pdf in [True, False]:
+      est = SimulationDummy(mean=mu, cov=sigma, ndim_x=1, ndim_y=1, has_pdf=has_pdf)
+
+      mean, std, skew, kurt = est.moments(x_cond=np.array([[0], [1]]))
+      self.assertAlmostEqual(mean[1][0], mu[0], places=2)
+      self.assertAlmostEqual(std[1][0], 0.5, places=2)
+      self.assertAlmostEqual(skew[0], 0.0, places=1)
+      self.assertAlmostEqual(kurt[0], 0.0, places=1)
+
 
 def mean_pdf(density, x_cond, n_samples=10 ** 6):
   means = np.zeros((x_cond.shape[0], density.ndim_y))
   for i in range(x_cond.shape[0]):
-    x = x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
-    func = lambda y: y * np.tile(np.expand_dims(density.pdf(x, y), axis=1), (1, density.ndim_y))
+    x_tiled = lambda y: np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (y.shape[0], 1))
+    func = lambda y: y * np.tile(np.expand_dims(density.pdf(x_tiled(y), y), axis=1), (1, density.ndim_y))
     integral = mc_integration_student_t(func, ndim=2, n_samples=n_samples)
     means[i] = integral
   return means
@@ -531,9 +579,8 @@ def covariance_pdf(density, x_cond, n_samples=10 ** 6):
   covs = np.zeros((x_cond.shape[0], density.ndim_y, density.ndim_y))
   mean = density.mean_(x_cond)
   for i in range(x_cond.shape[0]):
-    x = x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (n_samples, 1))
-
     def cov(y):
+      x = np.tile(x_cond[i].reshape((1, x_cond[i].shape[0])), (y.shape[0], 1))
       a = (y - mean[i])
 
       #compute cov matrices c for sampled instances and weight them with the probability p from the pdf
@@ -2,6 +2,10 @@ import unittest
 from scipy.stats import norm
 import warnings
 import pickle
+import time
+import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import tensorflow as tf
 import sys
 import os
@@ -11,8 +15,17 @@ import scipy.stats as stats
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from cde.utils.center_point_select import sample_center_points
 from cde.utils.misc import norm_along_axis_1
-from cde.utils.integration import mc_integration_student_t, numeric_integation
+from cde.utils.integration import mc_integration_student_t, numeric_integation, adaptive_gauss_kronrod, \
+  merge_chunk_statistics
 from cde.utils.async_executor import execute_batch_async_pdf
+from cde.utils.optimizers import find_root_bracketed
+from cde.utils.data_pipeline import TrainingData, ReservoirBuffer, update_mean_std
+from cde.utils.early_stopping import EarlyStopping
+from cde.utils.data_parallel import SharedAllReduce, shared_array, shard_batches, run_workers
+from cde.utils.coreset import build_coreset
+from cde.utils.numpy_predictor import NumpyMLP, NumpyMixturePredictor, NumpyNormalizingFlowPredictor
+from cde.utils.serving import MicroBatchServer
+from cde.utils.callbacks import EpochTimer, PhaseTimes, Throughput, LossCurve, CSVSink, PHASES
 from cde.utils.distribution import batched_univ_t_pdf, batched_univ_t_cdf, batched_univ_t_rvs
 
 
@@ -96,6 +109,37 @@ class TestHelpers(unittest.TestCase):
     self.assertAlmostEqual(1, integral[0], places=2)
     self.assertAlmostEqual(2, integral[1], places=2)
 
+  def test_mc_integration_t_streaming(self):
+    n_calls = []
+    def func(y):
+      n_calls.append(y.shape[0])
+      return np.expand_dims(stats.multivariate_normal.pdf(y, mean=[0, 0], cov=np.diag([2, 2])), axis=1)
+
+    # full budget in chunks -> the last chunk only holds the remaining samples
+    integral, std_err = mc_integration_student_t(func, ndim=2, n_samples=25 * 10 ** 4, batch_size=10 ** 5,
+                                                 return_std_err=True)
+    self.assertEqual(n_calls, [10 ** 5, 10 ** 5, 5 * 10 ** 4])
+    self.assertAlmostEqual(1.0, integral[0], places=1)
+    self.assertLessEqual(3 * std_err[0], 0.01)
+
+    # early stop once the standard error is below the tolerance
+    n_calls.clear()
+    integral, std_err = mc_integration_student_t(func, ndim=2, n_samples=10 ** 7, batch_size=10 ** 4,
+                                                 std_err_tol=0.01, return_std_err=True)
+    self.assertLessEqual(std_err[0], 0.01)
+    self.assertLess(sum(n_calls), 10 ** 7)
+    self.assertAlmostEqual(1.0, integral[0], places=1)
+
+  def test_merge_chunk_statistics(self):
+    # large offset relative to the spread -> the one-pass formula sum(v^2) / n - (sum(v) / n)^2 cancels
+    values = 1e8 + np.random.RandomState(22).normal(size=(2, 1000, 3))
+    n, mean, m2 = 0, np.zeros(2), np.zeros(2)
+    for chunk in np.split(values, 10, axis=1):
+      mean, m2 = merge_chunk_statistics(n, mean, m2, chunk[:, :, 0], axis=1)
+      n += chunk.shape[1]
+    np.testing.assert_allclose(mean, np.mean(values[:, :, 0], axis=1), rtol=1e-12)
+    np.testing.assert_allclose(m2 / (n - 1), np.var(values[:, :, 0], axis=1, ddof=1), rtol=1e-6)
+
 class TestExecAsyncBatch(unittest.TestCase):
 
   def test_batch_exec_1(self):
@@ -143,6 +187,317 @@ class TestIntegration(unittest.TestCase):
     print("kurt", result)
     self.assertAlmostEqual(float(result), 3, places=1)
 
+  def test_adaptive_gauss_kronrod(self):
+    locs, scales = np.array([-3., 0., 5.]), np.array([3., 1., 0.01])
+    moments = lambda y, idx: np.stack([y ** k * stats.norm.pdf(y, loc=locs[idx][:, None], scale=scales[idx][:, None])
+                                       for k in range(3)], axis=-1)
+
+    result, err = adaptive_gauss_kronrod(moments, locs - 10 * scales, locs + 10 * scales, rtol=1e-10)
+    self.assertEqual(result.shape, (3, 3))
+    self.assertLessEqual(np.max(err), 1e-8)
+    for i in range(3):
+      self.assertAlmostEqual(result[i, 0], 1.0, places=8)
+      self.assertAlmostEqual(result[i, 1], locs[i], places=8)
+      self.assertAlmostEqual(result[i, 2], locs[i] ** 2 + scales[i] ** 2, places=8)
+
+    # scalar integrand over wide bounds
+    kurt = lambda y, idx: y ** 4 * stats.norm.pdf(y)
+    result, _ = adaptive_gauss_kronrod(kurt, np.array([-10**3]), np.array([10**3]), n_subintervals=10**3)
+    self.assertEqual(result.shape, (1,))
+    self.assertAlmostEqual(result[0], 3.0, places=8)
+
+  def test_adaptive_gauss_kronrod_float32(self):
+    # the float32 rounding errors of the integrand must not trigger bisections down to max_iter
+    n_evals = [0]
+    def pdf_float32(y, idx):
+      n_evals[0] += y.size
+      return stats.norm.pdf(y).astype(np.float32)
+
+    result, _ = adaptive_gauss_kronrod(pdf_float32, np.array([-10.]), np.array([10.]), rtol=1e-8, atol=1e-12)
+    self.assertAlmostEqual(result[0], 1.0, places=6)
+    self.assertLessEqual(n_evals[0], 10 ** 3)
+
+    # an integrand that never converges stops at the evaluation budget
+    n_evals[0] = 0
+    def noise(y, idx):
+      n_evals[0] += y.size
+      return np.random.uniform(size=y.shape)
+
+    adaptive_gauss_kronrod(noise, np.array([0.]), np.array([1.]), max_evals=10 ** 4)
+    self.assertLessEqual(n_evals[0], 10 ** 4)
+
+  def test_mc_integration_t_qmc(self):
+    func = lambda y: y * np.tile(np.expand_dims(stats.multivariate_normal.pdf(y, mean=[1, 2], cov=np.diag([2, 2])), axis=1), (1,2))
+    for sampling in ['sobol', 'halton']:
+      integral = mc_integration_student_t(func, ndim=2, n_samples=2 ** 15, batch_size=2 ** 12, sampling=sampling)
+      self.assertAlmostEqual(1, integral[0], places=2)
+      self.assertAlmostEqual(2, integral[1], places=2)
+
+class TestOptimizers(unittest.TestCase):
+
+  def test_find_root_bracketed(self):
+    locs, scales = np.array([-3., 0., 5., 1.]), np.array([3., 1., 0.01, 2.])
+    alphas = np.array([0.01, 0.5, 0.9, 0.999])
+    fun = lambda y, idx: stats.t.cdf(y, df=4, loc=locs[idx], scale=scales[idx]) - alphas[idx]
+    grad = lambda y, idx: stats.t.pdf(y, df=4, loc=locs[idx], scale=scales[idx])
+    true = stats.t.ppf(alphas, df=4, loc=locs, scale=scales)
+
+    for g in [None, grad]:
+      # brackets that initially do not contain all roots have to be expanded
+      roots = find_root_bracketed(fun, left=locs - scales, right=locs + scales, x0=locs, grad=g, eps=1e-10)
+      self.assertEqual(roots.shape, (4,))
+      self.assertLessEqual(np.max(np.abs(roots - true) / scales), 1e-6)
+
+class TestDataPipeline(unittest.TestCase):
+
+  def test_training_data_batches(self):
+    rng = np.random.RandomState(22)
+    X, Y = rng.normal(size=(1003, 2)), rng.normal(loc=2, scale=3, size=(1003, 1))
+
+    def data_fn():
+      for start in range(0, X.shape[0], 77):
+        yield X[start:start + 77], Y[start:start + 77]
+
+    for data in [TrainingData(X, Y, 2, 1), TrainingData(data_fn, None, 2, 1)]:
+      statistics = data.statistics()
+      self.assertEqual(statistics['n_samples'], 1003)
+      self.assertTrue(np.allclose(statistics['X_mean'], np.mean(X, axis=0)))
+      self.assertTrue(np.allclose(statistics['Y_std'], np.std(Y, axis=0)))
+
+      batches = list(data.batches(batch_size=100, shuffle=True, random_state=np.random.RandomState(22)))
+      self.assertEqual(len(batches), 11)
+      self.assertTrue(all(X_batch.shape[0] == Y_batch.shape[0] <= 100 for X_batch, Y_batch in batches))
+
+      # every row is seen exactly once per epoch and the rows of X and Y stay aligned
+      X_epoch, Y_epoch = np.concatenate([b[0] for b in batches]), np.concatenate([b[1] for b in batches])
+      order, order_true = np.argsort(X_epoch[:, 0]), np.argsort(X[:, 0])
+      self.assertTrue(np.all(X_epoch[order] == X[order_true]))
+      self.assertTrue(np.all(Y_epoch[order] == Y[order_true]))
+
+  def test_update_mean_std(self):
+    rng = np.random.RandomState(22)
+    X_old, X_new = rng.normal(size=(500, 2)), rng.normal(loc=3, scale=2, size=(200, 2))
+
+    mean, std = update_mean_std(500, np.mean(X_old, axis=0), np.std(X_old, axis=0), X_new)
+    X = np.concatenate([X_old, X_new])
+    self.assertTrue(np.allclose(mean, np.mean(X, axis=0)))
+    self.assertTrue(np.allclose(std, np.std(X, axis=0)))
+
+    # decay = 1 forgets the previous statistics
+    mean, std = update_mean_std(500, np.mean(X_old, axis=0), np.std(X_old, axis=0), X_new, decay=1.0)
+    self.assertTrue(np.allclose(mean, np.mean(X_new, axis=0)))
+    self.assertTrue(np.allclose(std, np.std(X_new, axis=0)))
+
+  def test_reservoir_buffer(self):
+    buffer = ReservoirBuffer(100, 1, 1, random_state=np.random.RandomState(22))
+    for start in range(0, 10000, 250):
+      rows = np.arange(start, start + 250, dtype=np.float64).reshape((-1, 1))
+      buffer.add(rows, -rows)
+
+    self.assertEqual(len(buffer), 100)
+    self.assertEqual(buffer.n_seen, 10000)
+    self.assertTrue(np.all(buffer.X == -buffer.Y))
+    self.assertEqual(len(np.unique(buffer.X)), 100)
+    # uniform sub-sample of all rows -> mean close to the mean of 0, ..., 9999
+    self.assertAlmostEqual(np.mean(buffer.X), 4999.5, delta=1000)
+    self.assertEqual(buffer.sample(10)[0].shape, (10, 1))
+
+class TestDataParallel(unittest.TestCase):
+
+  def test_shared_all_reduce(self):
+    n_workers, n_steps = 3, 5
+    all_reduce = SharedAllReduce(n_workers, 4, timeout=60)
+    results = shared_array(n_workers * 4)
+
+    def _worker(rank):
+      total = np.zeros(4)
+      for step in range(n_steps):
+        total += all_reduce.all_reduce(rank, np.full(4, rank + step, dtype=np.float64))
+      results[rank * 4:(rank + 1) * 4] = total
+
+    run_workers(_worker, n_workers, all_reduce=all_reduce)
+    expected = sum(rank + step for rank in range(n_workers) for step in range(n_steps))
+    self.assertTrue(np.all(results == expected))
+
+  def test_run_workers_failure(self):
+    all_reduce = SharedAllReduce(2, 1, timeout=60)
+
+    def _worker(rank):
+      if rank == 1:
+        raise ValueError("worker failed")
+      all_reduce.all_reduce(rank, np.zeros(1))
+
+    with self.assertRaises(RuntimeError):
+      run_workers(_worker, 2, all_reduce=all_reduce)
+
+  def test_shard_batches(self):
+    batches = shard_batches(np.arange(1, 100, 3), 4, random_state=np.random.RandomState(22))
+    self.assertEqual(len(batches), 4)
+    self.assertEqual(sorted(np.concatenate(batches)), list(range(1, 100, 3)))
+
+class TestCoreset(unittest.TestCase):
+
+  def test_build_coreset(self):
+    rng = np.random.RandomState(22)
+    X = rng.normal(size=(20000, 2))
+    Y = X[:, :1] ** 2 + rng.normal(size=(20000, 1))
+
+    for method in ['sensitivity', 'kmeans++']:
+      X_c, Y_c, weights = build_coreset(X, Y, 200, method=method, random_state=np.random.RandomState(22))
+      self.assertLessEqual(X_c.shape[0], 200)
+      self.assertEqual(X_c.shape[0], Y_c.shape[0])
+      self.assertEqual(weights.shape, (X_c.shape[0],))
+      self.assertAlmostEqual(np.sum(weights) / 20000, 1.0, delta=0.05)
+      self.assertAlmostEqual(np.average(Y_c[:, 0], weights=weights), np.mean(Y), delta=0.15)
+
+    X_c, Y_c, weights = build_coreset(X[:100], Y[:100], 200)
+    self.assertTrue(np.all(X_c == X[:100]) and np.all(weights == 1))
+
+class TestNumpyPredictor(unittest.TestCase):
+
+  def constant_mlp(self, output):
+    # network with a constant output - p(y|x) does not depend on x
+    return NumpyMLP([np.zeros((1, 4)), np.zeros((4, len(output)))], [np.zeros(4), np.asarray(output)], ['tanh', 'identity'])
+
+  def test_mixture_predictor(self):
+    locs, scales, weights = np.array([-1.0, 2.0]), np.array([0.5, 1.5]), np.array([0.3, 0.7])
+    predictor = NumpyMixturePredictor("mixture", 1, 1, self.constant_mlp(np.concatenate([locs, np.log(np.expm1(scales)),
+                                                                                         np.log(weights)])), 2)
+    predictor = pickle.loads(pickle.dumps(predictor))
+
+    x, y = np.zeros(50), np.linspace(-4, 6, 50)
+    p_true = np.sum(weights * norm.pdf(y[:, None], loc=locs, scale=scales), axis=1)
+    self.assertTrue(np.allclose(predictor.pdf(x, y), p_true))
+    self.assertTrue(np.allclose(predictor.cdf(x, y), np.sum(weights * norm.cdf(y[:, None], loc=locs, scale=scales), axis=1)))
+
+    mean, std = predictor.mean_std(x[:2])
+    self.assertAlmostEqual(mean[0, 0], np.sum(weights * locs))
+    self.assertAlmostEqual(std[0, 0] ** 2, np.sum(weights * (scales ** 2 + locs ** 2)) - np.sum(weights * locs) ** 2)
+    _, samples = predictor.sample(np.zeros(10 ** 5), random_state=22)
+    self.assertAlmostEqual(np.mean(samples), mean[0, 0], delta=0.05)
+
+  def test_flow_predictor(self):
+    # an affine flow of the standard normal -> N(b, exp(a)^2), the data normalization maps it to N(3 + 2b, (2 exp(a))^2)
+    data_statistics = {'X_mean': np.zeros(1), 'X_std': np.ones(1), 'Y_mean': np.array([3.0]), 'Y_std': np.array([2.0])}
+    predictor = NumpyNormalizingFlowPredictor("flow", 1, 1, self.constant_mlp([np.log(0.5), 1.0]), ('affine', 'identity'),
+                                              data_statistics=data_statistics)
+
+    x, y = np.zeros(50), np.linspace(-2, 12, 50)
+    self.assertTrue(np.allclose(predictor.pdf(x, y), norm.pdf(y, loc=5, scale=1), atol=1e-6))
+    self.assertTrue(np.allclose(predictor.cdf(x, y), norm.cdf(y, loc=5, scale=1), atol=1e-6))
+    self.assertAlmostEqual(predictor.mean_(x[:1])[0, 0], 5.0, places=4)
+    self.assertFalse(predictor.can_sample)
+
+class TestMicroBatchServer(unittest.TestCase):
+
+  def get_predictor(self):
+    mlp = NumpyMLP([np.array([[0.5, -1.0, 0.2, 0.3, 0.4, -0.4]])], [np.array([0.0, 1.0, 0.1, -0.2, 0.0, 0.5])], ['identity'])
+    return NumpyMixturePredictor("served", 1, 1, mlp, 2)
+
+  def test_micro_batching(self):
+    predictor = self.get_predictor()
+    X, Y = np.linspace(-2, 2, 200), np.linspace(-3, 3, 200)
+
+    with MicroBatchServer(predictor, max_batch_size=64, max_wait_time=0.05) as server:
+      with ThreadPoolExecutor(max_workers=50) as executor:
+        p = list(executor.map(lambda i: server.pdf(X[i], Y[i]), range(200)))
+        var = list(executor.map(lambda i: server.value_at_risk(X[i], alpha=0.05), range(20)))
+      mixed = [server.submit('cdf', X[:5], Y[:5]), server.submit('value_at_risk', X[:3], alpha=0.1),
+               server.submit('cdf', X[5:7], Y[5:7])]
+    stats = server.stats()  # the server answers all queued requests before it stops
+
+    self.assertTrue(np.allclose(np.concatenate(p), predictor.pdf(X, Y)))
+    self.assertTrue(np.allclose(np.concatenate(var), predictor.value_at_risk(X[:20, None], alpha=0.05)))
+    self.assertTrue(np.allclose(mixed[0].result(), predictor.cdf(X[:5], Y[:5])))
+    self.assertTrue(np.allclose(mixed[1].result(), predictor.value_at_risk(X[:3, None], alpha=0.1)))
+    self.assertEqual(mixed[2].result().shape, (2,))
+
+    # the concurrent requests are coalesced into a few batches of at most max_batch_size rows
+    self.assertEqual(stats['n_requests'], 223)
+    self.assertLess(stats['n_calls'], 50)
+    self.assertLessEqual(stats['mean_batch_size'], 64)
+    self.assertTrue(0 < stats['latency_percentiles'][50] <= stats['latency_percentiles'][99])
+
+  def test_errors(self):
+    with MicroBatchServer(self.get_predictor(), max_wait_time=0.01) as server:
+      future = server.submit('cdf', np.zeros(3), np.zeros(3))
+      # the value at risk of a mixture requires alpha within (0, 1) -> the error is raised in the client only
+      self.assertRaises(AssertionError, server.value_at_risk, np.zeros(2), alpha=2.0)
+      self.assertEqual(server.pdf(0.0, 0.0).shape, (1,))
+      self.assertEqual(future.result().shape, (3,))
+    self.assertRaises(AssertionError, server.pdf, 0.0, 0.0)
+
+class TestCallbacks(unittest.TestCase):
+
+  def test_epoch_timer(self):
+    timer = EpochTimer()
+    with timer.phase('early_stopping'):
+      with timer.phase('eval'):
+        time.sleep(0.05)
+    times = timer.times()
+    self.assertEqual(set(times.keys()), set(PHASES) | {'total'})
+    self.assertGreaterEqual(times['eval'], 0.05)
+    # nested phases are not counted twice
+    self.assertLess(times['early_stopping'], 0.01)
+    self.assertAlmostEqual(sum(times[name] for name in PHASES), times['total'], places=6)
+
+  def test_collectors(self):
+    class _Estimator:
+      name = 'estimator'
+
+    csv_path = os.path.join(tempfile.mkdtemp(), 'throughput.csv')
+    phase_times, throughput, loss_curve = PhaseTimes(), Throughput(CSVSink(csv_path)), LossCurve()
+    for epoch in range(3):
+      times = dict({name: 0.0 for name in PHASES}, session_run=0.5, total=1.0)
+      logs = {'epoch': epoch, 'loss': 3.0 - epoch, 'n_samples': 100, 'times': times}
+      for callback in [phase_times, throughput, loss_curve]:
+        callback.on_epoch_end(_Estimator(), epoch, logs)
+    for callback in [phase_times, throughput, loss_curve]:
+      callback.on_fit_end(_Estimator(), {'n_epochs': 3})
+
+    self.assertEqual(list(loss_curve.sink.to_dataframe()['loss']), [3.0, 2.0, 1.0])
+    self.assertEqual(list(phase_times.sink.to_dataframe()['epoch']), [0, 1, 2])
+    with open(csv_path) as f:
+      rows = list(csv.DictReader(f))
+    self.assertEqual(len(rows), 3)
+    self.assertAlmostEqual(float(rows[0]['examples_per_sec']), 200.0)
+
+class TestEarlyStopping(unittest.TestCase):
+
+  class ParamsDummy:
+    def __init__(self):
+      self.params = np.zeros(2)
+
+    def get_param_values(self):
+      return np.copy(self.params)
+
+    def set_param_values(self, params):
+      self.params = params
+
+  def test_early_stopping_patience(self):
+    estimator = self.ParamsDummy()
+    early_stopping = EarlyStopping(estimator, patience=3, min_delta=0.01, eval_interval=2)
+    self.assertTrue(early_stopping.active)
+
+    losses = [5.0, 4.0, 3.0, 3.005, 3.1, 2.999, 3.2, 1.0]
+    stopped = None
+    for epoch in range(2 * len(losses)):
+      estimator.params = np.ones(2) * epoch
+      if early_stopping.is_eval_epoch(epoch) and early_stopping.update(epoch, losses[epoch // 2]):
+        stopped = epoch
+        break
+
+    # improvements smaller than min_delta do not count -> best loss 3.0 in epoch 4, stopped after 3 more evaluations
+    self.assertEqual(stopped, 10)
+    self.assertEqual(early_stopping.best_epoch, 4)
+    early_stopping.restore_best_params()
+    self.assertTrue(np.all(estimator.params == 4))
+
+  def test_early_stopping_time_budget(self):
+    early_stopping = EarlyStopping(self.ParamsDummy(), max_fit_time=0.0)
+    self.assertTrue(early_stopping.stop(0))
+    self.assertFalse(EarlyStopping(self.ParamsDummy()).active)
+
 class TestDistribution(unittest.TestCase):
 
   def test_multidim_student_t(self):
@@ -200,6 +555,23 @@ class TestDistribution(unittest.TestCase):
 
     self.assertGreaterEqual(p_val, 0.1)
 
+  def test_qmc_uniform(self):
+    from cde.utils.distribution import qmc_uniform
+    sobol = qmc_uniform(4, 2, method='sobol')
+    np.testing.assert_array_almost_equal(sobol, [[0., 0.], [0.5, 0.5], [0.25, 0.75], [0.75, 0.25]])
+
+    halton = qmc_uniform(3, 2, method='halton')
+    np.testing.assert_array_almost_equal(halton, [[1/2, 1/3], [1/4, 2/3], [3/4, 1/9]])
+
+    # chunks of the randomized sequence are consistent with generating the points at once
+    for method in ['sobol', 'halton']:
+      shift = np.random.uniform(size=5)
+      points = qmc_uniform(1000, 5, method=method, shift=shift)
+      chunks = np.concatenate([qmc_uniform(300, 5, method=method, start=start, shift=shift)[:1000 - start]
+                               for start in range(0, 1000, 300)])
+      np.testing.assert_array_almost_equal(points, chunks)
+      self.assertTrue(np.all(points >= 0) and np.all(points < 1))
+
 if __name__ == '__main__':
   warnings.filterwarnings("ignore")
 